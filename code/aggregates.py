@@ -0,0 +1,317 @@
+import os
+import json
+import math
+import numpy as np
+
+AGGREGATES_FILE = "_aggregates.json"
+METRICS = [
+    "compression_ratio",
+    "cost_ratio",
+    "overestimation_ratio"
+]
+# about 1.5 days of l1 blocks per rollup
+BLOCK_RANGE = 10000
+RELATIVE_ACCURACY = 0.005
+
+################################################################################
+# running statistics
+################################################################################
+class RunningStats:
+    # count, mean, variance (welford) and min/max, mergeable across runs
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, x: float):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        self.min = min(self.min, x)
+        self.max = max(self.max, x)
+
+    def merge(self, other):
+        if not other.count:
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def to_dict(self) -> dict:
+        return { "count": self.count, "mean": self.mean, "m2": self.m2, "min": self.min, "max": self.max }
+
+    @classmethod
+    def from_dict(cls, d: dict):
+        stats = cls()
+        stats.count, stats.mean, stats.m2, stats.min, stats.max = d["count"], d["mean"], d["m2"], d["min"], d["max"]
+        return stats
+
+class QuantileSketch:
+    # Log-bucketed histogram (the ddsketch idea): a value lands in bucket
+    # ceil(log_gamma(x)), so any quantile is answered within the relative
+    # accuracy and two sketches merge by adding bucket counts.
+    def __init__(self, relative_accuracy: float=RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zeros = 0
+        self.count = 0
+
+    def add(self, x: float):
+        self.count += 1
+        if x <= 0:
+            self.zeros += 1
+            return
+        k = math.ceil(math.log(x) / self.log_gamma)
+        self.buckets[k] = self.buckets.get(k, 0) + 1
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise Exception("Can't merge sketches with different relative accuracy")
+        for k, n in other.buckets.items():
+            self.buckets[k] = self.buckets.get(k, 0) + n
+        self.zeros += other.zeros
+        self.count += other.count
+        return self
+
+    def value(self, k: int) -> float:
+        # the estimate that is within relative_accuracy of every value in bucket k
+        return 2 * self.gamma ** k / (self.gamma + 1)
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return math.nan
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for k in sorted(self.buckets):
+            seen += self.buckets[k]
+            if rank < seen:
+                return self.value(k)
+        return self.value(max(self.buckets))
+
+    def histogram(self):
+        # bucket edges and counts, enough to draw a histogram without the values.
+        # Bucket k spans (gamma^(k-1), gamma^k], empty buckets between the
+        # smallest and largest key are filled with zero counts so the edges
+        # stay contiguous.
+        if not self.buckets:
+            return np.zeros(0), np.zeros(0, dtype=np.int64)
+        keys = np.arange(min(self.buckets), max(self.buckets) + 1, dtype=np.int64)
+        counts = np.array([self.buckets.get(k, 0) for k in keys.tolist()], dtype=np.int64)
+        edges = self.gamma ** np.append(keys - 1.0, keys[-1])
+        return edges, counts
+
+    def to_dict(self) -> dict:
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "zeros": self.zeros,
+            "buckets": { str(k): n for k, n in sorted(self.buckets.items()) }
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict):
+        sketch = cls(d["relative_accuracy"])
+        sketch.buckets = { int(k): n for k, n in d["buckets"].items() }
+        sketch.zeros = d["zeros"]
+        sketch.count = sketch.zeros + sum(sketch.buckets.values())
+        return sketch
+
+class MetricAggregate:
+    def __init__(self, relative_accuracy: float=RELATIVE_ACCURACY):
+        self.stats = RunningStats()
+        self.sketch = QuantileSketch(relative_accuracy)
+
+    def add(self, x: float):
+        self.stats.add(x)
+        self.sketch.add(x)
+
+    def merge(self, other):
+        self.stats.merge(other.stats)
+        self.sketch.merge(other.sketch)
+        return self
+
+    def quantile(self, q: float) -> float:
+        # the exact min and max tighten the sketch's estimate at the tails
+        return min(max(self.sketch.quantile(q), self.stats.min), self.stats.max)
+
+    def summary(self) -> dict:
+        return {
+            "count": self.stats.count,
+            "mean": self.stats.mean,
+            "std": self.stats.std,
+            "min": self.stats.min,
+            "p01": self.quantile(0.01),
+            "p10": self.quantile(0.1),
+            "median": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "max": self.stats.max
+        }
+
+    def to_dict(self) -> dict:
+        return { "stats": self.stats.to_dict(), "sketch": self.sketch.to_dict() }
+
+    @classmethod
+    def from_dict(cls, d: dict):
+        aggregate = cls()
+        aggregate.stats = RunningStats.from_dict(d["stats"])
+        aggregate.sketch = QuantileSketch.from_dict(d["sketch"])
+        return aggregate
+
+################################################################################
+# simulation aggregates
+################################################################################
+def result_metrics(result: dict) -> dict:
+    return {
+        "compression_ratio": result["compression_ratio"],
+        "cost_ratio": result["cost_ratio"],
+        "overestimation_ratio": result["compression_ratio"] / result["cost_ratio"]
+    }
+
+class Aggregates:
+    # Totals plus one rollup per range of l1 blocks, updated one result at a
+    # time so a run only adds what it simulated. Everything is kept in a small
+    # json file next to the results.
+    def __init__(self, block_range: int=BLOCK_RANGE, relative_accuracy: float=RELATIVE_ACCURACY):
+        self.block_range = block_range
+        self.relative_accuracy = relative_accuracy
+        self.batches = 0
+        self.total = self._metrics()
+        self.rollups = {}
+
+    def _metrics(self) -> dict:
+        return { metric: MetricAggregate(self.relative_accuracy) for metric in METRICS }
+
+    def add(self, result: dict, block: int):
+        start = block - block % self.block_range
+        if start not in self.rollups:
+            self.rollups[start] = self._metrics()
+        for metric, x in result_metrics(result).items():
+            self.total[metric].add(x)
+            self.rollups[start][metric].add(x)
+        self.batches += 1
+
+    def merge(self, other):
+        if other.block_range != self.block_range:
+            raise Exception("Can't merge aggregates with different block ranges")
+        for metric in METRICS:
+            self.total[metric].merge(other.total[metric])
+        for start, metrics in other.rollups.items():
+            if start not in self.rollups:
+                self.rollups[start] = self._metrics()
+            for metric in METRICS:
+                self.rollups[start][metric].merge(metrics[metric])
+        self.batches += other.batches
+        return self
+
+    def summary(self) -> dict:
+        return { metric: self.total[metric].summary() for metric in METRICS }
+
+    def series(self, metric: str, field: str="median"):
+        # (first block of each range, field of the metric in that range)
+        starts = sorted(self.rollups)
+        values = [self.rollups[start][metric].summary()[field] for start in starts]
+        return np.array(starts, dtype=np.int64), np.array(values)
+
+    def save(self, path: str):
+        # written to a temporary file first so an interrupted save keeps the old one
+        with open(f"{path}.tmp", "w+") as f:
+            json.dump({
+                "block_range": self.block_range,
+                "relative_accuracy": self.relative_accuracy,
+                "batches": self.batches,
+                "summary": self.summary(),
+                "total": { metric: self.total[metric].to_dict() for metric in METRICS },
+                "rollups": {
+                    str(start): { metric: metrics[metric].to_dict() for metric in METRICS }
+                    for start, metrics in sorted(self.rollups.items())
+                }
+            }, f)
+        os.replace(f"{path}.tmp", path)
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path, "r") as f:
+            saved = json.load(f)
+        aggregates = cls(saved["block_range"], saved["relative_accuracy"])
+        aggregates.batches = saved["batches"]
+        aggregates.total = { metric: MetricAggregate.from_dict(d) for metric, d in saved["total"].items() }
+        aggregates.rollups = {
+            int(start): { metric: MetricAggregate.from_dict(d) for metric, d in metrics.items() }
+            for start, metrics in saved["rollups"].items()
+        }
+        return aggregates
+
+def rebuild_aggregates(results_dir: str, block_range: int=BLOCK_RANGE, source: str=None) -> Aggregates:
+    # One full pass over existing results, for runs that predate the aggregates.
+    # source is "columns" or "json", by default the columns when they exist.
+    from batch_store import (
+        BatchStore,
+        STORE_DIR
+    )
+    from pipeline import read_json_lines
+    from result_columns import (
+        ResultColumns,
+        COLUMNS_DIR,
+        has_columns
+    )
+
+    if source is None:
+        source = "columns" if has_columns(results_dir) else "json"
+    if source == "columns":
+        columns = ResultColumns(f"{results_dir}/{COLUMNS_DIR}")
+        aggregates = Aggregates(block_range)
+        for compression_ratio, cost_ratio, block in zip(
+            columns["compression_ratio"].tolist(), columns["cost_ratio"].tolist(), columns["block"].tolist()
+        ):
+            aggregates.add({ "compression_ratio": compression_ratio, "cost_ratio": cost_ratio }, block)
+        aggregates.save(f"{results_dir}/{AGGREGATES_FILE}")
+        return aggregates
+
+    store = BatchStore(STORE_DIR)
+    blocks = { store.name(i): int(store.block[i]) for i in range(len(store)) }
+    if os.path.exists(f"{results_dir}/_total_results.jsonl"):
+        results = read_json_lines(f"{results_dir}/_total_results.jsonl")
+    else:
+        # simulate.py writes [name, result] pairs, simulate_batch_compression.py
+        # bare results in batch order
+        with open(f"{results_dir}/_total_results.json", "r") as f:
+            results = json.load(f)
+        nonempty = store.nonempty().tolist()
+        results = [
+            { **entry[1], "batch": entry[0] } if isinstance(entry, list) else { **entry, "batch": store.name(i) }
+            for i, entry in zip(nonempty, results)
+        ]
+    aggregates = Aggregates(block_range)
+    for result in results:
+        aggregates.add(result, blocks[result["batch"]])
+    aggregates.save(f"{results_dir}/{AGGREGATES_FILE}")
+    return aggregates
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Rebuild the aggregates of existing simulation results")
+    parser.add_argument("--results", default="../data/resultsV2",
+        help="directory with result columns, _total_results.jsonl or _total_results.json")
+    parser.add_argument("--block-range", type=int, default=BLOCK_RANGE,
+        help="l1 blocks per rollup")
+    args = parser.parse_args()
+
+    aggregates = rebuild_aggregates(args.results, args.block_range)
+    print(f"Aggregated {aggregates.batches} results into {len(aggregates.rollups)} block ranges")
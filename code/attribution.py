@@ -0,0 +1,125 @@
+from multiprocessing import Pool
+import csv
+import numpy as np
+from calldata_cost import (
+    count_zeros_batches,
+    compute_l1_cost
+)
+from batch_store import (
+    BatchStore,
+    STORE_DIR
+)
+
+FIELDS = [
+    "tx",
+    "size",
+    "n_zeros",
+    "uncompressed_cost",
+    "compressed_size",
+    "compressed_cost",
+    "attributed_cost"
+]
+
+################################################################################
+# per transaction attribution
+################################################################################
+def attribute_transactions(transactions: list, compressor) -> dict:
+    # One streaming compressor is fed the batch's l2 transactions in order and
+    # flushed after each one, so the bytes emitted at a flush are what that
+    # transaction added given everything before it. Every prefix is compressed
+    # once instead of recompressing the batch per transaction.
+    stream = compressor.stream()
+    chunks = []
+    for tx in transactions:
+        chunks.append(stream.process(tx) + stream.flush())
+    tail = stream.finish()
+
+    n_zeros, n_nonzeros, sizes = count_zeros_batches(transactions)
+    chunk_zeros, chunk_nonzeros, chunk_sizes = count_zeros_batches(chunks)
+    compressed_costs = compute_l1_cost(chunk_zeros, chunk_nonzeros)
+
+    # flushing costs a few bytes per boundary, so the marginal costs are rescaled
+    # to add up to the cost of compressing the batch in one shot
+    batch = b"".join(transactions)
+    batch_zeros, batch_nonzeros, _ = count_zeros_batches([compressor.compress(batch)])
+    batch_cost = int(compute_l1_cost(batch_zeros, batch_nonzeros)[0])
+    attributed = int(compressed_costs.sum())
+    streamed_cost = attributed + int(compute_l1_cost(*count_zeros_batches([tail])[:2])[0])
+    scale = batch_cost / attributed if attributed else 0.0
+
+    return {
+        "size": sizes,
+        "n_zeros": n_zeros,
+        "uncompressed_cost": compute_l1_cost(n_zeros, n_nonzeros),
+        "compressed_size": chunk_sizes,
+        "compressed_cost": compressed_costs,
+        "attributed_cost": compressed_costs * scale,
+        "batch_cost": batch_cost,
+        "streamed_cost": streamed_cost
+    }
+
+def attribution_rows(attribution: dict, positions: list=None) -> list:
+    # tx is the transaction's position in the batch's lengths, empty messages
+    # aren't attributed but keep their position
+    positions = positions if positions is not None else range(len(attribution["size"]))
+    return [{
+        "tx": position,
+        **{ field: attribution[field][k].item() for field in FIELDS[1:] }
+    } for k, position in enumerate(positions)]
+
+store = None
+compressor = None
+
+def open_attribution(store_dir: str, batch_compressor):
+    global store, compressor
+    store = BatchStore(store_dir)
+    compressor = batch_compressor
+
+def attribute_batch(i: int):
+    attribution = attribute_transactions(store.l2_transactions(i), compressor)
+    positions = np.flatnonzero(store.lengths(i)).tolist()
+    return store.name(i), attribution_rows(attribution, positions), attribution["batch_cost"], attribution["streamed_cost"]
+
+if __name__ == "__main__":
+    import os
+    import time
+    import argparse
+    from compressors import parse_compressor
+    from pipeline import (
+        bounded_imap_unordered,
+        default_workers
+    )
+
+    parser = argparse.ArgumentParser(description="Attribute each batch's compressed cost to its l2 transactions")
+    parser.add_argument("--compressor", type=parse_compressor, default="brotli",
+        help="streaming compressor and parameters (brotli, zlib or zstd)")
+    parser.add_argument("--output", default="../data/attribution",
+        help="directory for the per-batch attribution tables")
+    parser.add_argument("--window", type=int, default=256,
+        help="maximum number of batches in flight")
+    args = parser.parse_args()
+    os.makedirs(args.output, exist_ok=True)
+
+    start = time.perf_counter()
+    open_attribution(STORE_DIR, args.compressor)
+    batch_ids = store.nonempty().tolist()
+
+    n = default_workers()
+    print(f"Attributing {args.compressor.label} costs in {len(batch_ids)} batches with {n} processes")
+    n_transactions = 0
+    batch_cost = 0
+    streamed_cost = 0
+    with Pool(n, initializer=open_attribution, initargs=(STORE_DIR, args.compressor)) as p:
+        for fname, rows, cost, streamed in bounded_imap_unordered(p, attribute_batch, batch_ids, args.window):
+            with open(f"{args.output}/{fname[:-len('.json')]}.csv", "w+", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=FIELDS)
+                writer.writeheader()
+                writer.writerows(rows)
+            n_transactions += len(rows)
+            batch_cost += cost
+            streamed_cost += streamed
+
+    elapsed = time.perf_counter() - start
+    print(f"Attributed {n_transactions} transactions, {n_transactions / elapsed:.0f} per second")
+    print(f"Flushing at every transaction costs {streamed_cost / max(batch_cost, 1) - 1:.2%} over one-shot compression")
+    print(f"Total time to attribute: {elapsed:.2f} seconds or {elapsed/60.0:.2f} minutes")
@@ -0,0 +1,185 @@
+import os
+import mmap
+import json
+import numpy as np
+from utils import decode_by_function_selector
+from pipeline import (
+    default_workers,
+    start_shared_memory,
+    share_bytes,
+    shared_bytes
+)
+from profiling import (
+    stage,
+    init_worker
+)
+
+TRANSACTIONS_DIR = "../data/transactions"
+STORE_DIR = "../data/batches"
+DATA_FILE = "transactions.bin"
+
+# every column is a plain .npy file so it can be opened with mmap_mode="r"
+COLUMNS = {
+    "batch_index": np.int64,     # index in logs_info.json transaction_hashes
+    "hash": np.uint8,            # l1 transaction hash, stored as (n, 32) bytes
+    "block": np.uint64,          # l1 block number
+    "selector": np.uint32,       # function selector of the batch call
+    "offset": np.uint64,         # start of decoded transactions in DATA_FILE
+    "size": np.uint64,           # length of decoded transactions in DATA_FILE
+    "lengths_offset": np.uint64, # start of this batch's lengths in lengths.npy
+    "lengths_count": np.uint64,  # number of l2 transactions in this batch
+}
+
+################################################################################
+# l2 transactions
+################################################################################
+def split_transactions(transactions: bytes, lengths) -> list:
+    # lengths covers the whole transactions blob, zero lengths are empty
+    # messages and are left out, np.flatnonzero(lengths) maps back to positions
+    ends = np.cumsum(lengths, dtype=np.int64)
+    if len(ends) and ends[-1] != len(transactions):
+        raise Exception(f"lengths sum to {ends[-1]} but transactions has {len(transactions)} bytes")
+    view = memoryview(transactions)
+    starts = ends - np.asarray(lengths, dtype=np.int64)
+    return [view[start:end] for start, end in zip(starts.tolist(), ends.tolist()) if end > start]
+
+################################################################################
+# ingest
+################################################################################
+def list_batch_files(transactions_dir: str=TRANSACTIONS_DIR) -> list:
+    # files are written as {batch_index}_{hash}.json by get_batch_transactions.py
+    batch_files = [f for f in os.listdir(transactions_dir) if f.endswith(".json")]
+    return sorted(batch_files, key=lambda f: int(f.split("_", 1)[0]))
+
+def decode_batch_file(batch_file: str, transactions_dir: str=TRANSACTIONS_DIR):
+    with stage("task"):
+        return _decode_batch_file(batch_file, transactions_dir)
+
+def _decode_batch_file(batch_file: str, transactions_dir: str):
+    with open(f"{transactions_dir}/{batch_file}", "r") as f, stage("json_load"):
+        batch = json.load(f)
+    with stage("hex_decode", len(batch["input"])):
+        calldata = bytes.fromhex(batch["input"][2:])
+    with stage("abi_decode", len(calldata)):
+        decoded_calldata = decode_by_function_selector(calldata)
+    return (
+        int(batch_file.split("_", 1)[0]),
+        bytes.fromhex(batch["hash"][2:]),
+        int(batch["blockNumber"], 16),
+        int(batch["input"][2:10], 16),
+        # only a descriptor goes back to the parent, which writes straight from
+        # shared memory instead of unpickling a copy of every batch
+        share_bytes(decoded_calldata["transactions"]),
+        decoded_calldata["lengths"]
+    )
+
+def ingest(transactions_dir: str=TRANSACTIONS_DIR, store_dir: str=STORE_DIR, n: int=None, profile: dict=None):
+    from multiprocessing import Pool
+    from functools import partial
+
+    batch_files = list_batch_files(transactions_dir)
+    os.makedirs(store_dir, exist_ok=True)
+    n = n or default_workers()
+    # a few tasks per worker at least, so small runs don't end on one straggler
+    chunksize = max(1, min(64, len(batch_files) // (n * 4)))
+    start_shared_memory()
+
+    columns = { name: [] for name in COLUMNS }
+    lengths = []
+    n_lengths = 0
+    offset = 0
+    with open(f"{store_dir}/{DATA_FILE}", "wb") as data, Pool(n, initializer=init_worker, initargs=(profile,)) as p, stage("pool"):
+        decode = partial(decode_batch_file, transactions_dir=transactions_dir)
+        # imap keeps batch order so the data file is laid out in l1 order
+        for batch in p.imap(decode, batch_files, chunksize=chunksize):
+            batch_index, tx_hash, block, selector, descriptor, tx_lengths = batch
+            with shared_bytes(descriptor) as transactions, stage("write", len(transactions)):
+                data.write(transactions)
+            columns["batch_index"].append(batch_index)
+            columns["hash"].append(tx_hash)
+            columns["block"].append(block)
+            columns["selector"].append(selector)
+            columns["offset"].append(offset)
+            columns["size"].append(descriptor[2])
+            columns["lengths_offset"].append(n_lengths)
+            columns["lengths_count"].append(len(tx_lengths))
+            lengths.append(tx_lengths)
+            n_lengths += len(tx_lengths)
+            offset += descriptor[2]
+        p.close()
+        p.join()
+
+    # numpy "S" strings strip trailing zero bytes, so hashes are kept as raw rows
+    columns["hash"] = np.frombuffer(b"".join(columns["hash"]), dtype=np.uint8).reshape(-1, 32)
+    for name, dtype in COLUMNS.items():
+        np.save(f"{store_dir}/{name}.npy", np.asarray(columns[name], dtype=dtype))
+    np.save(f"{store_dir}/lengths.npy", np.concatenate(lengths + [np.zeros(0, dtype=np.uint64)]))
+    return len(batch_files), offset
+
+################################################################################
+# reading
+################################################################################
+class BatchStore:
+    def __init__(self, store_dir: str=STORE_DIR):
+        self.store_dir = store_dir
+        for name in COLUMNS:
+            setattr(self, name, np.load(f"{store_dir}/{name}.npy", mmap_mode="r"))
+        self.all_lengths = np.load(f"{store_dir}/lengths.npy", mmap_mode="r")
+        with open(f"{store_dir}/{DATA_FILE}", "rb") as f:
+            if os.fstat(f.fileno()).st_size:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._mmap = b""
+        self._data = memoryview(self._mmap)
+
+    def __len__(self):
+        return len(self.batch_index)
+
+    def transactions(self, i: int) -> memoryview:
+        start = int(self.offset[i])
+        return self._data[start:start + int(self.size[i])]
+
+    def lengths(self, i: int) -> np.ndarray:
+        start = int(self.lengths_offset[i])
+        return self.all_lengths[start:start + int(self.lengths_count[i])]
+
+    def l2_transactions(self, i: int) -> list:
+        return split_transactions(self.transactions(i), self.lengths(i))
+
+    def tx_hash(self, i: int) -> str:
+        return "0x" + self.hash[i].tobytes().hex()
+
+    def fn_selector(self, i: int) -> str:
+        return f"0x{int(self.selector[i]):08x}"
+
+    def name(self, i: int) -> str:
+        # matches the data/transactions file name so results keep their names
+        return f"{self.batch_index[i]}_{self.tx_hash(i)}.json"
+
+    def nonempty(self) -> np.ndarray:
+        return np.flatnonzero(self.size)
+
+    def close(self):
+        self._data.release()
+        if isinstance(self._mmap, mmap.mmap):
+            self._mmap.close()
+
+if __name__ == "__main__":
+    import time
+    import argparse
+    import profiling
+
+    parser = argparse.ArgumentParser(description="Decode the fetched batch transactions into the batch store")
+    parser.add_argument("--workers", type=int, default=default_workers(),
+        help="decoding processes, one less than the available cores by default")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profile = profiling.settings_from_args("ingest", args)
+
+    start = time.perf_counter()
+    print(f"Ingesting {TRANSACTIONS_DIR} into {STORE_DIR} with {args.workers} processes")
+    n_batches, n_bytes = ingest(n=args.workers, profile=profile)
+    elapsed = time.perf_counter() - start
+    print(f"Ingested {n_batches} batches ({n_bytes} bytes of transactions) in {elapsed:.2f} seconds")
+    if profile is not None:
+        print(f"Profile written to {profiling.finish_run({ 'batches': n_batches, 'bytes': n_bytes })}")
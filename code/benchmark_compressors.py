@@ -0,0 +1,114 @@
+from multiprocessing import Pool
+import time
+from calldata_cost import compute_l1_costs
+from compressors import (
+    parse_compressor,
+    available_compressors
+)
+from batch_store import (
+    BatchStore,
+    STORE_DIR
+)
+
+DEFAULT_COMPRESSORS = [
+    "brotli",
+    "zlib",
+    "lzma",
+    "bz2",
+    "zstd"
+]
+
+def benchmark_calldata(calldata: bytes, compressors: list) -> list:
+    # every backend goes through the same zero byte and l1 cost accounting
+    compressed = []
+    compress_seconds = []
+    decompress_seconds = []
+    for compressor in compressors:
+        start = time.perf_counter()
+        output = compressor.compress(calldata)
+        compress_seconds.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        roundtrip = compressor.decompress(output)
+        decompress_seconds.append(time.perf_counter() - start)
+        if roundtrip != calldata:
+            raise Exception(f"{compressor.label} did not roundtrip")
+        compressed.append(output)
+
+    n_zeros, _, sizes, costs = compute_l1_costs([calldata] + compressed)
+    sizes, costs = sizes.tolist(), costs.tolist()
+    return [
+        (sizes[0], costs[0], sizes[k + 1], costs[k + 1], compress_seconds[k], decompress_seconds[k])
+        for k in range(len(compressors))
+    ]
+
+def summarize(compressor, totals: list, n_batches: int) -> dict:
+    # a selection with no nonempty batches sums to zero everywhere
+    size, cost, compressed_size, compressed_cost, compress_seconds, decompress_seconds = totals
+    return {
+        "compressor": compressor.label,
+        "batches": n_batches,
+        "uncompressed_size": size,
+        "compressed_size": compressed_size,
+        "uncompressed_cost": cost,
+        "compressed_cost": compressed_cost,
+        "compression_ratio": size / max(compressed_size, 1),
+        "cost_ratio": cost / max(compressed_cost, 1),
+        "compress_seconds": compress_seconds,
+        "decompress_seconds": decompress_seconds,
+        "compress_mb_per_s": size / compress_seconds / 1e6 if compress_seconds else 0.0,
+        "decompress_mb_per_s": size / decompress_seconds / 1e6 if decompress_seconds else 0.0
+    }
+
+store = None
+compressors = None
+
+def open_benchmark(store_dir: str, batch_compressors: list):
+    global store, compressors
+    store = BatchStore(store_dir)
+    compressors = batch_compressors
+
+def benchmark_batch(i: int):
+    return benchmark_calldata(bytes(store.transactions(i)), compressors)
+
+if __name__ == "__main__":
+    import json
+    import argparse
+    import numpy as np
+    from pipeline import default_workers
+
+    parser = argparse.ArgumentParser(description="Benchmark compressor backends on sequencer batches")
+    parser.add_argument("compressors", nargs="*",
+        default=[c for c in DEFAULT_COMPRESSORS if c in available_compressors()],
+        help="compressor specs, e.g. brotli:quality=11 zlib:level=9 (default: all installed)")
+    parser.add_argument("--sample", type=int, default=0,
+        help="benchmark an evenly spaced sample of this many batches (default: all)")
+    parser.add_argument("--processes", type=int, default=default_workers(),
+        help="number of worker processes, one less than the available cores by default")
+    parser.add_argument("--output", default="../data/compressor_benchmark.json",
+        help="path of the json report")
+    args = parser.parse_args()
+    batch_compressors = [parse_compressor(spec) for spec in args.compressors]
+
+    open_benchmark(STORE_DIR, batch_compressors)
+    batch_ids = store.nonempty()
+    if args.sample and args.sample < len(batch_ids):
+        batch_ids = batch_ids[np.linspace(0, len(batch_ids) - 1, args.sample).astype(np.int64)]
+    batch_ids = batch_ids.tolist()
+
+    print(f"Benchmarking {len(batch_compressors)} compressors over {len(batch_ids)} batches with {args.processes} processes")
+    totals = [[0, 0, 0, 0, 0.0, 0.0] for _ in batch_compressors]
+    with Pool(args.processes, initializer=open_benchmark, initargs=(STORE_DIR, batch_compressors)) as p:
+        for rows in p.imap_unordered(benchmark_batch, batch_ids, chunksize=8):
+            for total, row in zip(totals, rows):
+                for field, value in enumerate(row):
+                    total[field] += value
+
+    report = [summarize(c, t, len(batch_ids)) for c, t in zip(batch_compressors, totals)]
+    with open(args.output, "w+") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'compressor':<32}{'ratio':>8}{'cost ratio':>12}{'comp MB/s':>12}{'decomp MB/s':>13}")
+    for r in report:
+        print(f"{r['compressor']:<32}{r['compression_ratio']:>8.3f}{r['cost_ratio']:>12.3f}"
+            f"{r['compress_mb_per_s']:>12.2f}{r['decompress_mb_per_s']:>13.2f}")
+    print(f"Report written to {args.output}")
@@ -0,0 +1,84 @@
+import json
+import time
+import numpy as np
+from utils import (
+    abi_decoders,
+    decode_by_function_selector
+)
+from batch_store import (
+    TRANSACTIONS_DIR,
+    list_batch_files
+)
+
+def check_decoded(decoded: dict, reference: dict):
+    # the dedicated decoder must agree with eth_abi on every field
+    if bytes(decoded["transactions"]) != reference["transactions"]:
+        raise Exception("transactions differ from eth_abi")
+    if decoded["lengths"].tolist() != list(reference["lengths"]):
+        raise Exception("lengths differ from eth_abi")
+    if decoded["sectionsMetadata"] != list(reference["sectionsMetadata"]):
+        raise Exception("sectionsMetadata differ from eth_abi")
+    if decoded["afterAcc"] != reference["afterAcc"]:
+        raise Exception("afterAcc differs from eth_abi")
+    if decoded.get("gasRefunder", "").lower() != reference.get("gasRefunder", "").lower():
+        raise Exception("gasRefunder differs from eth_abi")
+
+def time_decoder(decode, inputs: list, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for calldata in inputs:
+            decode(calldata)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the sequencer calldata decoder against eth_abi")
+    parser.add_argument("--sample", type=int, default=200,
+        help="decode an evenly spaced sample of this many batch files (0 for all)")
+    parser.add_argument("--repeat", type=int, default=3,
+        help="timing runs per decoder, the fastest is reported")
+    parser.add_argument("--transactions-dir", default=TRANSACTIONS_DIR)
+    parser.add_argument("--output", default="../data/decoder_benchmark.json",
+        help="path of the json report")
+    args = parser.parse_args()
+
+    batch_files = list_batch_files(args.transactions_dir)
+    if args.sample and args.sample < len(batch_files):
+        batch_files = [batch_files[k] for k in np.linspace(0, len(batch_files) - 1, args.sample).astype(np.int64)]
+    hex_inputs = []
+    for batch_file in batch_files:
+        with open(f"{args.transactions_dir}/{batch_file}", "r") as f:
+            hex_inputs.append(json.load(f)["input"])
+    byte_inputs = [bytes.fromhex(calldata[2:]) for calldata in hex_inputs]
+    n_bytes = sum(len(calldata) for calldata in byte_inputs)
+
+    for calldata, raw in zip(hex_inputs, byte_inputs):
+        reference = abi_decoders[calldata[0:10]](calldata[10:])
+        check_decoded(decode_by_function_selector(calldata), reference)
+        check_decoded(decode_by_function_selector(raw), reference)
+    print(f"Decoded {len(batch_files)} batches ({n_bytes} bytes of calldata), all match eth_abi")
+
+    timings = {
+        "eth_abi (hex)": time_decoder(lambda calldata: abi_decoders[calldata[0:10]](calldata[10:]), hex_inputs, args.repeat),
+        "decoder (hex)": time_decoder(decode_by_function_selector, hex_inputs, args.repeat),
+        "decoder (bytes)": time_decoder(decode_by_function_selector, byte_inputs, args.repeat)
+    }
+    report = [{
+        "decoder": name,
+        "batches": len(batch_files),
+        "calldata_bytes": n_bytes,
+        "seconds": seconds,
+        "mb_per_s": n_bytes / seconds / 1e6,
+        "us_per_batch": 1e6 * seconds / len(batch_files),
+        "speedup": timings["eth_abi (hex)"] / seconds
+    } for name, seconds in timings.items()]
+    with open(args.output, "w+") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'decoder':<20}{'MB/s':>12}{'us/batch':>12}{'speedup':>10}")
+    for r in report:
+        print(f"{r['decoder']:<20}{r['mb_per_s']:>12.1f}{r['us_per_batch']:>12.1f}{r['speedup']:>10.1f}")
+    print(f"Report written to {args.output}")
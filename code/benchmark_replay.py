@@ -0,0 +1,179 @@
+import os
+import time
+import resource
+import numpy as np
+from batch_store import (
+    BatchStore,
+    STORE_DIR
+)
+
+REPLAY_DIR = "../data/replay"
+MAX_OUTPUT = 65536
+
+################################################################################
+# replaying a batch the way a node does
+################################################################################
+def replay_batch(compressed: bytes, transactions, lengths, compressor, max_output: int=MAX_OUTPUT) -> tuple:
+    # Streams the decompressed batch out in chunks of about max_output bytes,
+    # cuts it back into l2 transactions at the lengths boundaries and compares
+    # each against the original, so memory is bounded by one chunk plus the
+    # largest transaction rather than the whole batch. The largest chunk is
+    # returned, since not every backend can hard limit its output.
+    ends = np.cumsum(lengths, dtype=np.int64).tolist()
+    original = memoryview(transactions)
+    pending = bytearray()
+    consumed = 0
+    k = 0
+    n_transactions = 0
+    decompress_seconds = 0.0
+    max_chunk = 0
+    chunks = compressor.decompress_stream(compressed, max_output)
+    while True:
+        start = time.perf_counter()
+        chunk = next(chunks, None)
+        decompress_seconds += time.perf_counter() - start
+        if chunk is None:
+            break
+        max_chunk = max(max_chunk, len(chunk))
+        pending += chunk
+        while k < len(ends) and ends[k] <= consumed + len(pending):
+            n = ends[k] - consumed
+            if n:
+                if pending[:n] != original[consumed:ends[k]]:
+                    raise Exception(f"l2 transaction {k} differs after decompression")
+                n_transactions += 1
+                del pending[:n]
+                consumed = ends[k]
+            k += 1
+    if consumed + len(pending) != len(original) or k != len(ends):
+        raise Exception(f"decompressed {consumed + len(pending)} bytes, expected {len(original)}")
+    return decompress_seconds, n_transactions, max_chunk
+
+store = None
+compressor = None
+compressed = None
+max_output = MAX_OUTPUT
+
+def open_compress(store_dir: str, batch_compressor):
+    global store, compressor
+    store = BatchStore(store_dir)
+    compressor = batch_compressor
+
+def compress_batch(i: int) -> bytes:
+    return compressor.compress(bytes(store.transactions(i)))
+
+def open_replay(store_dir: str, batch_compressor, compressed_path: str, batch_max_output: int):
+    # compressed batches are read from a memory mapped file, like a node
+    # reading them back from l1 calldata, only their positions are passed in
+    global compressed, max_output
+    open_compress(store_dir, batch_compressor)
+    compressed = np.memmap(compressed_path, dtype=np.uint8, mode="r") if os.path.getsize(compressed_path) else np.zeros(0, np.uint8)
+    max_output = batch_max_output
+
+def replay(task: tuple) -> tuple:
+    i, offset, size = task
+    start = time.perf_counter()
+    decompress_seconds, n_transactions, max_chunk = replay_batch(
+        compressed[offset:offset + size], store.transactions(i), store.lengths(i), compressor, max_output
+    )
+    return (
+        int(store.size[i]),
+        n_transactions,
+        decompress_seconds,
+        time.perf_counter() - start,
+        max_chunk,
+        # linux reports ru_maxrss in KiB
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    )
+
+def summarize(rows: list, workers: int, wall_seconds: float, max_output: int=MAX_OUTPUT) -> dict:
+    size, n_transactions, decompress_seconds, latency, max_chunk, max_rss = (np.array(column) for column in zip(*rows))
+    latency_ms = latency * 1e3
+    return {
+        "workers": workers,
+        "batches": len(rows),
+        "l2_transactions": int(n_transactions.sum()),
+        "uncompressed_size": int(size.sum()),
+        "wall_seconds": wall_seconds,
+        # per process decompression speed, and the whole pool's replay speed
+        "decompress_mb_per_s": float(size.sum() / decompress_seconds.sum() / 1e6),
+        "replay_mb_per_s": float(size.sum() / wall_seconds / 1e6),
+        "batches_per_s": len(rows) / wall_seconds,
+        "latency_ms": {
+            "p50": float(np.percentile(latency_ms, 50)),
+            "p90": float(np.percentile(latency_ms, 90)),
+            "p99": float(np.percentile(latency_ms, 99)),
+            "max": float(latency_ms.max())
+        },
+        "max_chunk_bytes": int(max_chunk.max()),
+        "batches_over_max_output": int((max_chunk > max_output).sum()),
+        "peak_worker_rss_bytes": int(max_rss.max())
+    }
+
+if __name__ == "__main__":
+    import json
+    import hashlib
+    import argparse
+    from multiprocessing import Pool
+    from compressors import (
+        parse_compressor,
+        available_compressors
+    )
+    from pipeline import default_workers
+    from sweep import parse_list
+
+    parser = argparse.ArgumentParser(description="Benchmark node side decompression and replay of compressed batches")
+    parser.add_argument("--compressor", type=parse_compressor, default="brotli",
+        help=f"compressor and parameters, e.g. brotli:quality=5 ({', '.join(available_compressors())})")
+    parser.add_argument("--sample", type=int, default=0,
+        help="replay an evenly spaced sample of this many batches (default: all)")
+    parser.add_argument("--workers", type=parse_list, default=[1, default_workers()],
+        help="comma separated worker counts to replay with")
+    parser.add_argument("--max-output", type=int, default=MAX_OUTPUT,
+        help="largest decompressed chunk held at once, in bytes")
+    parser.add_argument("--output", default="../data/replay_benchmark.json",
+        help="path of the json report")
+    args = parser.parse_args()
+
+    open_compress(STORE_DIR, args.compressor)
+    batch_ids = store.nonempty()
+    if args.sample and args.sample < len(batch_ids):
+        batch_ids = batch_ids[np.linspace(0, len(batch_ids) - 1, args.sample).astype(np.int64)]
+    batch_ids = batch_ids.tolist()
+
+    # the batches are compressed once per compressor and sample, then replayed
+    # from disk at every worker count
+    os.makedirs(REPLAY_DIR, exist_ok=True)
+    key = hashlib.sha256(f"{args.compressor.label}:{batch_ids}".encode()).hexdigest()[:16]
+    compressed_path = f"{REPLAY_DIR}/{key}.bin"
+    if not os.path.exists(f"{REPLAY_DIR}/{key}.npy"):
+        print(f"Compressing {len(batch_ids)} batches with {args.compressor.label}")
+        sizes = []
+        with open(compressed_path, "wb") as f, Pool(default_workers(), initializer=open_compress, initargs=(STORE_DIR, args.compressor)) as p:
+            for output in p.imap(compress_batch, batch_ids, chunksize=4):
+                f.write(output)
+                sizes.append(len(output))
+        np.save(f"{REPLAY_DIR}/{key}.npy", np.array(sizes, dtype=np.uint64))
+    sizes = np.load(f"{REPLAY_DIR}/{key}.npy").astype(np.int64)
+    offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
+    tasks = list(zip(batch_ids, offsets.tolist(), sizes.tolist()))
+
+    report = { "compressor": args.compressor.label, "max_output": args.max_output, "compressed_size": int(sizes.sum()), "runs": [] }
+    for workers in args.workers:
+        print(f"Replaying {len(tasks)} batches with {workers} processes")
+        with Pool(workers, initializer=open_replay, initargs=(STORE_DIR, args.compressor, compressed_path, args.max_output)) as p:
+            start = time.perf_counter()
+            rows = p.map(replay, tasks, chunksize=4)
+            wall_seconds = time.perf_counter() - start
+        report["runs"].append(summarize(rows, workers, wall_seconds, args.max_output))
+    report["main_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    with open(args.output, "w+") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'workers':>8}{'decomp MB/s':>13}{'replay MB/s':>13}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}{'max chunk KiB':>15}{'peak RSS MiB':>14}")
+    for r in report["runs"]:
+        print(f"{r['workers']:>8}{r['decompress_mb_per_s']:>13.1f}{r['replay_mb_per_s']:>13.1f}"
+            f"{r['latency_ms']['p50']:>9.2f}{r['latency_ms']['p99']:>9.2f}{r['latency_ms']['max']:>9.2f}"
+            f"{r['max_chunk_bytes'] / 2**10:>15.1f}{r['peak_worker_rss_bytes'] / 2**20:>14.1f}")
+    print(f"Report written to {args.output}")
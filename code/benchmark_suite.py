@@ -0,0 +1,237 @@
+import os
+import json
+import time
+import tempfile
+import eth_abi
+import numpy as np
+from utils import (
+    arg_types,
+    selectors,
+    decode_by_function_selector
+)
+from batch_store import split_transactions
+
+EXAMPLE_BATCH = "../data/example_batch.txt"
+BENCHMARK_DIR = "../data/benchmarks"
+# bumped whenever the report layout changes, so comparisons can refuse mismatches
+REPORT_VERSION = 1
+SIZES = [16384, 65536, 262144]
+SEED = 0
+
+################################################################################
+# synthetic corpus
+################################################################################
+def example_transactions(path: str=EXAMPLE_BATCH) -> list:
+    with open(path, "r") as f:
+        decoded = decode_by_function_selector(f.read().strip())
+    return [bytes(tx) for tx in split_transactions(decoded["transactions"], decoded["lengths"])]
+
+def store_transactions(n_batches: int, seed: int) -> list:
+    # templates from the real corpus when the batch store exists
+    from batch_store import (
+        BatchStore,
+        STORE_DIR
+    )
+    from dictionary import sample_batch_ids
+
+    store = BatchStore(STORE_DIR)
+    return [bytes(tx) for i in sample_batch_ids(store, n_batches, seed) for tx in store.l2_transactions(i)]
+
+def mutate_transaction(template: bytes, rng, fraction: float=0.1) -> bytes:
+    # Rewrites a fraction of the nonzero bytes and the whole signature, so
+    # synthetic batches keep the template's zero byte density and layout but
+    # don't compress better than real traffic by repeating it verbatim.
+    data = np.frombuffer(template, dtype=np.uint8).copy()
+    nonzero = np.flatnonzero(data)
+    picked = nonzero[rng.random(len(nonzero)) < fraction]
+    data[picked] = rng.integers(1, 256, len(picked), dtype=np.uint8)
+    if len(data) > 65:
+        data[-65:] = rng.integers(0, 256, 65, dtype=np.uint8)
+    return data.tobytes()
+
+def encode_batch(transactions: list, gas_refunder: bool, rng) -> bytes:
+    # real addSequencerL2BatchFromOrigin* calldata, as the sequencer posts it
+    k = 0 if gas_refunder else 1
+    sections_metadata = [len(transactions), 13318918 + int(rng.integers(1e6)), 1633000000 + int(rng.integers(1e7)), 0, 0]
+    args = [b"".join(transactions), [len(tx) for tx in transactions], sections_metadata, rng.bytes(32)]
+    if gas_refunder:
+        args.append("0x" + rng.bytes(20).hex())
+    return bytes.fromhex(selectors[k][2:]) + eth_abi.encode_abi(arg_types[k], args)
+
+def synthetic_batch(templates: list, size: int, rng) -> bytes:
+    transactions = []
+    total = 0
+    while total < size:
+        tx = mutate_transaction(templates[int(rng.integers(len(templates)))], rng)
+        transactions.append(tx)
+        total += len(tx)
+    return encode_batch(transactions, bool(rng.integers(2)), rng)
+
+def synthetic_corpus(templates: list, sizes: list, batches_per_size: int, seed: int=SEED) -> dict:
+    # the same seed and templates always give byte-identical batches
+    rng = np.random.default_rng(seed)
+    return { size: [synthetic_batch(templates, size, rng) for _ in range(batches_per_size)] for size in sizes }
+
+################################################################################
+# timing
+################################################################################
+def time_runs(fn, repeat: int) -> list:
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+def record(name: str, size: int, workers: int, seconds: list, n_bytes: int, n_ops: int) -> dict:
+    best = min(seconds)
+    return {
+        "benchmark": name,
+        "size": size,
+        "workers": workers,
+        "seconds_best": best,
+        "seconds_median": float(np.median(seconds)),
+        "mb_per_s": n_bytes / best / 1e6 if n_bytes else None,
+        "ops_per_s": n_ops / best
+    }
+
+def benchmark_size(size: int, calldatas: list, compressors: list, repeat: int) -> list:
+    from calldata_cost import count_zeros
+    from simulate import analyze_calldata
+    from result_columns import ResultColumnsWriter
+
+    hex_calldatas = ["0x" + calldata.hex() for calldata in calldatas]
+    decoded = [decode_by_function_selector(calldata) for calldata in calldatas]
+    transactions = [bytes(d["transactions"]) for d in decoded]
+    n_calldata = sum(len(c) for c in calldatas)
+    n_transactions = sum(len(t) for t in transactions)
+    n = len(calldatas)
+
+    rows = [
+        record("decode_hex", size, 1, time_runs(lambda: [decode_by_function_selector(c) for c in hex_calldatas], repeat), n_calldata, n),
+        record("decode_bytes", size, 1, time_runs(lambda: [decode_by_function_selector(c) for c in calldatas], repeat), n_calldata, n),
+        record("count_zeros", size, 1, time_runs(lambda: [count_zeros(t) for t in transactions], repeat), n_transactions, n)
+    ]
+    for compressor in compressors:
+        rows.append(record(f"compress:{compressor.label}", size, 1,
+            time_runs(lambda: [compressor.compress(t) for t in transactions], repeat), n_transactions, n))
+    results = [analyze_calldata((t, f"{k}.json"))[1] for k, t in enumerate(transactions)]
+    rows.append(record("analyze_calldata", size, 1,
+        time_runs(lambda: [analyze_calldata((t, f"{k}.json")) for k, t in enumerate(transactions)], repeat), n_transactions, n))
+
+    def write_columns():
+        with tempfile.TemporaryDirectory() as d, ResultColumnsWriter(f"{d}/columns") as columns:
+            for k, result in enumerate(results):
+                columns.append(k, k, result)
+
+    def write_json():
+        with tempfile.TemporaryDirectory() as d:
+            for k, result in enumerate(results):
+                with open(f"{d}/{k}.json", "w+") as f:
+                    json.dump(result, f, indent=2)
+
+    rows.append(record("write_columns", size, 1, time_runs(write_columns, repeat), 0, n))
+    rows.append(record("write_json", size, 1, time_runs(write_json, repeat), 0, n))
+    return rows
+
+def analyze_calldata_worker(transactions: bytes):
+    from simulate import analyze_calldata
+    return analyze_calldata((transactions, ""))[1]
+
+def benchmark_workers(size: int, transactions: list, workers: list, repeat: int) -> list:
+    from multiprocessing import Pool
+
+    rows = []
+    n_bytes = sum(len(t) for t in transactions)
+    for w in workers:
+        with Pool(w) as p:
+            # warm up so worker start and imports aren't timed
+            p.map(analyze_calldata_worker, transactions[:w])
+            seconds = time_runs(lambda: p.map(analyze_calldata_worker, transactions), repeat)
+        rows.append(record("analyze_pool", size, w, seconds, n_bytes, len(transactions)))
+    return rows
+
+def compare_reports(report: dict, baseline: dict):
+    if baseline.get("version") != report["version"]:
+        raise Exception(f"Report versions differ: {baseline.get('version')} vs {report['version']}")
+    before = { (r["benchmark"], r["size"], r["workers"]): r for r in baseline["results"] }
+    print(f"{'benchmark':<44}{'size':>8}{'workers':>8}{'before':>12}{'after':>12}{'speedup':>9}")
+    for r in report["results"]:
+        b = before.get((r["benchmark"], r["size"], r["workers"]))
+        if b is None:
+            continue
+        print(f"{r['benchmark']:<44}{r['size']:>8}{r['workers']:>8}{b['seconds_best']:>12.5f}"
+            f"{r['seconds_best']:>12.5f}{b['seconds_best'] / r['seconds_best']:>9.2f}")
+
+if __name__ == "__main__":
+    import sys
+    import argparse
+    import platform
+    from profiling import git_commit
+    from compressors import (
+        parse_compressor,
+        available_compressors
+    )
+    from sweep import parse_list
+
+    parser = argparse.ArgumentParser(description="Benchmark the hot paths on a deterministic synthetic batch corpus")
+    parser.add_argument("--sizes", type=parse_list, default=SIZES,
+        help="comma separated l2 transaction bytes per synthetic batch")
+    parser.add_argument("--batches", type=int, default=16,
+        help="synthetic batches per size")
+    parser.add_argument("--workers", type=parse_list, default=[1, 2, 4, 8],
+        help="comma separated worker counts for the pool benchmark")
+    parser.add_argument("--compressor", action="append", type=parse_compressor, default=None,
+        help="compressor spec to time, e.g. brotli:quality=5,lgwin=20, repeat for more "
+            "(default: brotli, zlib and zstd when installed)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--templates", choices=["auto", "example", "store"], default="auto",
+        help="sample transactions from the batch store, data/example_batch.txt, or the store when it exists")
+    parser.add_argument("--label", default=None,
+        help="report name (default: the current commit)")
+    parser.add_argument("--compare", default=None,
+        help="earlier report to compare against")
+    args = parser.parse_args()
+
+    from batch_store import STORE_DIR
+    source = args.templates
+    if source == "auto":
+        source = "store" if os.path.exists(f"{STORE_DIR}/size.npy") else "example"
+    templates = store_transactions(32, args.seed) if source == "store" else example_transactions()
+    print(f"Building {args.batches} synthetic batches per size from {len(templates)} {source} transactions")
+    corpus = synthetic_corpus(templates, args.sizes, args.batches, args.seed)
+    compressors = args.compressor or [parse_compressor(c) for c in ["brotli", "zlib", "zstd"] if c in available_compressors()]
+
+    results = []
+    for size, calldatas in corpus.items():
+        print(f"Timing {size} byte batches")
+        results += benchmark_size(size, calldatas, compressors, args.repeat)
+        transactions = [bytes(decode_by_function_selector(c)["transactions"]) for c in calldatas]
+        results += benchmark_workers(size, transactions, [w for w in args.workers if w <= (os.cpu_count() or 1)], args.repeat)
+
+    commit = git_commit()
+    report = {
+        "version": REPORT_VERSION,
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "seed": args.seed,
+        "templates": source,
+        "batches_per_size": args.batches,
+        "results": results
+    }
+    os.makedirs(BENCHMARK_DIR, exist_ok=True)
+    path = f"{BENCHMARK_DIR}/{args.label or (commit or 'local')[:12]}.json"
+    with open(path, "w+") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    print(f"{'benchmark':<44}{'size':>8}{'workers':>8}{'best s':>12}{'MB/s':>10}{'ops/s':>10}")
+    for r in results:
+        print(f"{r['benchmark']:<44}{r['size']:>8}{r['workers']:>8}{r['seconds_best']:>12.5f}"
+            f"{r['mb_per_s'] or 0:>10.1f}{r['ops_per_s']:>10.1f}")
+    print(f"Report written to {path}")
+    if args.compare:
+        with open(args.compare, "r") as f:
+            compare_reports(report, json.load(f))
@@ -0,0 +1,32 @@
+import numpy as np
+
+################################################################################
+# l1 calldata gas accounting
+################################################################################
+ZERO_BYTE_GAS = 4
+NONZERO_BYTE_GAS = 16
+
+def as_uint8(calldata) -> np.ndarray:
+    # zero-copy view over bytes, bytearray, memoryview or mmap slices
+    return np.frombuffer(calldata, dtype=np.uint8)
+
+def count_zeros(calldata: bytes):
+    size = len(calldata)
+    n_nonzeros = int(np.count_nonzero(as_uint8(calldata)))
+    return size - n_nonzeros, n_nonzeros, size
+
+def compute_l1_cost(n_zeros, n_nonzeros):
+    # works on plain ints as well as numpy arrays of counts
+    return (ZERO_BYTE_GAS * n_zeros) + (NONZERO_BYTE_GAS * n_nonzeros)
+
+def count_zeros_batches(batches: list):
+    n = len(batches)
+    sizes = np.fromiter((len(b) for b in batches), dtype=np.int64, count=n)
+    n_nonzeros = np.fromiter(
+        (np.count_nonzero(as_uint8(b)) for b in batches), dtype=np.int64, count=n
+    )
+    return sizes - n_nonzeros, n_nonzeros, sizes
+
+def compute_l1_costs(batches: list):
+    n_zeros, n_nonzeros, sizes = count_zeros_batches(batches)
+    return n_zeros, n_nonzeros, sizes, compute_l1_cost(n_zeros, n_nonzeros)
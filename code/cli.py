@@ -0,0 +1,114 @@
+import sys
+import time
+
+# one entry point for the pipeline, each command only imports its own script
+COMMANDS = {
+    "fetch-logs": ("get_batch_logs", "scan for SequencerBatchDeliveredFromOrigin logs"),
+    "fetch-txs": ("get_batch_transactions", "fetch the batch transactions listed in logs_info.json"),
+    "ingest": ("batch_store", "decode the fetched transactions into the batch store"),
+    "simulate": ("simulate", "simulate compression of every batch in the store"),
+    "follow": ("follow", "simulate new batches as they land"),
+    "plot": ("plot_data", "plot the simulation results"),
+    "startup": (None, "measure import and pool worker start times, and check the precomputed selectors and topics")
+}
+
+# modules timed by startup, and the dependencies that should stay unloaded
+STARTUP_MODULES = ["utils", "compressors", "batch_store", "simulate", "follow", "cli"]
+HEAVY_MODULES = ["eth_abi", "requests", "aiohttp", "Crypto", "dotenv", "matplotlib"]
+
+def run_command(command: str, argv: list):
+    # the script runs as __main__ with its own argument parser, as if started directly
+    import runpy
+    module = COMMANDS[command][0]
+    sys.argv = [f"{module}.py"] + argv
+    runpy.run_module(module, run_name="__main__", alter_sys=True)
+
+################################################################################
+# startup time
+################################################################################
+def import_seconds(module: str) -> tuple:
+    # a fresh interpreter each time, so nothing is already imported
+    import json
+    import subprocess
+    code = (
+        "import sys, time, json\n"
+        "start = time.perf_counter()\n"
+        f"import {module}\n"
+        "seconds = time.perf_counter() - start\n"
+        f"print(json.dumps([seconds, sorted(m for m in {HEAVY_MODULES} if m in sys.modules)]))"
+    )
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    return tuple(json.loads(output.strip().splitlines()[-1]))
+
+def noop(_):
+    return None
+
+def worker_start_seconds(module: str, workers: int) -> float:
+    # spawned workers import everything themselves, unlike forked ones
+    import importlib
+    from multiprocessing import get_context
+
+    start = time.perf_counter()
+    with get_context("spawn").Pool(workers, initializer=importlib.import_module, initargs=(module,)) as p:
+        p.map(noop, range(workers), chunksize=1)
+    return time.perf_counter() - start
+
+def measure_startup(repeat: int, workers: int) -> dict:
+    import statistics
+    modules = {}
+    for module in STARTUP_MODULES:
+        runs = [import_seconds(module) for _ in range(repeat)]
+        modules[module] = {
+            "import_ms": 1e3 * statistics.median(seconds for seconds, _ in runs),
+            "heavy_modules": runs[-1][1]
+        }
+    return {
+        "python": sys.version.split()[0],
+        "modules": modules,
+        "workers": workers,
+        "spawn_pool_ms": 1e3 * statistics.median(worker_start_seconds("simulate", workers) for _ in range(repeat))
+    }
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Run a pipeline step: " + ", ".join(f"{c} ({d})" for c, (_, d) in COMMANDS.items()),
+        usage="cli.py [--timing] {" + ",".join(COMMANDS) + "} [args ...]"
+    )
+    parser.add_argument("--timing", action="store_true",
+        help="print how long the command took to import and run")
+    parser.add_argument("command", choices=list(COMMANDS))
+    parser.add_argument("args", nargs=argparse.REMAINDER,
+        help="arguments for the command, see cli.py <command> --help")
+    args = parser.parse_args()
+
+    if args.command == "startup":
+        import json
+        from utils import check_selectors
+        from get_batch_logs import check_topics
+        startup_parser = argparse.ArgumentParser(prog="cli.py startup", description=COMMANDS["startup"][1])
+        startup_parser.add_argument("--repeat", type=int, default=5)
+        startup_parser.add_argument("--workers", type=int, default=4,
+            help="spawned workers importing simulate")
+        startup_parser.add_argument("--output", default=None,
+            help="also write the measurements to this json file")
+        startup_args = startup_parser.parse_args(args.args)
+        # the constants that replaced hashing at import must still match their signatures
+        check_selectors()
+        check_topics()
+        report = measure_startup(startup_args.repeat, startup_args.workers)
+        print(f"{'module':<16}{'import ms':>11}  heavy dependencies loaded")
+        for module, m in report["modules"].items():
+            print(f"{module:<16}{m['import_ms']:>11.1f}  {', '.join(m['heavy_modules']) or '-'}")
+        print(f"{report['workers']} spawned workers importing simulate: {report['spawn_pool_ms']:.1f} ms")
+        if startup_args.output:
+            with open(startup_args.output, "w+") as f:
+                json.dump(report, f, indent=2)
+    else:
+        start = time.perf_counter()
+        try:
+            run_command(args.command, args.args)
+        finally:
+            if args.timing:
+                print(f"{args.command}: {time.perf_counter() - start:.3f} seconds", file=sys.stderr)
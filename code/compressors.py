@@ -0,0 +1,315 @@
+import bz2
+import lzma
+import zlib
+import hashlib
+import brotli
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+################################################################################
+# registry
+################################################################################
+COMPRESSORS = {}
+
+def register(cls):
+    COMPRESSORS[cls.name] = cls
+    return cls
+
+def available_compressors() -> list:
+    return [name for name, cls in COMPRESSORS.items() if cls.available()]
+
+def get_compressor(name: str, **params):
+    if name not in COMPRESSORS:
+        raise Exception(f"Unknown compressor: {name}, expected one of {list(COMPRESSORS)}")
+    if not COMPRESSORS[name].available():
+        raise Exception(f"Compressor {name} is not installed")
+    return COMPRESSORS[name](**params)
+
+def parse_compressor(spec: str):
+    # "brotli" or "brotli:quality=5,lgwin=20"
+    name, _, params = spec.partition(":")
+    kwargs = {}
+    for param in filter(None, params.split(",")):
+        key, _, value = param.partition("=")
+        kwargs[key] = int(value)
+    return get_compressor(name, **kwargs)
+
+class Compressor:
+    # backends only keep plain parameters so instances pickle into pool workers
+    name = None
+    defaults = {}
+    supports_dictionary = False
+
+    def __init__(self, dictionary: bytes=None, **params):
+        unknown = set(params) - set(self.defaults)
+        if unknown:
+            raise Exception(f"Unknown {self.name} parameters: {sorted(unknown)}")
+        if dictionary is not None and not self.supports_dictionary:
+            raise Exception(f"Compressor {self.name} does not support dictionaries")
+        self.params = { **self.defaults, **params }
+        self.dictionary = dictionary
+
+    def with_dictionary(self, dictionary: bytes):
+        return type(self)(dictionary=dictionary, **self.params)
+
+    @classmethod
+    def available(cls) -> bool:
+        return True
+
+    @property
+    def label(self) -> str:
+        params = ",".join(f"{k}={v}" for k, v in sorted(self.params.items()))
+        label = f"{self.name}:{params}" if params else self.name
+        if self.dictionary is not None:
+            label += f"+dict:{hashlib.sha256(self.dictionary).hexdigest()[:8]}"
+        return label
+
+    def compress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+    def decompress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+    def decompress_stream(self, data: bytes, max_output: int):
+        # yields the decompressed data in chunks of at most max_output bytes,
+        # backends without a bounded decoder yield it whole
+        yield self.decompress(data)
+
+    @property
+    def window_size(self) -> int:
+        # how far back matches can reach, which a streaming decoder has to keep
+        return None
+
+    def stream(self):
+        # an incremental compressor with process(data), flush() and finish(),
+        # where flush() emits every byte needed to decode the input so far
+        raise Exception(f"Compressor {self.name} does not support streaming")
+
+################################################################################
+# streaming adapters, shaped like brotli.Compressor
+################################################################################
+class ZlibStream:
+    def __init__(self, level: int, wbits: int, **dictionary):
+        self._c = zlib.compressobj(level, zlib.DEFLATED, wbits, **dictionary)
+
+    def process(self, data: bytes) -> bytes:
+        return self._c.compress(data)
+
+    def flush(self) -> bytes:
+        return self._c.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._c.flush(zlib.Z_FINISH)
+
+class ZstdStream:
+    def __init__(self, cctx):
+        self._c = cctx.compressobj()
+
+    def process(self, data: bytes) -> bytes:
+        return self._c.compress(data)
+
+    def flush(self) -> bytes:
+        return self._c.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self._c.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+def bounded_decompress(d, data: bytes, max_output: int):
+    # for lzma and bz2 decompressors, which take max_length and buffer the rest
+    chunk = d.decompress(data, max_output)
+    while True:
+        if chunk:
+            yield chunk
+        if d.eof or d.needs_input:
+            break
+        chunk = d.decompress(b"", max_output)
+
+################################################################################
+# backends
+################################################################################
+@register
+class BrotliCompressor(Compressor):
+    name = "brotli"
+    defaults = { "quality": 11, "lgwin": 22, "mode": brotli.MODE_GENERIC }
+    supports_dictionary = True
+
+    # The python brotli bindings have no custom dictionary api, so a dictionary
+    # is modeled as a shared stream prefix: the dictionary is compressed and
+    # flushed first, and only the bytes emitted after that count as the batch.
+    # A decoder that has seen the same prefix reproduces the batch exactly.
+    # Compressor state can't be copied, so every compress and stream call
+    # compresses the whole dictionary again at the configured quality. For a
+    # 64KiB dictionary at quality 11 that is most of the time spent per batch,
+    # so timings with a dictionary mostly measure priming. The prefix bytes
+    # the decoder needs are only computed once.
+    def _primed(self):
+        c = brotli.Compressor(**self.params)
+        prefix = c.process(self.dictionary) + c.flush()
+        if getattr(self, "_prefix", None) is None:
+            self._prefix = prefix
+        return c, prefix
+
+    def _primed_prefix(self) -> bytes:
+        if getattr(self, "_prefix", None) is None:
+            self._primed()
+        return self._prefix
+
+    @property
+    def window_size(self) -> int:
+        return (1 << self.params["lgwin"]) - 16
+
+    def compress(self, data: bytes) -> bytes:
+        if self.dictionary is None:
+            return brotli.compress(data, **self.params)
+        c, _ = self._primed()
+        return c.process(data) + c.finish()
+
+    def stream(self):
+        if self.dictionary is None:
+            return brotli.Compressor(**self.params)
+        return self._primed()[0]
+
+    def decompress(self, data: bytes) -> bytes:
+        if self.dictionary is None:
+            return brotli.decompress(data)
+        d = brotli.Decompressor()
+        d.process(self._primed_prefix())
+        return d.process(data)
+
+    def decompress_stream(self, data: bytes, max_output: int):
+        d = brotli.Decompressor()
+        if self.dictionary is not None:
+            d.process(self._primed_prefix())
+        if hasattr(d, "can_accept_more_data"):
+            # brotli 1.2 stops growing its output buffer once it reaches
+            # max_output, which it grows in blocks of about 32KiB, so a chunk
+            # can overshoot by up to one block. The rest comes out of further
+            # calls with empty input.
+            chunk = d.process(data, output_buffer_limit=max_output)
+            while chunk:
+                yield chunk
+                if d.is_finished():
+                    return
+                chunk = d.process(b"", output_buffer_limit=max_output)
+            return
+        # Brotli 1.0's Decompressor has no output limit, so the input is fed in
+        # slices sized from the ratio seen so far, aiming each chunk at half of
+        # max_output. A slice can still expand past it where the ratio jumps,
+        # so there the bound is best effort, benchmark_replay.py reports the
+        # largest chunk actually produced.
+        step = max(1, max_output // 16)
+        start = 0
+        while start < len(data):
+            chunk = d.process(data[start:start + step])
+            start += step
+            if chunk:
+                yield chunk
+            step = max(1, min(max_output, step * max_output // (2 * max(len(chunk), 1))))
+
+@register
+class ZlibCompressor(Compressor):
+    # raw deflate by default (wbits=-15), without the zlib header and checksum
+    name = "zlib"
+    defaults = { "level": 9, "wbits": -15 }
+    supports_dictionary = True
+
+    def _dictionary(self) -> dict:
+        # deflate can only reach back 32KiB, so only the tail of a dictionary is used
+        return {} if self.dictionary is None else { "zdict": self.dictionary[-32768:] }
+
+    @property
+    def window_size(self) -> int:
+        # raw (-15), zlib (15) and gzip (31) framings all use a 32KiB window
+        return 1 << (abs(self.params["wbits"]) & 15)
+
+    def compress(self, data: bytes) -> bytes:
+        c = zlib.compressobj(self.params["level"], zlib.DEFLATED, self.params["wbits"], **self._dictionary())
+        return c.compress(data) + c.flush()
+
+    def stream(self):
+        return ZlibStream(self.params["level"], self.params["wbits"], **self._dictionary())
+
+    def decompress(self, data: bytes) -> bytes:
+        d = zlib.decompressobj(self.params["wbits"], **self._dictionary())
+        return d.decompress(data) + d.flush()
+
+    def decompress_stream(self, data: bytes, max_output: int):
+        d = zlib.decompressobj(self.params["wbits"], **self._dictionary())
+        while True:
+            chunk = d.decompress(data, max_output)
+            data = d.unconsumed_tail
+            if chunk:
+                yield chunk
+            if not data and len(chunk) < max_output:
+                break
+        chunk = d.flush()
+        if chunk:
+            yield chunk
+
+@register
+class LzmaCompressor(Compressor):
+    # raw lzma2 stream, so container headers don't count against the cost
+    name = "lzma"
+    defaults = { "preset": 9 }
+
+    def _filters(self):
+        return [{ "id": lzma.FILTER_LZMA2, "preset": self.params["preset"] }]
+
+    def compress(self, data: bytes) -> bytes:
+        return lzma.compress(data, format=lzma.FORMAT_RAW, filters=self._filters())
+
+    def decompress(self, data: bytes) -> bytes:
+        return lzma.decompress(data, format=lzma.FORMAT_RAW, filters=self._filters())
+
+    def decompress_stream(self, data: bytes, max_output: int):
+        yield from bounded_decompress(lzma.LZMADecompressor(format=lzma.FORMAT_RAW, filters=self._filters()), data, max_output)
+
+@register
+class Bz2Compressor(Compressor):
+    name = "bz2"
+    defaults = { "compresslevel": 9 }
+
+    def compress(self, data: bytes) -> bytes:
+        return bz2.compress(data, **self.params)
+
+    def decompress(self, data: bytes) -> bytes:
+        return bz2.decompress(data)
+
+    def decompress_stream(self, data: bytes, max_output: int):
+        yield from bounded_decompress(bz2.BZ2Decompressor(), data, max_output)
+
+@register
+class ZstdCompressor(Compressor):
+    name = "zstd"
+    defaults = { "level": 19 }
+    supports_dictionary = True
+
+    @classmethod
+    def available(cls) -> bool:
+        return zstandard is not None
+
+    def _dictionary(self) -> dict:
+        if self.dictionary is None:
+            return {}
+        return { "dict_data": zstandard.ZstdCompressionDict(self.dictionary) }
+
+    @property
+    def window_size(self) -> int:
+        # streams have no content size, so the level's default window applies
+        return 1 << zstandard.ZstdCompressionParameters.from_level(self.params["level"]).window_log
+
+    def compress(self, data: bytes) -> bytes:
+        return zstandard.ZstdCompressor(level=self.params["level"], **self._dictionary()).compress(data)
+
+    def stream(self):
+        return ZstdStream(zstandard.ZstdCompressor(level=self.params["level"], **self._dictionary()))
+
+    def decompress(self, data: bytes) -> bytes:
+        # streamed frames carry no content size, which one-shot decompress() needs
+        return zstandard.ZstdDecompressor(**self._dictionary()).decompressobj().decompress(data)
+
+    def decompress_stream(self, data: bytes, max_output: int):
+        yield from zstandard.ZstdDecompressor(**self._dictionary()).read_to_iter(data, write_size=max_output)
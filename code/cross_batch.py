@@ -0,0 +1,152 @@
+from multiprocessing import Pool
+import csv
+from calldata_cost import compute_l1_costs
+from batch_store import (
+    BatchStore,
+    STORE_DIR
+)
+
+# batches per compressor context, 1 only shares nothing but the stream framing
+RESETS = [1, 8, 64, 512]
+
+FIELDS = [
+    "reset_batches",
+    "streams",
+    "batches",
+    "uncompressed_size",
+    "independent_size",
+    "stream_size",
+    "independent_gas",
+    "stream_gas",
+    "gas_vs_independent",
+    "decoder_state_bytes",
+    "max_blocks_held"
+]
+
+store = None
+compressor = None
+
+def open_cross_batch(store_dir: str, batch_compressor):
+    global store, compressor
+    store = BatchStore(store_dir)
+    compressor = batch_compressor
+
+def independent_batches(batch_ids: list) -> list:
+    # the baseline, every batch compressed on its own like analyze_calldata does
+    transactions = [bytes(store.transactions(i)) for i in batch_ids]
+    _, _, sizes, costs = compute_l1_costs(transactions + [compressor.compress(t) for t in transactions])
+    sizes, costs = sizes.tolist(), costs.tolist()
+    n = len(batch_ids)
+    return [(i, sizes[k], costs[k], sizes[n + k], costs[n + k]) for k, i in enumerate(batch_ids)]
+
+def stream_batches(batch_ids: list) -> list:
+    # One stream in l1 order, flushed at every batch boundary. The bytes each
+    # flush emits are what that batch would post, and a node decodes them with
+    # the decoder state left by the batches before it. The stream is never
+    # finished, the next context simply starts a new one.
+    stream = compressor.stream()
+    outputs = [stream.process(bytes(store.transactions(i))) + stream.flush() for i in batch_ids]
+    _, _, sizes, costs = compute_l1_costs(outputs)
+    return list(zip(batch_ids, sizes.tolist(), costs.tolist()))
+
+def summarize(reset: int, segments: list, independent: dict, streamed: dict, window_size: int) -> dict:
+    batch_ids = list(independent)
+    independent_gas = sum(independent[i][3] for i in batch_ids)
+    stream_gas = sum(streamed[i][1] for i in batch_ids)
+    # a node keeps the window, or the whole stream when that's shorter
+    longest = max(sum(independent[i][0] for i in segment) for segment in segments)
+    return {
+        "reset_batches": reset,
+        "streams": len(segments),
+        "batches": len(batch_ids),
+        "uncompressed_size": sum(independent[i][0] for i in batch_ids),
+        "independent_size": sum(independent[i][2] for i in batch_ids),
+        "stream_size": sum(streamed[i][0] for i in batch_ids),
+        "independent_gas": independent_gas,
+        "stream_gas": stream_gas,
+        "gas_vs_independent": stream_gas / max(independent_gas, 1),
+        "decoder_state_bytes": min(window_size, longest) if window_size else longest,
+        "max_blocks_held": max(int(store.block[s[-1]]) - int(store.block[s[0]]) for s in segments)
+    }
+
+if __name__ == "__main__":
+    import os
+    import time
+    import argparse
+    from compressors import parse_compressor
+    from result_columns import (
+        ResultColumnsWriter,
+        COLUMNS_DIR
+    )
+    from pipeline import (
+        bounded_imap_unordered,
+        default_workers,
+        size_aware_chunks
+    )
+    from sweep import parse_list
+
+    parser = argparse.ArgumentParser(description="Compress batches through long lived streams that keep context across batches")
+    parser.add_argument("--reset", type=parse_list, default=RESETS,
+        help="comma separated batches per compressor context, 0 for one context over every batch")
+    parser.add_argument("--compressor", type=parse_compressor, default="brotli",
+        help="streaming compressor and parameters (brotli, zlib or zstd)")
+    parser.add_argument("--workers", type=int, default=default_workers(),
+        help="compression processes, each stream runs in one")
+    parser.add_argument("--window", type=int, default=64,
+        help="maximum number of streams in flight")
+    parser.add_argument("--output", default="../data/cross_batch",
+        help="directory for the per-batch columns and the summary")
+    args = parser.parse_args()
+    os.makedirs(args.output, exist_ok=True)
+
+    start = time.perf_counter()
+    open_cross_batch(STORE_DIR, args.compressor)
+    batch_ids = store.nonempty().tolist()
+    n = args.workers
+
+    print(f"Compressing {len(batch_ids)} batches independently with {args.compressor.label}")
+    independent = {}
+    with Pool(n, initializer=open_cross_batch, initargs=(STORE_DIR, args.compressor)) as p:
+        chunks = size_aware_chunks(batch_ids, store.size[batch_ids].tolist(), n)
+        for rows in bounded_imap_unordered(p, independent_batches, chunks, args.window):
+            independent.update((row[0], row[1:]) for row in rows)
+    # keep l1 order, the summaries iterate over it
+    independent = { i: independent[i] for i in batch_ids }
+
+    totals = []
+    for reset in args.reset:
+        step = reset or len(batch_ids)
+        segments = [batch_ids[k:k + step] for k in range(0, len(batch_ids), step)]
+        print(f"Streaming {len(segments)} contexts of {step} batches")
+        streamed = {}
+        with Pool(n, initializer=open_cross_batch, initargs=(STORE_DIR, args.compressor)) as p:
+            for rows in bounded_imap_unordered(p, stream_batches, segments, args.window):
+                streamed.update((row[0], row[1:]) for row in rows)
+
+        # per-batch numbers next to the independent ones, for plotting
+        with ResultColumnsWriter(f"{args.output}/reset_{reset}/{COLUMNS_DIR}", truncate=True) as columns:
+            for i in batch_ids:
+                size, cost, independent_size, independent_cost = independent[i]
+                stream_size, stream_cost = streamed[i]
+                columns.append(int(store.batch_index[i]), int(store.block[i]), {
+                    "uncompressed_size": size,
+                    "uncompressed_cost": cost,
+                    "independent_size": independent_size,
+                    "independent_cost": independent_cost,
+                    "stream_size": stream_size,
+                    "stream_cost": stream_cost,
+                    "gas_saving": 1 - stream_cost / independent_cost
+                })
+        totals.append(summarize(reset, segments, independent, streamed, args.compressor.window_size))
+
+    with open(f"{args.output}/_summary.csv", "w+", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(totals)
+    for total in totals:
+        print(f"reset {total['reset_batches'] or 'never'}: {total['stream_gas']} gas "
+            f"({total['gas_vs_independent']:.2%} of independent), "
+            f"decoder keeps {total['decoder_state_bytes'] / 2**10:,.1f} KiB over up to {total['max_blocks_held']} blocks")
+
+    elapsed = time.perf_counter() - start
+    print(f"Total time: {elapsed:.2f} seconds or {elapsed/60.0:.2f} minutes")
@@ -0,0 +1,197 @@
+import json
+import hashlib
+from collections import Counter
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DICTIONARY_DIR = "../data/dictionaries"
+METHODS = ["ngram", "zstd"]
+
+################################################################################
+# sampling
+################################################################################
+def sample_batch_ids(store, n_samples: int, seed: int=0) -> list:
+    # seeded so the same store always yields the same training set
+    batch_ids = store.nonempty()
+    if n_samples >= len(batch_ids):
+        return batch_ids.tolist()
+    rng = np.random.default_rng(seed)
+    return np.sort(rng.choice(batch_ids, n_samples, replace=False)).tolist()
+
+def training_samples(store, batch_ids: list) -> list:
+    # individual l2 transactions make better samples than whole batches
+    return [bytes(tx) for i in batch_ids for tx in store.l2_transactions(i)]
+
+################################################################################
+# training
+################################################################################
+def sample_grams(sample: bytes, width: int) -> np.ndarray:
+    # the distinct width byte substrings of a sample, packed big endian into
+    # uint64 so they sort like the bytes and take 8 bytes each instead of a
+    # bytes object per position
+    data = np.frombuffer(sample, dtype=np.uint8)
+    n = len(data) - width + 1
+    if n <= 0:
+        return np.zeros(0, dtype=np.uint64)
+    grams = np.zeros(n, dtype=np.uint64)
+    for k in range(width):
+        grams = (grams << np.uint64(8)) | data[k:k + n]
+    return np.unique(grams)
+
+def merge_gram_counts(keys: np.ndarray, counts: np.ndarray, pending: list, max_grams: int) -> tuple:
+    # Adds the pending per-sample grams to the running counts. Past max_grams
+    # only the most common are kept, so memory stays bounded on large samples
+    # at the cost of undercounting grams that were dropped and seen again.
+    all_keys = np.concatenate([keys] + pending)
+    all_counts = np.concatenate([counts] + [np.ones(len(grams), dtype=np.int64) for grams in pending])
+    keys, inverse = np.unique(all_keys, return_inverse=True)
+    counts = np.bincount(inverse, weights=all_counts, minlength=len(keys)).astype(np.int64)
+    if len(keys) > max_grams:
+        top = np.sort(np.argpartition(-counts, max_grams)[:max_grams])
+        keys, counts = keys[top], counts[top]
+    return keys, counts
+
+def pack_grams(grams: list, size: int, width: int) -> bytes:
+    # Shifted copies of the same common region rank alike, and each would take
+    # width bytes. A gram that overlaps the end or start of a packed segment by
+    # width - 1 bytes extends it by one byte instead, and grams a segment
+    # already contains are skipped.
+    segments = []
+    ends = {}
+    starts = {}
+    covered = set()
+    total = 0
+    for gram in grams:
+        if gram in covered:
+            continue
+        k = ends.pop(gram[:-1], None)
+        if k is not None:
+            if total + 1 > size:
+                break
+            segments[k] += gram[-1:]
+        else:
+            k = starts.pop(gram[1:], None)
+            if k is not None:
+                if total + 1 > size:
+                    break
+                segments[k][:0] = gram[:1]
+        if k is None:
+            if total + width > size:
+                break
+            k = len(segments)
+            segments.append(bytearray(gram))
+            total += width
+        else:
+            total += 1
+        ends[bytes(segments[k][-(width - 1):])] = k
+        starts[bytes(segments[k][:width - 1])] = k
+        covered.add(gram)
+    # most common last, so they sit closest to the data being compressed
+    return b"".join(bytes(segment) for segment in reversed(segments))
+
+def train_ngram_dictionary(samples: list, size: int, width: int=8, max_grams: int=1 << 22) -> bytes:
+    # the same idea as the n-gram frequency experiment in example_simulation.py:
+    # rank substrings by how many samples contain them and pack the best ones
+    if not 1 < width <= 8:
+        raise Exception(f"n-gram width must be between 2 and 8, got {width}")
+    keys = np.zeros(0, dtype=np.uint64)
+    counts = np.zeros(0, dtype=np.int64)
+    pending = []
+    n_pending = 0
+    for sample in samples:
+        grams = sample_grams(sample, width)
+        pending.append(grams)
+        n_pending += len(grams)
+        if n_pending >= max_grams:
+            keys, counts = merge_gram_counts(keys, counts, pending, max_grams)
+            pending = []
+            n_pending = 0
+    keys, counts = merge_gram_counts(keys, counts, pending, max_grams)
+
+    # by count, then by the bytes themselves so ties pack deterministically
+    order = np.lexsort((keys, -counts))
+    order = order[counts[order] >= 2]
+    grams = [int(key).to_bytes(width, "big") for key in keys[order[:size]].tolist()]
+    return pack_grams(grams, size, width)
+
+def train_dictionary(samples: list, size: int, method: str="ngram") -> bytes:
+    if method == "ngram":
+        return train_ngram_dictionary(samples, size)
+    if method == "zstd":
+        if zstandard is None:
+            raise Exception("zstd dictionaries require the zstandard package")
+        return zstandard.train_dictionary(size, samples).as_bytes()
+    raise Exception(f"Unknown dictionary method: {method}, expected one of {METHODS}")
+
+################################################################################
+# results
+################################################################################
+def dictionary_gain(result: dict, size: int, cost: int) -> dict:
+    # gains are relative to the same compressor without the dictionary
+    return {
+        "dictionary_compressed_size": size,
+        "dictionary_compressed_cost": cost,
+        "dictionary_compression_ratio": result["uncompressed_size"] / size,
+        "dictionary_cost_ratio": result["uncompressed_cost"] / cost,
+        "dictionary_size_gain": 1 - size / result["compressed_size"],
+        "dictionary_gas_gain": 1 - cost / result["compressed_cost"]
+    }
+
+################################################################################
+# storage
+################################################################################
+def save_dictionary(path: str, dictionary: bytes, info: dict):
+    with open(path, "wb") as f:
+        f.write(dictionary)
+    # the sidecar records everything needed to retrain the same dictionary
+    with open(f"{path}.json", "w+") as f:
+        json.dump({ **info, "sha256": hashlib.sha256(dictionary).hexdigest() }, f, indent=2)
+
+def load_dictionary(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+if __name__ == "__main__":
+    import os
+    import time
+    import argparse
+    from batch_store import (
+        BatchStore,
+        STORE_DIR
+    )
+
+    parser = argparse.ArgumentParser(description="Train a shared compression dictionary from the batch store")
+    parser.add_argument("--method", choices=METHODS, default="ngram",
+        help="ngram builds a raw content dictionary for brotli/zlib, zstd trains a zstd dictionary")
+    parser.add_argument("--size", type=int, default=64 * 1024,
+        help="dictionary size in bytes")
+    parser.add_argument("--samples", type=int, default=500,
+        help="number of historical batches to sample")
+    parser.add_argument("--seed", type=int, default=0,
+        help="seed for the batch sample")
+    parser.add_argument("--output", default=None,
+        help=f"dictionary path (default: {DICTIONARY_DIR}/<method>_<size>_<seed>.dict)")
+    args = parser.parse_args()
+    output = args.output or f"{DICTIONARY_DIR}/{args.method}_{args.size}_{args.seed}.dict"
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+
+    start = time.perf_counter()
+    store = BatchStore(STORE_DIR)
+    batch_ids = sample_batch_ids(store, args.samples, args.seed)
+    samples = training_samples(store, batch_ids)
+    print(f"Training a {args.method} dictionary from {len(samples)} l2 transactions in {len(batch_ids)} batches")
+    dictionary = train_dictionary(samples, args.size, args.method)
+    save_dictionary(output, dictionary, {
+        "method": args.method,
+        "size": args.size,
+        "seed": args.seed,
+        "store": STORE_DIR,
+        "batch_ids": batch_ids
+    })
+
+    elapsed = time.perf_counter() - start
+    print(f"Wrote a {len(dictionary)} byte dictionary to {output} in {elapsed:.2f} seconds")
@@ -0,0 +1,184 @@
+import json
+from collections import deque
+import numpy as np
+from calldata_cost import as_uint8
+
+FEATURES = [
+    "intercept",
+    "size",
+    "n_zeros",
+    "matched",
+    "repeated",
+    "entropy_bits"
+]
+
+# rough starting point so the estimator is usable before calibration,
+# running this script fits coefficients for the actual compressor
+DEFAULT_COEFFICIENTS = [40.0, 8.0, -6.0, -6.0, -4.0, 1.5]
+
+################################################################################
+# online compressed cost estimator
+################################################################################
+class CompressedSizeEstimator:
+    # Predicts the l1 gas a transaction adds to a compressed batch from cheap
+    # statistics: zero bytes, byte entropy and how many of its 4-byte sequences
+    # already appeared in a rolling window of recent batch bytes. The window is
+    # a counting hash table, so lookups and updates are a few numpy operations.
+    def __init__(self, coefficients: list=None, window: int=1 << 16, table_bits: int=20):
+        self.coefficients = np.array(coefficients or DEFAULT_COEFFICIENTS, dtype=np.float64)
+        self.window = window
+        self.table_bits = table_bits
+        self.reset()
+
+    def reset(self):
+        self.counts = np.zeros(1 << self.table_bits, dtype=np.uint32)
+        self.history = deque()
+        self.history_size = 0
+
+    def _grams(self, data: np.ndarray) -> np.ndarray:
+        if len(data) < 4:
+            return np.zeros(0, dtype=np.uint32)
+        a = data.astype(np.uint32)
+        grams = a[:-3] | (a[1:-2] << 8) | (a[2:-1] << 16) | (a[3:] << 24)
+        # multiplicative hashing into the table
+        return (grams * np.uint32(2654435761)) >> np.uint32(32 - self.table_bits)
+
+    def features(self, tx: bytes) -> np.ndarray:
+        data = as_uint8(tx)
+        size = len(data)
+        hashes = self._grams(data)
+        matched = int(np.count_nonzero(self.counts[hashes]))
+        unique, occurrences = np.unique(hashes, return_counts=True)
+        repeated = len(hashes) - len(unique)
+        histogram = np.bincount(data, minlength=256)
+        p = histogram[histogram > 0] / max(size, 1)
+        entropy_bits = float(-(p * np.log2(p)).sum()) * size
+
+        # slide the window forward over this transaction's bytes, the indices
+        # are unique so plain fancy indexing is enough
+        self.counts[unique] += occurrences.astype(np.uint32)
+        self.history.append((unique, occurrences, size))
+        self.history_size += size
+        while self.history_size > self.window and len(self.history) > 1:
+            old_unique, old_occurrences, old_size = self.history.popleft()
+            self.counts[old_unique] -= old_occurrences.astype(np.uint32)
+            self.history_size -= old_size
+
+        return np.array([1.0, size, size - np.count_nonzero(data), matched, repeated, entropy_bits])
+
+    def estimate(self, tx: bytes) -> float:
+        return max(float(self.features(tx) @ self.coefficients), 0.0)
+
+    def save(self, path: str):
+        with open(path, "w+") as f:
+            json.dump({
+                "features": FEATURES,
+                "coefficients": self.coefficients.tolist(),
+                "window": self.window,
+                "table_bits": self.table_bits
+            }, f, indent=2)
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path, "r") as f:
+            saved = json.load(f)
+        return cls(saved["coefficients"], saved["window"], saved["table_bits"])
+
+def fit_coefficients(features: np.ndarray, targets: np.ndarray) -> list:
+    return np.linalg.lstsq(features, targets, rcond=None)[0].tolist()
+
+def prediction_error(predicted: np.ndarray, targets: np.ndarray) -> dict:
+    errors = predicted - targets
+    total = targets.sum()
+    return {
+        "mean_absolute_error": float(np.abs(errors).mean()),
+        "relative_error_per_tx": float(np.abs(errors).sum() / total) if total else 0.0,
+        "relative_error_total": float(errors.sum() / total) if total else 0.0,
+        "r2": float(1 - (errors ** 2).sum() / ((targets - targets.mean()) ** 2).sum())
+    }
+
+################################################################################
+# calibration harness
+################################################################################
+store = None
+compressor = None
+estimator_args = None
+
+def open_calibration(store_dir: str, batch_compressor, window: int, table_bits: int):
+    global store, compressor, estimator_args
+    from batch_store import BatchStore
+
+    store = BatchStore(store_dir)
+    compressor = batch_compressor
+    estimator_args = (window, table_bits)
+
+def calibration_batch(i: int):
+    from attribution import attribute_transactions
+
+    transactions = store.l2_transactions(i)
+    targets = attribute_transactions(transactions, compressor)["attributed_cost"]
+    # the estimator context starts empty with each batch, like the compressor's
+    estimator = CompressedSizeEstimator(None, *estimator_args)
+    features = np.array([estimator.features(tx) for tx in transactions]).reshape(-1, len(FEATURES))
+    return features, targets
+
+if __name__ == "__main__":
+    import time
+    import argparse
+    from multiprocessing import Pool
+    from batch_store import STORE_DIR
+    from compressors import parse_compressor
+    from dictionary import sample_batch_ids
+    from pipeline import default_workers
+
+    parser = argparse.ArgumentParser(description="Calibrate and benchmark the per-transaction compressed cost estimator")
+    parser.add_argument("--compressor", type=parse_compressor, default="brotli",
+        help="streaming compressor whose per-transaction costs are the ground truth")
+    parser.add_argument("--samples", type=int, default=400,
+        help="number of batches to sample, half for fitting and half for evaluation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--window", type=int, default=1 << 16,
+        help="rolling window of recent bytes in the estimator")
+    parser.add_argument("--table-bits", type=int, default=20)
+    parser.add_argument("--output", default="../data/estimator.json",
+        help="where to save the fitted estimator")
+    args = parser.parse_args()
+
+    open_calibration(STORE_DIR, args.compressor, args.window, args.table_bits)
+    batch_ids = sample_batch_ids(store, args.samples, args.seed)
+    print(f"Computing {args.compressor.label} ground truth for {len(batch_ids)} batches")
+    start = time.perf_counter()
+    n = default_workers()
+    with Pool(n, initializer=open_calibration, initargs=(STORE_DIR, args.compressor, args.window, args.table_bits)) as p:
+        batches = p.map(calibration_batch, batch_ids)
+    truth_seconds = time.perf_counter() - start
+
+    # alternate batches so both halves span the whole history
+    train = batches[0::2]
+    test = batches[1::2] or batches
+    coefficients = fit_coefficients(
+        np.concatenate([f for f, _ in train]), np.concatenate([t for _, t in train])
+    )
+    estimator = CompressedSizeEstimator(coefficients, args.window, args.table_bits)
+    estimator.save(args.output)
+
+    test_features = np.concatenate([f for f, _ in test])
+    test_targets = np.concatenate([t for _, t in test])
+    print("Coefficients:", dict(zip(FEATURES, np.round(coefficients, 3).tolist())))
+    for name, value in prediction_error(test_features @ np.array(coefficients), test_targets).items():
+        print(f"{name}: {value:.4f}")
+
+    # throughput of the online path: features plus the dot product, per transaction
+    n_transactions = 0
+    start = time.perf_counter()
+    for i in batch_ids[1::2] or batch_ids:
+        estimator.reset()
+        for tx in store.l2_transactions(i):
+            estimator.estimate(tx)
+            n_transactions += 1
+    estimate_seconds = time.perf_counter() - start
+    n_truth = sum(len(t) for _, t in batches)
+    print(f"Estimator: {n_transactions / estimate_seconds:.0f} transactions/sec "
+        f"({1e6 * estimate_seconds / max(n_transactions, 1):.1f} us each)")
+    print(f"{args.compressor.label} attribution: {n_truth / truth_seconds:.0f} transactions/sec across {n} processes")
+    print(f"Estimator saved to {args.output}")
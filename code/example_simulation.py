@@ -1,15 +1,8 @@
 from brotli import compress
-
-def count_zeros(calldata: bytes):
-    num = 0
-    for i in range(len(calldata)):
-        if calldata[i] == 0:
-            num += 1
-    return num, len(calldata) - num
-
-def compute_l1_cost(calldata: bytes):
-    n_zeros, n_nonzeros = count_zeros(calldata)
-    return (4 * n_zeros) + (16 * n_nonzeros)
+from calldata_cost import (
+    count_zeros,
+    compute_l1_cost
+)
 
 def print_calldata(calldata: bytes):
     size = len(calldata)
@@ -32,9 +25,8 @@ def analyze_calldata(calldata: bytes, compressed: bool=False, verbose: bool=True
         print("===================== uncompressed calldata ====================")
     elif verbose:
         print("======================= compressed calldata ====================")
-    n_zeros, n_nonzeros = count_zeros(calldata)
-    size = len(calldata)
-    cost = compute_l1_cost(calldata)
+    n_zeros, n_nonzeros, size = count_zeros(calldata)
+    cost = compute_l1_cost(n_zeros, n_nonzeros)
     if verbose:
         print_data("number of zero bytes", n_zeros)
         print_data("number of non-zero bytes", n_nonzeros)
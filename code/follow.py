@@ -0,0 +1,312 @@
+import os
+import json
+import asyncio
+from utils import (
+    AsyncProvider,
+    decode_by_function_selector
+)
+from simulate import analyze_calldata
+from get_batch_logs import (
+    sequencer_batch_delivered_from_origin,
+    is_range_too_large,
+    FIRST_BLOCK,
+    STEP
+)
+from get_batch_transactions import (
+    CHECKPOINT_FILE,
+    BATCH_SIZE,
+    load_checkpoint,
+    save_checkpoint
+)
+from aggregates import (
+    Aggregates,
+    AGGREGATES_FILE,
+    BLOCK_RANGE,
+    rebuild_aggregates
+)
+from result_columns import (
+    ResultColumnsWriter,
+    COLUMNS_DIR
+)
+
+FOLLOW_STATE = "_follow.json"
+POLL_SECONDS = 12
+REORG_DEPTH = 12
+# blocks scanned per poll while catching up, so a long gap isn't one huge poll
+CATCH_UP_BLOCKS = 10 * STEP
+
+def save_json(path: str, data: dict):
+    with open(f"{path}.tmp", "w+") as f:
+        json.dump(data, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+def simulate_transaction(transaction: dict, name: str, compressor=None):
+    # runs in a worker process, returns None for batches with no l2 transactions
+    transactions = decode_by_function_selector(transaction["input"])["transactions"]
+    if not len(transactions):
+        return None
+    return analyze_calldata((bytes(transactions), name), compressor)[1]
+
+################################################################################
+# following the chain head
+################################################################################
+class Follower:
+    # Polls for SequencerBatchDeliveredFromOrigin logs past the last processed
+    # block, fetches and simulates only the new batches, and appends them to
+    # logs_info.json, the transaction files, the result columns and the
+    # aggregates, in chain order. Batches in the last reorg_depth blocks are
+    # rechecked on every poll. When one has left the chain or moved to a
+    # different block hash, it and every later batch are rolled back and
+    # recorded again from the canonical logs.
+    def __init__(
+        self,
+        provider,
+        executor,
+        output: str,
+        transactions_dir: str,
+        logs_info_path: str,
+        compressor,
+        reorg_depth: int=REORG_DEPTH,
+        step: int=STEP,
+        block_range: int=BLOCK_RANGE
+    ):
+        self.provider = provider
+        self.executor = executor
+        self.output = output
+        self.transactions_dir = transactions_dir
+        self.logs_info_path = logs_info_path
+        self.compressor = compressor
+        self.reorg_depth = reorg_depth
+        self.step = step
+        self.block_range = block_range
+        os.makedirs(output, exist_ok=True)
+        os.makedirs(transactions_dir, exist_ok=True)
+
+        self.logs_info = { "transaction_hashes": [] }
+        if os.path.exists(logs_info_path):
+            with open(logs_info_path, "r") as f:
+                self.logs_info = json.load(f)
+        self.transaction_hashes = self.logs_info["transaction_hashes"]
+        self.known = set(self.transaction_hashes)
+
+        self.state_path = f"{output}/{FOLLOW_STATE}"
+        if os.path.exists(self.state_path):
+            with open(self.state_path, "r") as f:
+                self.state = json.load(f)
+        else:
+            self.state = { "next_block": self.logs_info.get("to_block", FIRST_BLOCK - 1) + 1, "recent": [] }
+
+        # an interruption between saves can leave results for batches that
+        # logs_info.json doesn't list yet, they are recorded again
+        self.columns = ResultColumnsWriter(f"{output}/{COLUMNS_DIR}")
+        self.columns.truncate_batches(len(self.transaction_hashes))
+        self.aggregates_path = f"{output}/{AGGREGATES_FILE}"
+        self.aggregates = Aggregates(self.block_range)
+        if os.path.exists(self.aggregates_path):
+            self.aggregates = Aggregates.load(self.aggregates_path)
+        if self.aggregates.batches != self.columns.rows:
+            self.aggregates = rebuild_aggregates(output, self.block_range)
+
+    async def get_logs(self, from_block: int, to_block: int) -> list:
+        logs = []
+        for start in range(from_block, to_block + 1, self.step):
+            logs += await self.get_logs_window(start, min(start + self.step - 1, to_block))
+        return sorted(logs, key=lambda log: (int(log["blockNumber"], 16), int(log["logIndex"], 16)))
+
+    async def get_logs_window(self, from_block: int, to_block: int) -> list:
+        response = await self.provider.get_logs(from_block, to_block, sequencer_batch_delivered_from_origin)
+        if response.get("error") is None:
+            return response["result"]
+        if not is_range_too_large(response["error"]) or from_block == to_block:
+            raise Exception(f"eth_getLogs {(from_block, to_block)} failed: {response['error']}")
+        middle = (from_block + to_block) // 2
+        return await self.get_logs_window(from_block, middle) + await self.get_logs_window(middle + 1, to_block)
+
+    async def get_transactions(self, transaction_hashes: list) -> list:
+        transactions = []
+        for k in range(0, len(transaction_hashes), BATCH_SIZE):
+            chunk = transaction_hashes[k:k + BATCH_SIZE]
+            for transaction_hash, response in zip(chunk, await self.provider.get_transactions_by_hash(chunk)):
+                if not response.get("result"):
+                    # not served yet, the whole poll is retried
+                    raise Exception(f"No result for {transaction_hash}: {response.get('error')}")
+                transactions.append(response["result"])
+        return transactions
+
+    def rollback(self, block: int) -> int:
+        # batches are recorded in chain order, so everything from block on is a suffix
+        rolled_back = [r for r in self.state["recent"] if r["block"] >= block]
+        if not rolled_back:
+            return 0
+        first = min(r["batch_index"] for r in rolled_back)
+        for index in range(first, len(self.transaction_hashes)):
+            path = f"{self.transactions_dir}/{index}_{self.transaction_hashes[index]}.json"
+            if os.path.exists(path):
+                os.remove(path)
+            self.known.discard(self.transaction_hashes[index])
+        del self.transaction_hashes[first:]
+        # the checkpoint is appended to as batches are recorded, so the rolled
+        # back indexes have to leave it before their replacements are appended
+        save_checkpoint(self.transactions_dir, [i for i in load_checkpoint(self.transactions_dir) if i < first])
+        self.state["recent"] = [r for r in self.state["recent"] if r["block"] < block]
+        self.state["next_block"] = min(self.state["next_block"], block)
+        if self.columns.truncate_batches(first):
+            self.aggregates = rebuild_aggregates(self.output, self.block_range)
+        return len(rolled_back)
+
+    async def poll(self) -> dict:
+        latest = await self.provider.block_number()
+        to_block = min(latest, self.state["next_block"] + CATCH_UP_BLOCKS - 1)
+        recheck_from = max(FIRST_BLOCK, self.state["next_block"] - self.reorg_depth)
+        if to_block < recheck_from:
+            return { "latest": latest, "to_block": to_block, "recorded": 0, "rolled_back": 0 }
+        logs = await self.get_logs(recheck_from, to_block)
+
+        canonical = set((log["transactionHash"], log["blockHash"]) for log in logs)
+        stale = [r for r in self.state["recent"] if r["block"] >= recheck_from and (r["hash"], r["block_hash"]) not in canonical]
+        # batches from first on are replaced, but nothing on disk changes until
+        # their replacements have been fetched and simulated
+        rollback_block = min(r["block"] for r in stale) if stale else None
+        first = len(self.transaction_hashes)
+        if stale:
+            first = min(r["batch_index"] for r in self.state["recent"] if r["block"] >= rollback_block)
+        replaced = set(self.transaction_hashes[first:])
+
+        new_logs = []
+        seen = set()
+        for log in logs:
+            transaction_hash = log["transactionHash"]
+            if (transaction_hash not in self.known or transaction_hash in replaced) and transaction_hash not in seen:
+                seen.add(transaction_hash)
+                new_logs.append(log)
+        transactions = await self.get_transactions([log["transactionHash"] for log in new_logs])
+        loop = asyncio.get_running_loop()
+        names = [f"{first + k}_{log['transactionHash']}.json" for k, log in enumerate(new_logs)]
+        results = await asyncio.gather(*(
+            loop.run_in_executor(self.executor, simulate_transaction, transaction, name, self.compressor)
+            for transaction, name in zip(transactions, names)
+        ))
+
+        rolled_back = self.rollback(rollback_block) if stale else 0
+        with open(f"{self.transactions_dir}/{CHECKPOINT_FILE}", "a") as checkpoint:
+            for log, transaction, name, result in zip(new_logs, transactions, names, results):
+                self.record(log, transaction, name, result, checkpoint)
+
+        self.state["next_block"] = to_block + 1
+        self.state["recent"] = [r for r in self.state["recent"] if r["block"] > to_block - self.reorg_depth]
+        self.save(to_block)
+        return { "latest": latest, "to_block": to_block, "recorded": len(new_logs), "rolled_back": rolled_back }
+
+    def record(self, log: dict, transaction: dict, name: str, result: dict, checkpoint):
+        batch_index = len(self.transaction_hashes)
+        block = int(log["blockNumber"], 16)
+        with open(f"{self.transactions_dir}/{name}", "w+") as f:
+            json.dump(transaction, f, indent=2)
+        checkpoint.write(f"{batch_index}\n")
+        self.transaction_hashes.append(log["transactionHash"])
+        self.known.add(log["transactionHash"])
+        if result is not None:
+            self.columns.append(batch_index, block, result)
+            self.aggregates.add(result, block)
+        self.state["recent"].append({
+            "block": block,
+            "block_hash": log["blockHash"],
+            "hash": log["transactionHash"],
+            "batch_index": batch_index
+        })
+
+    def save(self, to_block: int):
+        # results first, then the batch list, then the cursor, so a restart
+        # never skips a batch
+        self.columns.flush()
+        self.aggregates.save(self.aggregates_path)
+        self.logs_info.pop("log_topic", None)
+        self.logs_info.update({
+            "event_topic": sequencer_batch_delivered_from_origin,
+            "total_batches": len(self.transaction_hashes),
+            "from_block": self.logs_info.get("from_block", FIRST_BLOCK),
+            "to_block": to_block,
+            "transaction_hashes": self.transaction_hashes
+        })
+        save_json(self.logs_info_path, self.logs_info)
+        save_json(self.state_path, self.state)
+
+    def close(self):
+        self.columns.close()
+
+async def follow(follower: Follower, poll_seconds: float=POLL_SECONDS, max_polls: int=None):
+    polls = 0
+    while max_polls is None or polls < max_polls:
+        polls += 1
+        try:
+            poll = await follower.poll()
+        except Exception as e:
+            # fetching and simulating finish before anything on disk changes,
+            # so a provider hiccup leaves the last saved state to retry from
+            print(f"Poll failed: {e}")
+            await asyncio.sleep(poll_seconds)
+            continue
+        if poll["recorded"] or poll["rolled_back"]:
+            print(f"Block {poll['to_block']}: recorded {poll['recorded']} batches, rolled back {poll['rolled_back']}")
+        if poll["to_block"] >= poll["latest"]:
+            await asyncio.sleep(poll_seconds)
+
+if __name__ == "__main__":
+    import argparse
+    from concurrent.futures import ProcessPoolExecutor
+    from utils import get_env
+    from compressors import (
+        parse_compressor,
+        available_compressors
+    )
+    from pipeline import default_workers
+
+    parser = argparse.ArgumentParser(description="Follow the chain head and simulate new sequencer batches as they land")
+    parser.add_argument("--provider", default=None,
+        help="json rpc url (default: ETH_PROVIDER_URL)")
+    parser.add_argument("--poll", type=float, default=POLL_SECONDS,
+        help="seconds between polls once caught up")
+    parser.add_argument("--reorg-depth", type=int, default=REORG_DEPTH,
+        help="recent blocks rechecked for reorgs on every poll")
+    parser.add_argument("--step", type=int, default=STEP,
+        help="blocks per eth_getLogs window")
+    parser.add_argument("--compressor", type=parse_compressor, default="brotli",
+        help=f"compressor and parameters, e.g. brotli:quality=5 ({', '.join(available_compressors())})")
+    parser.add_argument("--workers", type=int, default=default_workers(),
+        help="compression processes")
+    parser.add_argument("--output", default="../data/resultsV2",
+        help="directory for the result columns and aggregates")
+    parser.add_argument("--transactions-dir", default="../data/transactions")
+    parser.add_argument("--logs-info", default="../data/logs_info.json")
+    parser.add_argument("--block-range", type=int, default=BLOCK_RANGE,
+        help="l1 blocks per rollup in _aggregates.json")
+    parser.add_argument("--max-polls", type=int, default=None,
+        help="stop after this many polls (default: run until interrupted)")
+    args = parser.parse_args()
+    eth_provider_url = args.provider or get_env("ETH_PROVIDER_URL", raise_on_none=True)
+
+    async def main():
+        async with AsyncProvider(eth_provider_url) as provider:
+            with ProcessPoolExecutor(args.workers) as executor:
+                follower = Follower(
+                    provider,
+                    executor,
+                    args.output,
+                    args.transactions_dir,
+                    args.logs_info,
+                    args.compressor,
+                    args.reorg_depth,
+                    args.step,
+                    args.block_range
+                )
+                print(f"Following from block {follower.state['next_block']} with {args.compressor.label}, "
+                    f"{len(follower.transaction_hashes)} batches recorded")
+                try:
+                    await follow(follower, args.poll, args.max_polls)
+                finally:
+                    follower.close()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("Stopped")
@@ -1,50 +1,201 @@
+import os
 import json
+import asyncio
 from utils import (
+    AsyncProvider,
     log_topic,
-    get_logs,
     get_env
 )
 
-eth_provider_url = get_env("ETH_PROVIDER_URL")
-sequencer_batch_delivered = log_topic(
-    "SequencerBatchDelivered(uint256,bytes32,uint256,bytes32,bytes,uint256[],uint256[],uint256,address)"
-)
-sequencer_batch_delivered_from_origin = log_topic(
-    "SequencerBatchDeliveredFromOrigin(uint256,bytes32,uint256,bytes32,uint256)"
-)
+# log_topic of each event, precomputed so importing this module hashes nothing
+events = {
+    "SequencerBatchDelivered(uint256,bytes32,uint256,bytes32,bytes,uint256[],uint256[],uint256,address)":
+        "0x3bf85aebd2a1dc6c510ffc4795a3785e786b5817ab30144f88501d4c6456c986",
+    "SequencerBatchDeliveredFromOrigin(uint256,bytes32,uint256,bytes32,uint256)":
+        "0x10e0571aafaf282151fd5b0215b5495521c549509cb0de3a3f8310bd2e344682"
+}
+sequencer_batch_delivered, sequencer_batch_delivered_from_origin = events.values()
+
+def check_topics():
+    for event_sig, topic in events.items():
+        if log_topic(event_sig) != topic:
+            raise Exception(f"Topic of {event_sig} is {log_topic(event_sig)}, not {topic}")
+
+FIRST_BLOCK = 13318918
+STEP = 2000
+MAX_STEP = 100000
+PARALLEL_REQUESTS = 8
+REQUESTS_PER_SECOND = 20
+RETRIES = 5
+
+def is_range_too_large(error: dict) -> bool:
+    # providers word this differently, but all of them mean "ask for fewer blocks"
+    message = str(error.get("message", "")).lower()
+    return any(s in message for s in (
+        "more than",
+        "too many",
+        "too large",
+        "response size exceeded"
+    ))
+
+class BlockRanges:
+    # hands out inclusive block windows, growing across empty ranges and
+    # splitting any window the provider refuses as too large
+    def __init__(self, from_block: int, to_block: int, step: int=STEP, max_step: int=MAX_STEP):
+        self.cursor = from_block
+        self.to_block = to_block
+        self.step = step
+        self.max_step = max_step
+        self.split_ranges = []
+        self.in_flight = 0
+
+    def next(self):
+        if self.split_ranges:
+            block_range = self.split_ranges.pop()
+        elif self.cursor <= self.to_block:
+            block_range = (self.cursor, min(self.cursor + self.step - 1, self.to_block))
+            self.cursor = block_range[1] + 1
+        else:
+            return None
+        self.in_flight += 1
+        return block_range
+
+    def done(self, block_range: tuple, n_logs: int):
+        self.in_flight -= 1
+        if not n_logs:
+            self.step = min(self.step * 2, self.max_step)
+
+    def split(self, block_range: tuple):
+        self.in_flight -= 1
+        from_block, to_block = block_range
+        if from_block == to_block:
+            raise Exception(f"Block {from_block} alone has too many logs")
+        middle = (from_block + to_block) // 2
+        self.split_ranges += [(middle + 1, to_block), (from_block, middle)]
+        self.step = max(1, (to_block - from_block + 1) // 2)
 
-first_block = 13318918
-end_block = 14413651
-step = 2000
-transaction_hashes = []
-offset = 0
-
-for i in range(first_block, end_block - step, step):
-    from_block = i + offset
-    to_block = i + offset + step
-    offset += 1
-    response = get_logs(eth_provider_url, from_block, to_block, sequencer_batch_delivered_from_origin)
-
-    if response.get("result") is not None:
-        results = response["result"]
-        if not len(results):
+    def finished(self) -> bool:
+        return self.cursor > self.to_block and not self.split_ranges and not self.in_flight
+
+async def scan_logs(
+    provider_url: str,
+    topic: str,
+    from_block: int,
+    to_block: int,
+    logs_dir: str,
+    step: int=STEP,
+    parallel_requests: int=PARALLEL_REQUESTS,
+    requests_per_second: float=REQUESTS_PER_SECOND,
+    retries: int=RETRIES
+) -> list:
+    ranges = BlockRanges(from_block, to_block, step)
+    logs = []
+    provider = AsyncProvider(
+        provider_url,
+        retries=retries,
+        parallel_requests=parallel_requests,
+        requests_per_second=requests_per_second
+    )
+    async with provider:
+        async def worker():
+            while not ranges.finished():
+                block_range = ranges.next()
+                if block_range is None:
+                    # another worker may still split its range into new work
+                    await asyncio.sleep(0.01)
+                    continue
+                response = await provider.get_logs(block_range[0], block_range[1], topic)
+                if response.get("error") is not None:
+                    if not is_range_too_large(response["error"]):
+                        raise Exception(f"eth_getLogs {block_range} failed: {response['error']}")
+                    ranges.split(block_range)
+                    continue
+                results = response["result"]
+                ranges.done(block_range, len(results))
+                if results:
+                    with open(f"{logs_dir}/{block_range[0]}_{block_range[1]}.json", "w+") as f:
+                        json.dump(results, f, indent=2)
+                    logs.extend(results)
+
+        await asyncio.gather(*(worker() for _ in range(parallel_requests)))
+    # windows complete out of order, batches are indexed in chain order
+    return sorted(logs, key=lambda log: (int(log["blockNumber"], 16), int(log["logIndex"], 16)))
+
+def append_transaction_hashes(transaction_hashes: list, logs: list) -> int:
+    seen = set(transaction_hashes)
+    added = 0
+    for log in logs:
+        transaction_hash = log["transactionHash"]
+        if transaction_hash in seen:
+            print("duplicate detected", transaction_hash)
             continue
-        next_transaction_hashes = [result["transactionHash"] for result in results]
-        for t in next_transaction_hashes:
-            if t in transaction_hashes:
-                print('duplicate detected', t)
-
-        transaction_hashes += next_transaction_hashes
-        with open(f"../data/logs/{i}_{i+step}.json", "w+") as f:
-            json.dump(results, f, indent=2)
-
-print(f"total transaction hashes: {len(transaction_hashes)}")
-
-with open("../data/logs_info.json", "w+") as f:
-    json.dump({
-        "log_topic": sequencer_batch_delivered_from_origin,
-        "total_batches": total_batches,
-        "from_block": first_block,
-        "to_block": end_block,
-        "transaction_hashes": transaction_hashes
-    }, f, indent=2)
\ No newline at end of file
+        seen.add(transaction_hash)
+        transaction_hashes.append(transaction_hash)
+        added += 1
+    return added
+
+async def latest_block(provider_url: str) -> int:
+    async with AsyncProvider(provider_url) as provider:
+        return await provider.block_number()
+
+if __name__ == "__main__":
+    import time
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Scan for SequencerBatchDeliveredFromOrigin logs")
+    parser.add_argument("--from-block", type=int, default=None,
+        help=f"first block to scan (default: after the last to_block in logs_info.json, else {FIRST_BLOCK})")
+    parser.add_argument("--to-block", type=int, default=None,
+        help="last block to scan (default: latest block)")
+    parser.add_argument("--step", type=int, default=STEP,
+        help="initial blocks per eth_getLogs window")
+    parser.add_argument("--parallel", type=int, default=PARALLEL_REQUESTS,
+        help="eth_getLogs windows in flight at once")
+    parser.add_argument("--rps", type=float, default=REQUESTS_PER_SECOND,
+        help="maximum requests per second, 0 for no limit")
+    parser.add_argument("--provider", default=None,
+        help="json rpc url (default: ETH_PROVIDER_URL)")
+    parser.add_argument("--logs-dir", default="../data/logs")
+    parser.add_argument("--logs-info", default="../data/logs_info.json")
+    args = parser.parse_args()
+    eth_provider_url = args.provider or get_env("ETH_PROVIDER_URL", raise_on_none=True)
+    os.makedirs(args.logs_dir, exist_ok=True)
+
+    logs_info = { "transaction_hashes": [] }
+    next_block = FIRST_BLOCK
+    if os.path.exists(args.logs_info):
+        # incremental run: only scan blocks after the last recorded to_block
+        with open(args.logs_info, "r") as f:
+            logs_info = json.load(f)
+        next_block = logs_info["to_block"] + 1
+    from_block = args.from_block if args.from_block is not None else next_block
+    to_block = args.to_block if args.to_block is not None else asyncio.run(latest_block(eth_provider_url))
+
+    start = time.perf_counter()
+    print(f"Scanning blocks {from_block} to {to_block}")
+    logs = asyncio.run(scan_logs(
+        eth_provider_url,
+        sequencer_batch_delivered_from_origin,
+        from_block,
+        to_block,
+        args.logs_dir,
+        args.step,
+        args.parallel,
+        args.rps
+    ))
+    transaction_hashes = logs_info["transaction_hashes"]
+    added = append_transaction_hashes(transaction_hashes, logs)
+    elapsed = time.perf_counter() - start
+    print(f"Found {len(logs)} logs and {added} new batches in {elapsed:.2f} seconds")
+    print(f"total transaction hashes: {len(transaction_hashes)}")
+
+    logs_info.pop("log_topic", None)
+    with open(args.logs_info, "w+") as f:
+        json.dump({
+            **logs_info,
+            "event_topic": sequencer_batch_delivered_from_origin,
+            "total_batches": len(transaction_hashes),
+            "from_block": min(logs_info.get("from_block", from_block), from_block),
+            "to_block": max(logs_info.get("to_block", to_block), to_block),
+            "transaction_hashes": transaction_hashes
+        }, f, indent=2)
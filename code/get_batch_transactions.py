@@ -1,56 +1,128 @@
-# this script is adapted from https://blog.jonlu.ca/posts/async-python-http
-import sys
+# fetches the sequencer batch transactions with batched json rpc requests,
+# originally adapted from https://blog.jonlu.ca/posts/async-python-http
 import os
 import json
 import asyncio
-import aiohttp
 from utils import (
-    compress_json,
+    AsyncProvider,
     get_env
 )
 
-eth_provider_url = get_env("ETH_PROVIDER_URL")
-
-with open("../data/logs_info.json", "r") as f:
-    logs_info = json.load(f)
-
-# Initialize connection pool
-conn = aiohttp.TCPConnector(limit_per_host=100, limit=0, ttl_dns_cache=300)
-PARALLEL_REQUESTS = 100
-transaction_hashes = logs_info["transaction_hashes"]
-results = []
-data = {
-    "jsonrpc": "2.0",
-    "method": "eth_getTransactionByHash",
-}
-
-async def gather_with_concurrency(n):
-    semaphore = asyncio.Semaphore(n)
-    session = aiohttp.ClientSession(connector=conn)
-    # heres the logic for the generator
-    async def post(url, data):
-        async with semaphore:
-            async with session.post(url, json=data) as response:
-                obj = json.loads(await response.read())
-                results.append(obj)
-
-    await asyncio.gather(
-        *(post(eth_provider_url, data={**data, "id": t, "params": [transaction_hash]}) for t, transaction_hash in enumerate(transaction_hashes))
+CHECKPOINT_FILE = "_checkpoint.txt"
+BATCH_SIZE = 50
+PARALLEL_REQUESTS = 8
+REQUESTS_PER_SECOND = 20
+RETRIES = 5
+
+def load_checkpoint(output_dir: str) -> set:
+    # one completed batch index per line, appended as each file is written
+    path = f"{output_dir}/{CHECKPOINT_FILE}"
+    if not os.path.exists(path):
+        return set()
+    with open(path, "r") as f:
+        return set(int(line) for line in f if line.strip().isdigit())
+
+def save_checkpoint(output_dir: str, batch_indexes):
+    # replaces the checkpoint at once, for follow.py dropping rolled back batches
+    path = f"{output_dir}/{CHECKPOINT_FILE}"
+    with open(f"{path}.tmp", "w+") as f:
+        f.writelines(f"{index}\n" for index in sorted(batch_indexes))
+    os.replace(f"{path}.tmp", path)
+
+async def fetch_transactions(
+    provider_url: str,
+    transaction_hashes: list,
+    output_dir: str,
+    batch_size: int=BATCH_SIZE,
+    parallel_requests: int=PARALLEL_REQUESTS,
+    requests_per_second: float=REQUESTS_PER_SECOND,
+    retries: int=RETRIES
+):
+    index_of = { transaction_hash: index for index, transaction_hash in enumerate(transaction_hashes) }
+    done = load_checkpoint(output_dir)
+    pending = [h for h in transaction_hashes if index_of[h] not in done]
+    print(f"{len(done)} transactions already fetched, {len(pending)} remaining")
+
+    queue = asyncio.Queue()
+    for k in range(0, len(pending), batch_size):
+        queue.put_nowait(pending[k:k + batch_size])
+
+    failed = []
+    provider = AsyncProvider(
+        provider_url,
+        retries=retries,
+        parallel_requests=parallel_requests,
+        requests_per_second=requests_per_second
     )
-    await session.close()
-
-print(f"Beginning {len(transaction_hashes)} requests")
-loop = asyncio.get_event_loop()
-loop.run_until_complete(gather_with_concurrency(PARALLEL_REQUESTS))
-conn.close()
-print(f"Completed {len(transaction_hashes)} requests with {len(results)} results")
-
-print('Writing results')
-for result in results:
-    index = transaction_hashes.index(result["result"]["hash"])
-    if not result.get("result"):
-        print(result)
-    if index != result["id"]:
-        print("mismatched index: ", result["result"]["hash"])
-    with open(f"../data/transactions/{index}_{result['result']['hash']}.json", "w+") as f:
-        json.dump(result["result"], f, indent=2)
\ No newline at end of file
+    async with provider:
+        with open(f"{output_dir}/{CHECKPOINT_FILE}", "a") as checkpoint:
+            async def worker():
+                while not queue.empty():
+                    chunk = queue.get_nowait()
+                    try:
+                        responses = await provider.get_transactions_by_hash(chunk)
+                    except Exception as e:
+                        # retries are exhausted, the chunk is left for the next run
+                        print(f"Batch request for {len(chunk)} transactions failed: {e}")
+                        failed.extend(chunk)
+                        continue
+                    for transaction_hash, response in zip(chunk, responses):
+                        result = response.get("result")
+                        if not result:
+                            print(f"No result for {transaction_hash}: {response.get('error')}")
+                            failed.append(transaction_hash)
+                            continue
+                        index = index_of[transaction_hash]
+                        if index_of.get(result["hash"]) != index:
+                            print("mismatched index: ", result["hash"])
+                        with open(f"{output_dir}/{index}_{result['hash']}.json", "w+") as f:
+                            json.dump(result, f, indent=2)
+                        checkpoint.write(f"{index}\n")
+                    checkpoint.flush()
+
+            await asyncio.gather(*(worker() for _ in range(parallel_requests)))
+    for method, counter in provider.latency.summary().items():
+        print(f"{method}: {counter['requests']} requests, {counter['calls']} calls, "
+            f"{counter['errors']} errors, {counter['mean_ms']:.1f} ms mean latency")
+    return len(pending) - len(failed), failed
+
+if __name__ == "__main__":
+    import time
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Fetch sequencer batch transactions listed in logs_info.json")
+    parser.add_argument("--output", default="../data/transactions",
+        help="directory for the transaction files and the resume checkpoint")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+        help="eth_getTransactionByHash calls per json rpc batch request")
+    parser.add_argument("--parallel", type=int, default=PARALLEL_REQUESTS,
+        help="batch requests in flight at once")
+    parser.add_argument("--rps", type=float, default=REQUESTS_PER_SECOND,
+        help="maximum batch requests per second, 0 for no limit")
+    parser.add_argument("--retries", type=int, default=RETRIES,
+        help="retries with exponential backoff per batch request")
+    parser.add_argument("--provider", default=None,
+        help="json rpc url (default: ETH_PROVIDER_URL)")
+    args = parser.parse_args()
+
+    eth_provider_url = args.provider or get_env("ETH_PROVIDER_URL", raise_on_none=True)
+    with open("../data/logs_info.json", "r") as f:
+        logs_info = json.load(f)
+    transaction_hashes = logs_info["transaction_hashes"]
+    os.makedirs(args.output, exist_ok=True)
+
+    start = time.perf_counter()
+    print(f"Fetching {len(transaction_hashes)} transactions")
+    fetched, failed = asyncio.run(fetch_transactions(
+        eth_provider_url,
+        transaction_hashes,
+        args.output,
+        args.batch_size,
+        args.parallel,
+        args.rps,
+        args.retries
+    ))
+    elapsed = time.perf_counter() - start
+    print(f"Fetched {fetched} transactions in {elapsed:.2f} seconds, {len(failed)} failed")
+    if failed:
+        print("Rerun to retry the failed transactions, completed ones are skipped")
@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import random
+from aiohttp import web
+
+################################################################################
+# a local json rpc node that replays recorded data
+################################################################################
+class RpcError(Exception):
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+class MockNode:
+    def __init__(
+        self,
+        transactions: dict=None,
+        logs: list=None,
+        block_number: int=None,
+        fail_rate: float=0.0,
+        max_logs: int=10000,
+        seed: int=0,
+        start_block: int=None,
+        blocks_per_second: float=0.0,
+        reorg_every: float=0.0,
+        reorg_depth: int=3
+    ):
+        self.transactions = transactions or {}
+        self.logs = sorted(logs or [], key=lambda log: int(log["blockNumber"], 16))
+        if block_number is None:
+            block_number = int(self.logs[-1]["blockNumber"], 16) if self.logs else 0
+        self.block_number = block_number
+        self.fail_rate = fail_rate
+        self.max_logs = max_logs
+        self.requests = 0
+        self.calls = 0
+        self.reorgs = 0
+        self._random = random.Random(seed)
+        # Replay: the head starts at start_block and advances in real time up
+        # to block_number, so recorded logs appear as if they were being mined.
+        # Every reorg_every seconds the last reorg_depth blocks are replaced.
+        self.final_block = block_number
+        self.start_block = start_block
+        self.blocks_per_second = blocks_per_second
+        self.reorg_every = reorg_every
+        self.reorg_depth = reorg_depth
+        self.started = time.monotonic()
+        self.last_reorg = self.started
+        if start_block is not None:
+            self.block_number = start_block
+
+    def advance(self):
+        now = time.monotonic()
+        if self.start_block is not None and self.blocks_per_second:
+            self.block_number = min(self.final_block, self.start_block + int((now - self.started) * self.blocks_per_second))
+        if self.reorg_every and now - self.last_reorg >= self.reorg_every:
+            self.last_reorg = now
+            self.reorg(self.reorg_depth)
+
+    def reorg(self, depth: int):
+        # the same transactions land in blocks with new hashes
+        block_hashes = {}
+        for log in self.logs:
+            block = int(log["blockNumber"], 16)
+            if block > self.block_number - depth and block <= self.block_number:
+                if block not in block_hashes:
+                    block_hashes[block] = "0x" + self._random.randbytes(32).hex()
+                log["blockHash"] = block_hashes[block]
+        self.reorgs += 1
+
+    def eth_blockNumber(self):
+        return hex(self.block_number)
+
+    def eth_getTransactionByHash(self, transaction_hash: str):
+        return self.transactions.get(transaction_hash)
+
+    def eth_getLogs(self, log_filter: dict):
+        from_block = int(log_filter.get("fromBlock", "0x0"), 16)
+        to_block = min(int(log_filter.get("toBlock", hex(self.block_number)), 16), self.block_number)
+        topics = log_filter.get("topics") or []
+        logs = [
+            log for log in self.logs
+            if from_block <= int(log["blockNumber"], 16) <= to_block
+            and (not topics or log["topics"][0] == topics[0])
+        ]
+        if len(logs) > self.max_logs:
+            # the same error geth-style providers return for oversized ranges
+            raise RpcError(-32005, f"query returned more than {self.max_logs} results")
+        return logs
+
+    def call(self, request: dict) -> dict:
+        self.calls += 1
+        response = { "id": request.get("id"), "jsonrpc": "2.0" }
+        method = getattr(self, request.get("method", ""), None)
+        if method is None or not request["method"].startswith("eth_"):
+            response["error"] = { "code": -32601, "message": "the method does not exist" }
+            return response
+        try:
+            response["result"] = method(*request.get("params", []))
+        except RpcError as e:
+            response["error"] = { "code": e.code, "message": e.message }
+        return response
+
+    async def handle(self, request):
+        self.requests += 1
+        self.advance()
+        if self.fail_rate and self._random.random() < self.fail_rate:
+            return web.Response(status=429, text="Too Many Requests")
+        body = await request.json()
+        if isinstance(body, list):
+            return web.json_response([self.call(r) for r in body])
+        return web.json_response(self.call(body))
+
+def load_transactions(transactions_dir: str) -> dict:
+    transactions = {}
+    for fname in os.listdir(transactions_dir):
+        if fname.endswith(".json"):
+            with open(f"{transactions_dir}/{fname}", "r") as f:
+                transaction = json.load(f)
+            transactions[transaction["hash"]] = transaction
+    return transactions
+
+def load_logs(logs_dir: str) -> list:
+    logs = []
+    for fname in os.listdir(logs_dir):
+        if fname.endswith(".json"):
+            with open(f"{logs_dir}/{fname}", "r") as f:
+                logs += json.load(f)
+    return logs
+
+async def start_mock_node(node: MockNode, host: str="127.0.0.1", port: int=0):
+    # returns the runner and url, port 0 picks a free port
+    app = web.Application()
+    app.router.add_post("/", node.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{port}"
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve recorded logs and transactions over json rpc")
+    parser.add_argument("--port", type=int, default=8545)
+    parser.add_argument("--transactions", default="../data/transactions",
+        help="directory of recorded transactions")
+    parser.add_argument("--logs", default="../data/logs",
+        help="directory of recorded logs")
+    parser.add_argument("--fail-rate", type=float, default=0.0,
+        help="fraction of http requests answered with 429, to exercise retries")
+    parser.add_argument("--start-block", type=int, default=None,
+        help="replay from this block instead of serving every recorded block at once")
+    parser.add_argument("--blocks-per-second", type=float, default=1.0,
+        help="how fast the replayed head advances")
+    parser.add_argument("--reorg-every", type=float, default=0.0,
+        help="seconds between reorgs of the replayed head, 0 for none")
+    parser.add_argument("--reorg-depth", type=int, default=3,
+        help="blocks replaced by each reorg")
+    args = parser.parse_args()
+
+    node = MockNode(
+        load_transactions(args.transactions) if os.path.isdir(args.transactions) else {},
+        load_logs(args.logs) if os.path.isdir(args.logs) else [],
+        fail_rate=args.fail_rate,
+        start_block=args.start_block,
+        blocks_per_second=args.blocks_per_second if args.start_block is not None else 0.0,
+        reorg_every=args.reorg_every,
+        reorg_depth=args.reorg_depth
+    )
+    print(f"Serving {len(node.transactions)} transactions and {len(node.logs)} logs up to block {node.final_block}")
+    app = web.Application()
+    app.router.add_post("/", node.handle)
+    web.run_app(app, host="127.0.0.1", port=args.port)
@@ -0,0 +1,187 @@
+import os
+import json
+import queue
+import itertools
+from contextlib import contextmanager
+from multiprocessing import (
+    shared_memory,
+    resource_tracker
+)
+
+################################################################################
+# bounded streaming over a multiprocessing pool
+################################################################################
+def apply_chunk(fn, chunk: list) -> list:
+    return [fn(item) for item in chunk]
+
+def bounded_imap_unordered(pool, fn, items, window: int, chunksize: int=1):
+    # Pool.imap_unordered drains its input eagerly in a feeder thread, so on its
+    # own it would queue every batch at once. Tasks are submitted from the
+    # consumer instead, a new one only after a result has been taken, keeping
+    # at most `window` items in flight. Nothing ever blocks inside the pool's
+    # threads, so Ctrl-C or an exception in the consumer still lets the pool
+    # terminate.
+    if window < chunksize:
+        raise ValueError(f"window ({window}) must be at least chunksize ({chunksize})")
+    completed = queue.SimpleQueue()
+    items = iter(items)
+    in_flight = 0
+
+    def submit() -> bool:
+        chunk = list(itertools.islice(items, chunksize))
+        if not chunk:
+            return False
+        pool.apply_async(apply_chunk, (fn, chunk),
+            callback=lambda results: completed.put((True, results)),
+            error_callback=lambda e: completed.put((False, e)))
+        return True
+
+    while True:
+        while in_flight < window // chunksize and submit():
+            in_flight += 1
+        if not in_flight:
+            return
+        ok, results = completed.get()
+        in_flight -= 1
+        if not ok:
+            raise results
+        yield from results
+
+def imap_chunks(pool, fn, chunks: list, window: int):
+    # fn takes a chunk and returns a list, results are yielded one at a time
+    for results in bounded_imap_unordered(pool, fn, chunks, window):
+        yield from results
+
+################################################################################
+# shared memory handoff
+################################################################################
+def start_shared_memory():
+    # Call before starting a pool whose workers share_bytes. Forked workers
+    # otherwise each start their own resource tracker, which never sees the
+    # parent's unlink and warns about (and retries) every block at exit.
+    resource_tracker.ensure_running()
+
+def share_bytes(data) -> tuple:
+    # Copies data into a new shared memory block and returns its (name, offset,
+    # length) descriptor, which pickles in a few bytes. The block outlives this
+    # process until whoever receives the descriptor opens it with shared_bytes.
+    if not len(data):
+        return (None, 0, 0)
+    block = shared_memory.SharedMemory(create=True, size=len(data))
+    block.buf[:len(data)] = data
+    block.close()
+    return (block.name, 0, len(data))
+
+@contextmanager
+def shared_bytes(descriptor: tuple):
+    # a view of a shared block, which is unlinked once the view is released
+    name, offset, length = descriptor
+    if name is None:
+        yield memoryview(b"")
+        return
+    block = shared_memory.SharedMemory(name=name)
+    view = block.buf[offset:offset + length]
+    try:
+        yield view
+    finally:
+        view.release()
+        block.close()
+        block.unlink()
+
+################################################################################
+# scheduling
+################################################################################
+def available_cpus() -> int:
+    # respects cpu affinity (taskset, container cpusets) where the os exposes it
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def default_workers() -> int:
+    # one core is left to the parent, which collects and records results
+    return max(1, available_cpus() - 1)
+
+def size_aware_chunks(items: list, sizes: list, n_workers: int, tasks_per_worker: int=16, max_items: int=256) -> list:
+    # Batch sizes vary by orders of magnitude, so a fixed chunksize either
+    # sends one task per tiny batch or lumps several huge ones together. Items
+    # are taken largest first, so the longest tasks start early instead of
+    # straggling at the end, and packed into chunks of about equal total size.
+    order = sorted(range(len(items)), key=lambda k: sizes[k], reverse=True)
+    target = sum(sizes) / max(1, n_workers * tasks_per_worker)
+    chunks = []
+    chunk = []
+    chunk_size = 0
+    for k in order:
+        chunk.append(items[k])
+        chunk_size += sizes[k]
+        if chunk_size >= target or len(chunk) >= max_items:
+            chunks.append(chunk)
+            chunk = []
+            chunk_size = 0
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+def truncate_partial_line(path: str):
+    # an interrupted run can leave a truncated last line, appending onto it
+    # would corrupt the first record of the next run
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            step = min(65536, position)
+            f.seek(position - step)
+            block = f.read(step)
+            newline = block.rfind(b"\n")
+            if newline != -1:
+                position = position - step + newline + 1
+                break
+            position -= step
+        if position != end:
+            f.truncate(position)
+
+class JsonLinesWriter:
+    # appends one json object per line and flushes so partial runs stay usable
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        truncate_partial_line(path)
+        self._f = open(path, "a")
+
+    def write(self, record: dict):
+        self._f.write(json.dumps(record) + "\n")
+        self._f.flush()
+        self.count += 1
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def rewrite_json_lines(path: str, keep) -> int:
+    # keeps the records keep(record) accepts, replacing the file at once
+    kept = 0
+    with open(f"{path}.tmp", "w+") as f:
+        for record in read_json_lines(path):
+            if keep(record):
+                f.write(json.dumps(record) + "\n")
+                kept += 1
+    os.replace(f"{path}.tmp", path)
+    return kept
+
+def read_json_lines(path: str):
+    with open(path, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # a line cut short by an interrupted run, the ones after it are fine
+                continue
@@ -1,121 +1,100 @@
-import json
+import os
 import numpy as np
 import matplotlib.pyplot as plt
+from aggregates import (
+    Aggregates,
+    AGGREGATES_FILE,
+    rebuild_aggregates
+)
+from result_columns import (
+    ResultColumns,
+    COLUMNS_DIR,
+    has_columns
+)
 
 
 show = False
 save = True
 
-# with open("../data/results/_total_results.json", "r") as f:
-#     data = json.load(f)
-
-with open("../data/resultsV2/_total_results.json", "r") as f:
-    data = json.load(f)
-
+results_dir = "../data/resultsV2"
 output_dir = "../data/imagesV2"
 
-compression_ratios = []
-cost_ratios = []
-for d in data:
-    compression_ratios.append(d["compression_ratio"])
-    cost_ratios.append(d["cost_ratio"])
-
-compression_ratios = np.array(compression_ratios)
-cost_ratios = np.array(cost_ratios)
-overestimation_ratios = compression_ratios/cost_ratios
-
-median_compression = np.median(compression_ratios)
-median_cost = np.median(cost_ratios)
-median_overestimation = np.median(overestimation_ratios)
-
-print(f"Max compression ratio: {compression_ratios.max()}")
-print(f"Median compression ratio: {median_compression}")
-print(f"Min compression ratio: {compression_ratios.min()}")
-
-print(f"Max cost ratio: {cost_ratios.max()}")
-print(f"Median cost ratio: {median_cost}")
-print(f"Min cost ratio: {cost_ratios.min()}")
-
 hist_range=(1, 5)
 hist_y_lims=(1, 500)
 plot_y_lims=(1, 22)
 
-plt.title("Compression Ratio")
-plt.hist(compression_ratios, bins=1000, range=hist_range)
-plt.axvline(median_compression, label=f"median = {median_compression:.2f}", color="red")
-plt.ylabel('N')
-plt.xlabel("Compression Ratio")
-plt.ylim(*hist_y_lims)
-plt.legend()
-if save:
-    plt.savefig(f"{output_dir}/compression_ratio_hist.png")
-if show:
-    plt.show()
-plt.close("all")
-
-plt.title("Cost Ratio")
-plt.hist(cost_ratios, bins=1000, range=hist_range)
-plt.axvline(median_cost, label=f"median = {median_cost:.2f}", color="red")
-plt.ylabel('N')
-plt.xlabel("Cost Ratio")
-plt.ylim(*hist_y_lims)
-plt.legend()
-if save:
-    plt.savefig(f"{output_dir}/cost_ratio_hist.png")
-if show:
-    plt.show()
-plt.close("all")
-
-plt.title("Overestimation Ratio")
-plt.hist(overestimation_ratios, bins=1000, range=hist_range)
-plt.axvline(median_overestimation, label=f"median = {median_cost:.2f}", color="red")
-plt.ylabel('N')
-plt.xlabel("Overestimation Ratio")
-plt.ylim(*hist_y_lims)
-plt.legend()
-if save:
-    plt.savefig(f"{output_dir}/overestimation_ratio_hist.png")
-if show:
-    plt.show()
-plt.close("all")
-
-
-x = np.arange(len(compression_ratios))
-plt.title("Compression Ratio vs Batch Number")
-plt.plot(x, compression_ratios)
-plt.axhline(median_compression, label=f"median={median_compression:.2f}", color="red")
-plt.xlabel("Batch")
-plt.ylabel("Compression Ratio")
-plt.ylim(*plot_y_lims)
-plt.legend()
-if save:
-    plt.savefig(f"{output_dir}/compression_ratio.png")
-if show:
-    plt.show()
-plt.close("all")
-
-plt.title("Cost Ratio vs Batch Number")
-plt.plot(x, cost_ratios)
-plt.axhline(median_cost, label=f"median={median_cost:.2f}", color="red")
-plt.xlabel("Batch")
-plt.ylabel("Cost Ratio")
-plt.ylim(*plot_y_lims)
-plt.legend()
-if save:
-    plt.savefig(f"{output_dir}/cost_ratio.png")
-if show:
-    plt.show()
-plt.close("all")
-
-plt.title("Overestimation Ratio vs Batch Number")
-plt.plot(x, compression_ratios/cost_ratios)
-plt.axhline(median_overestimation, label=f"median={median_overestimation:.2f}", color="red")
-plt.xlabel("Batch")
-plt.ylabel("Overestimation")
-plt.ylim(*plot_y_lims)
-plt.legend()
-if save:
-    plt.savefig(f"{output_dir}/overestimation_ratio.png")
-if show:
-    plt.show()
-plt.close("all")
\ No newline at end of file
+plots = [
+    ("compression_ratio", "Compression Ratio", "Compression Ratio"),
+    ("cost_ratio", "Cost Ratio", "Cost Ratio"),
+    ("overestimation_ratio", "Overestimation Ratio", "Overestimation")
+]
+
+def finish_plot(name: str):
+    if save:
+        plt.savefig(f"{output_dir}/{name}.png")
+    if show:
+        plt.show()
+    plt.close("all")
+
+if has_columns(results_dir):
+    # memory mapped result columns give every batch's value directly
+    columns = ResultColumns(f"{results_dir}/{COLUMNS_DIR}")
+    order = columns.batch_order()
+    values = {
+        "compression_ratio": columns["compression_ratio"][order],
+        "cost_ratio": columns["cost_ratio"][order]
+    }
+    values["overestimation_ratio"] = values["compression_ratio"] / values["cost_ratio"]
+    summary = {
+        metric: { "min": v.min(), "median": np.median(v), "max": v.max() } for metric, v in values.items()
+    }
+else:
+    # otherwise everything comes from the running aggregates, which older
+    # result sets get from one pass over their results
+    values = None
+    if os.path.exists(f"{results_dir}/{AGGREGATES_FILE}"):
+        aggregates = Aggregates.load(f"{results_dir}/{AGGREGATES_FILE}")
+    else:
+        aggregates = rebuild_aggregates(results_dir)
+    summary = aggregates.summary()
+
+for metric, name in [("compression_ratio", "compression ratio"), ("cost_ratio", "cost ratio")]:
+    print(f"Max {name}: {summary[metric]['max']}")
+    print(f"Median {name}: {summary[metric]['median']}")
+    print(f"Min {name}: {summary[metric]['min']}")
+
+for metric, title, label in plots:
+    median = summary[metric]["median"]
+    plt.title(title)
+    if values is not None:
+        plt.hist(values[metric], bins=1000, range=hist_range)
+        plt.ylim(*hist_y_lims)
+    else:
+        edges, counts = aggregates.total[metric].sketch.histogram()
+        plt.stairs(counts, edges, fill=True)
+        plt.xlim(*hist_range)
+    plt.axvline(median, label=f"median = {median:.2f}", color="red")
+    plt.ylabel('N')
+    plt.xlabel(title)
+    plt.legend()
+    finish_plot(f"{metric}_hist")
+
+for metric, title, label in plots:
+    median = summary[metric]["median"]
+    if values is not None:
+        plt.title(f"{title} vs Batch Number")
+        plt.plot(np.arange(len(values[metric])), values[metric])
+        plt.xlabel("Batch")
+    else:
+        blocks, medians = aggregates.series(metric, "median")
+        _, p10 = aggregates.series(metric, "p10")
+        _, p90 = aggregates.series(metric, "p90")
+        plt.title(f"{title} vs L1 Block")
+        plt.plot(blocks, medians, label=f"median per {aggregates.block_range} blocks")
+        plt.fill_between(blocks, p10, p90, alpha=0.3, label="10th to 90th percentile")
+        plt.xlabel("L1 Block")
+    plt.axhline(median, label=f"median={median:.2f}", color="red")
+    plt.ylabel(label)
+    plt.ylim(*plot_y_lims)
+    plt.legend()
+    finish_plot(metric)
@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import glob
+import pstats
+import socket
+import resource
+import subprocess
+from contextlib import nullcontext
+from multiprocessing.util import Finalize
+
+PROFILE_DIR = "../data/profile"
+
+# set in every process of a profiled run, None otherwise so stage() is free
+profiler = None
+
+################################################################################
+# stage timers
+################################################################################
+class StageTimer:
+    def __init__(self, stages: dict, name: str, n_bytes: int):
+        self.stages = stages
+        self.name = name
+        self.n_bytes = n_bytes
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        totals = self.stages.setdefault(self.name, [0, 0.0, 0])
+        totals[0] += 1
+        totals[1] += time.perf_counter() - self.start
+        totals[2] += self.n_bytes
+
+class Profiler:
+    # Accumulates calls, seconds and bytes per stage in one process and dumps
+    # them to the run directory, together with a cProfile of the process and
+    # the tracemalloc peak when those are requested.
+    def __init__(self, run_dir: str, role: str, cprofile: bool=False, trace_memory: bool=False):
+        self.run_dir = run_dir
+        self.role = role
+        self.stages = {}
+        self.cprofile = None
+        self.trace_memory = trace_memory
+        self.start = time.perf_counter()
+        if cprofile:
+            import cProfile
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+        if trace_memory:
+            import tracemalloc
+            tracemalloc.start()
+
+    def stage(self, name: str, n_bytes: int=0):
+        return StageTimer(self.stages, name, n_bytes)
+
+    def dump(self):
+        name = f"{self.run_dir}/{self.role}-{os.getpid()}"
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(f"{name}.prof")
+        peak_traced = None
+        if self.trace_memory:
+            import tracemalloc
+            peak_traced = tracemalloc.get_traced_memory()[1]
+        with open(f"{name}.json", "w+") as f:
+            json.dump({
+                "role": self.role,
+                "pid": os.getpid(),
+                "seconds": time.perf_counter() - self.start,
+                # linux reports ru_maxrss in KiB
+                "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+                "peak_traced_bytes": peak_traced,
+                "stages": { stage: dict(zip(["calls", "seconds", "bytes"], totals)) for stage, totals in self.stages.items() }
+            }, f, indent=2)
+
+def stage(name: str, n_bytes: int=0):
+    # with stage("compress", len(calldata)): ... is a no-op unless profiling
+    if profiler is None:
+        return nullcontext()
+    return profiler.stage(name, n_bytes)
+
+################################################################################
+# runs
+################################################################################
+def start_run(script: str, cprofile: bool=False, trace_memory: bool=False, profile_dir: str=PROFILE_DIR) -> dict:
+    # profiles the calling process and returns the settings for pool workers
+    global profiler
+    run_dir = f"{profile_dir}/{script}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+    os.makedirs(run_dir, exist_ok=True)
+    profiler = Profiler(run_dir, "main", cprofile, trace_memory)
+    return { "run_dir": run_dir, "cprofile": cprofile, "trace_memory": trace_memory }
+
+def init_worker(settings: dict, initializer=None, initargs: tuple=()):
+    # Pool initializer wrapper. Workers dump their profile on a clean exit, so
+    # profiled pools are closed and joined rather than terminated.
+    global profiler
+    if settings is not None:
+        profiler = Profiler(settings["run_dir"], "worker", settings["cprofile"], settings["trace_memory"])
+        Finalize(profiler, profiler.dump, exitpriority=10)
+    if initializer is not None:
+        initializer(*initargs)
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def finish_run(info: dict=None) -> str:
+    # merges every process's dump into report.json and the cProfiles into one
+    profiler.dump()
+    run_dir = profiler.run_dir
+    processes = []
+    for path in sorted(glob.glob(f"{run_dir}/*-*.json")):
+        with open(path, "r") as f:
+            processes.append(json.load(f))
+
+    stages = {}
+    for process in processes:
+        for name, totals in process["stages"].items():
+            merged = stages.setdefault(name, { "calls": 0, "seconds": 0.0, "bytes": 0 })
+            for field in merged:
+                merged[field] += totals[field]
+    # seconds are summed over processes, so throughput is per process
+    for totals in stages.values():
+        totals["mb_per_s"] = totals["bytes"] / totals["seconds"] / 1e6 if totals["bytes"] and totals["seconds"] else None
+
+    # a worker is busy while it runs a task, the pool stage is their wall time
+    main = next(p for p in processes if p["role"] == "main")
+    pool_seconds = main["stages"].get("pool", {}).get("seconds") or main["seconds"]
+    workers = [{
+        "pid": p["pid"],
+        "tasks": p["stages"].get("task", {}).get("calls", 0),
+        "busy_seconds": p["stages"].get("task", {}).get("seconds", 0.0),
+        "utilization": p["stages"].get("task", {}).get("seconds", 0.0) / pool_seconds,
+        "max_rss_bytes": p["max_rss_bytes"],
+        "peak_traced_bytes": p["peak_traced_bytes"]
+    } for p in processes if p["role"] == "worker"]
+
+    combined = None
+    for path in sorted(glob.glob(f"{run_dir}/*-*.prof")):
+        try:
+            stats = pstats.Stats(path)
+        except TypeError:
+            # a worker that never got a task has nothing profiled
+            continue
+        combined = stats if combined is None else combined.add(stats)
+    if combined is not None:
+        combined.dump_stats(f"{run_dir}/combined.prof")
+
+    report = {
+        "run": os.path.basename(run_dir),
+        "commit": git_commit(),
+        "host": socket.gethostname(),
+        "cpus": os.cpu_count(),
+        "wall_seconds": main["seconds"],
+        "pool_seconds": pool_seconds,
+        "info": info or {},
+        "stages": stages,
+        "workers": workers,
+        "mean_utilization": sum(w["utilization"] for w in workers) / len(workers) if workers else None,
+        "main": { "max_rss_bytes": main["max_rss_bytes"], "peak_traced_bytes": main["peak_traced_bytes"] },
+        "cprofile": f"{run_dir}/combined.prof" if combined is not None else None
+    }
+    with open(f"{run_dir}/report.json", "w+") as f:
+        json.dump(report, f, indent=2)
+    return f"{run_dir}/report.json"
+
+def add_arguments(parser):
+    parser.add_argument("--profile", action="store_true",
+        help=f"time each pipeline stage and write a report to {PROFILE_DIR}")
+    parser.add_argument("--cprofile", action="store_true",
+        help="also run cProfile in every process (implies --profile)")
+    parser.add_argument("--tracemalloc", action="store_true",
+        help="also trace peak python memory in every process (implies --profile)")
+
+def settings_from_args(script: str, args):
+    # None when the run isn't profiled, which init_worker passes through
+    if not (args.profile or args.cprofile or args.tracemalloc):
+        return None
+    return start_run(script, args.cprofile, args.tracemalloc)
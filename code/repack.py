@@ -0,0 +1,293 @@
+from multiprocessing import Pool
+import csv
+import numpy as np
+from calldata_cost import compute_l1_costs
+from batch_store import (
+    BatchStore,
+    STORE_DIR
+)
+
+# every batch posted to l1 also pays the intrinsic transaction gas
+BATCH_OVERHEAD_GAS = 21000
+GROUPS = ["none", "to", "selector"]
+
+POLICY_DEFAULTS = {
+    "max_size": 0,        # uncompressed bytes per batch, 0 for no cap
+    "max_compressed": 0,  # compressed bytes per batch, 0 for no cap
+    "max_blocks": 0,      # l1 blocks a batch may span, 0 for the whole segment
+    "group": "none",      # reorder transactions by recipient or selector
+    "check": 16384        # uncompressed bytes between compressed size checks
+}
+
+FIELDS = [
+    "policy",
+    "batches",
+    "transactions",
+    "uncompressed_size",
+    "compressed_size",
+    "calldata_gas",
+    "total_gas",
+    "gas_vs_original"
+]
+
+def parse_policy(spec: str) -> dict:
+    # "original" keeps the historical batch boundaries, anything else is
+    # "max_size=100000,max_blocks=10,group=to" style
+    if spec == "original":
+        return { "name": spec }
+    policy = { **POLICY_DEFAULTS, "name": spec }
+    for param in filter(None, spec.split(",")):
+        key, _, value = param.partition("=")
+        if key not in POLICY_DEFAULTS:
+            raise Exception(f"Unknown policy parameter: {key}, expected one of {list(POLICY_DEFAULTS)}")
+        policy[key] = value if key == "group" else int(value)
+    if policy["group"] not in GROUPS:
+        raise Exception(f"Unknown group: {policy['group']}, expected one of {GROUPS}")
+    return policy
+
+################################################################################
+# l2 messages
+################################################################################
+def rlp_item(data: bytes, pos: int) -> tuple:
+    # (start, end) of the payload of the rlp item at pos
+    b = data[pos]
+    if b < 0x80:
+        return pos, pos + 1
+    if b <= 0xb7:
+        return pos + 1, pos + 1 + b - 0x80
+    if b <= 0xbf:
+        n = b - 0xb7
+        start = pos + 1 + n
+        return start, start + int.from_bytes(data[pos + 1:start], "big")
+    if b <= 0xf7:
+        return pos + 1, pos + 1 + b - 0xc0
+    n = b - 0xf7
+    start = pos + 1 + n
+    return start, start + int.from_bytes(data[pos + 1:start], "big")
+
+def message_key(tx: bytes, group: str):
+    # An l2 transaction is a 0x03 batch of rlp length prefixed messages. The
+    # first one is usually a compressed signed transaction (0x07 0xff) with rlp
+    # nonce, gas price, gas limit, recipient and value, followed by the raw
+    # calldata and signature. The sender would need signature recovery, so
+    # recipient and selector are the grouping keys.
+    try:
+        if tx[0] != 0x03:
+            return None
+        pos = rlp_item(tx, 1)[1]
+        if tx[pos] != 0x07 or tx[pos + 1] != 0xff:
+            return None
+        pos += 2
+        for _ in range(3):
+            pos = rlp_item(tx, pos)[1]
+        to_start, to_end = rlp_item(tx, pos)
+        if group == "to":
+            return bytes(tx[to_start:to_end])
+        if group == "selector":
+            pos = rlp_item(tx, to_end)[1]
+            return bytes(tx[pos:pos + 4])
+        return None
+    except IndexError:
+        return None
+
+################################################################################
+# repacking
+################################################################################
+def batch_boundaries(blocks: np.ndarray, origins: np.ndarray, keys: list, policy: dict):
+    # returns the transaction order and the set of positions where a new
+    # batch must start regardless of size
+    if policy["name"] == "original":
+        starts = np.flatnonzero(np.diff(origins)) + 1
+        return list(range(len(origins))), set(starts.tolist())
+    windows = (blocks - blocks[0]) // policy["max_blocks"] if policy["max_blocks"] else np.zeros(len(blocks), dtype=np.int64)
+    order = list(range(len(blocks)))
+    if policy["group"] != "none":
+        # reorder inside each time window only, ungrouped messages go last
+        order.sort(key=lambda k: (windows[k], keys[k] is None, keys[k] or b""))
+    ordered_windows = windows[order]
+    starts = np.flatnonzero(np.diff(ordered_windows)) + 1
+    return order, set(starts.tolist())
+
+def compress_range(transactions: list, order: list, start: int, end: int, flushes: set, compressor) -> bytes:
+    # one batch of order[start:end], flushed after every position in flushes
+    stream = compressor.stream()
+    compressed = []
+    for position in range(start, end):
+        compressed.append(stream.process(transactions[order[position]]))
+        if position + 1 in flushes:
+            compressed.append(stream.flush())
+    return b"".join(compressed) + stream.finish()
+
+def capped_end(transactions: list, order: list, start: int, end: int, flushes: set, max_compressed: int, compressor) -> tuple:
+    # The batch of order[start:end] went over max_compressed after its last
+    # flush that fit. It is replayed up to that flush, then flushed after every
+    # transaction to find the last one that still fits, and rebuilt to end
+    # there. Returns the batch and the position the next one starts at. A lone
+    # transaction larger than the cap still gets a batch of its own.
+    last_fit = max(flushes, default=start)
+    stream = compressor.stream()
+    compressed_size = 0
+    for position in range(start, last_fit):
+        compressed_size += len(stream.process(transactions[order[position]]))
+        if position + 1 in flushes:
+            compressed_size += len(stream.flush())
+    fit = last_fit
+    for position in range(last_fit, end):
+        compressed_size += len(stream.process(transactions[order[position]])) + len(stream.flush())
+        if compressed_size > max_compressed:
+            break
+        fit = position + 1
+    fit = max(fit, start + 1)
+    flushes = flushes | set(range(last_fit + 1, fit + 1))
+    output = compress_range(transactions, order, start, fit, flushes, compressor)
+    # finishing the stream adds a few bytes of its own
+    while len(output) > max_compressed and fit > start + 1:
+        fit -= 1
+        output = compress_range(transactions, order, start, fit, flushes, compressor)
+    return output, fit
+
+def repack(transactions: list, blocks: np.ndarray, origins: np.ndarray, policy: dict, compressor) -> dict:
+    # Transactions are fed to one streaming compressor per rebuilt batch, so
+    # every byte is compressed once. Without a compressed size cap the stream
+    # is never flushed and matches one-shot compression of the batch. With a
+    # cap, the stream is flushed every `check` bytes to observe its size, and
+    # a batch that goes over is cut back to the last transaction that fits,
+    # so no capped batch is ever posted above the cap.
+    keys = [message_key(tx, policy.get("group", "none")) for tx in transactions]
+    order, forced = batch_boundaries(blocks, origins, keys, policy)
+    max_size = policy.get("max_size", 0)
+    max_compressed = policy.get("max_compressed", 0)
+    check = policy.get("check", 0)
+
+    outputs = []
+    position = 0
+    while position < len(order):
+        start = position
+        stream = compressor.stream()
+        size = 0
+        compressed = []
+        compressed_size = 0
+        since_check = 0
+        # positions after which the stream was flushed and still fit the cap
+        flushes = set()
+        while position < len(order):
+            tx = transactions[order[position]]
+            if position > start and (position in forced or (max_size and size + len(tx) > max_size)):
+                break
+            compressed.append(stream.process(tx))
+            compressed_size += len(compressed[-1])
+            size += len(tx)
+            since_check += len(tx)
+            position += 1
+            if max_compressed and since_check >= check:
+                # flushing is what makes the running compressed size observable
+                compressed.append(stream.flush())
+                compressed_size += len(compressed[-1])
+                since_check = 0
+                if compressed_size > max_compressed:
+                    break
+                flushes.add(position)
+        output = b"".join(compressed) + stream.finish()
+        if max_compressed and len(output) > max_compressed:
+            output, position = capped_end(transactions, order, start, position, flushes, max_compressed, compressor)
+        outputs.append(output)
+
+    _, _, sizes, costs = compute_l1_costs(outputs)
+    return {
+        "batches": len(outputs),
+        "transactions": len(transactions),
+        "uncompressed_size": sum(len(tx) for tx in transactions),
+        "compressed_size": int(sizes.sum()),
+        "calldata_gas": int(costs.sum())
+    }
+
+store = None
+compressor = None
+policies = None
+
+def open_repack(store_dir: str, batch_compressor, repack_policies: list):
+    global store, compressor, policies
+    store = BatchStore(store_dir)
+    compressor = batch_compressor
+    policies = repack_policies
+
+def repack_segment(batch_ids: list) -> list:
+    # pools the l2 transactions of consecutive batches, each one tagged with
+    # its original batch and that batch's l1 block as its arrival time
+    transactions = []
+    blocks = []
+    origins = []
+    for i in batch_ids:
+        l2_transactions = store.l2_transactions(i)
+        transactions += l2_transactions
+        blocks += [int(store.block[i])] * len(l2_transactions)
+        origins += [i] * len(l2_transactions)
+    blocks = np.array(blocks, dtype=np.int64)
+    origins = np.array(origins, dtype=np.int64)
+    return [repack(transactions, blocks, origins, policy, compressor) for policy in policies]
+
+if __name__ == "__main__":
+    import os
+    import time
+    import argparse
+    from compressors import parse_compressor
+    from pipeline import (
+        bounded_imap_unordered,
+        default_workers
+    )
+
+    parser = argparse.ArgumentParser(description="Rebuild historical batches under different batching policies")
+    parser.add_argument("--policy", action="append", type=parse_policy, default=None,
+        help="'original' or comma separated key=value pairs of "
+            f"{', '.join(POLICY_DEFAULTS)}, repeat for more policies")
+    parser.add_argument("--compressor", type=parse_compressor, default="brotli",
+        help="streaming compressor and parameters (brotli, zlib or zstd)")
+    parser.add_argument("--segment", type=int, default=64,
+        help="consecutive historical batches pooled together")
+    parser.add_argument("--overhead", type=int, default=BATCH_OVERHEAD_GAS,
+        help="fixed l1 gas per posted batch")
+    parser.add_argument("--output", default="../data/repack",
+        help="directory for the policy summary")
+    parser.add_argument("--window", type=int, default=64,
+        help="maximum number of segments in flight")
+    args = parser.parse_args()
+    repack_policies = args.policy or [parse_policy(spec) for spec in [
+        "original",
+        "max_size=131072",
+        "max_blocks=10",
+        "max_blocks=10,group=to",
+        "max_blocks=10,group=selector"
+    ]]
+    # the baseline is always run, once and first
+    repack_policies = [parse_policy("original")] + [p for p in repack_policies if p["name"] != "original"]
+    os.makedirs(args.output, exist_ok=True)
+
+    start = time.perf_counter()
+    open_repack(STORE_DIR, args.compressor, repack_policies)
+    batch_ids = store.nonempty().tolist()
+    segments = [batch_ids[k:k + args.segment] for k in range(0, len(batch_ids), args.segment)]
+
+    n = default_workers()
+    print(f"Repacking {len(batch_ids)} batches in {len(segments)} segments under "
+        f"{len(repack_policies)} policies with {n} processes")
+    summed = FIELDS[1:-2]
+    totals = [{ "policy": policy["name"], **dict.fromkeys(summed, 0) } for policy in repack_policies]
+    with Pool(n, initializer=open_repack, initargs=(STORE_DIR, args.compressor, repack_policies)) as p:
+        for results in bounded_imap_unordered(p, repack_segment, segments, args.window):
+            for total, result in zip(totals, results):
+                for field in summed:
+                    total[field] += result[field]
+
+    for total in totals:
+        total["total_gas"] = total["calldata_gas"] + total["batches"] * args.overhead
+        total["gas_vs_original"] = total["total_gas"] / max(totals[0]["total_gas"], 1)
+    with open(f"{args.output}/_summary.csv", "w+", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(totals)
+    for total in totals:
+        print(f"{total['policy']}: {total['batches']} batches, {total['total_gas']} gas "
+            f"({total['gas_vs_original']:.2%} of original)")
+
+    elapsed = time.perf_counter() - start
+    print(f"Total time to repack: {elapsed:.2f} seconds or {elapsed/60.0:.2f} minutes")
@@ -0,0 +1,114 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+
+CACHE_PATH = "../data/cache/results.sqlite"
+MAX_BYTES = 512 * 1024 * 1024
+# bump when analyze_calldata's accounting changes so stale results are ignored
+CACHE_VERSION = 1
+
+def cache_config(compressor, dictionary_compressor=None) -> str:
+    # compressor labels include every parameter and the dictionary digest
+    config = compressor.label
+    if dictionary_compressor is not None:
+        config += f"|{dictionary_compressor.label}"
+    return config
+
+def cache_key(tx_hash: str, config: str) -> str:
+    return hashlib.sha256(f"{CACHE_VERSION}|{tx_hash}|{config}".encode("utf-8")).hexdigest()
+
+################################################################################
+# persistent result cache
+################################################################################
+class ResultCache:
+    # only the parent process touches the cache: it filters out hits before
+    # dispatching work and stores fresh results as they come back
+    def __init__(self, path: str=CACHE_PATH, max_bytes: int=MAX_BYTES):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+
+    def get_many(self, tx_hashes: list, config: str) -> dict:
+        keys = { cache_key(tx_hash, config): tx_hash for tx_hash in tx_hashes }
+        found = {}
+        key_list = list(keys)
+        # stay below sqlite's limit on bound parameters
+        for k in range(0, len(key_list), 500):
+            chunk = key_list[k:k + 500]
+            rows = self.db.execute(
+                f"SELECT key, value FROM results WHERE key IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            for key, value in rows:
+                found[keys[key]] = json.loads(value)
+            now = time.time()
+            self.db.executemany(
+                "UPDATE results SET last_used = ? WHERE key = ?", [(now, key) for key, _ in rows]
+            )
+        self.db.commit()
+        self.hits += len(found)
+        self.misses += len(tx_hashes) - len(found)
+        return found
+
+    def get(self, tx_hash: str, config: str):
+        return self.get_many([tx_hash], config).get(tx_hash)
+
+    def put_many(self, items: list, config: str):
+        # items are (tx_hash, result) pairs
+        now = time.time()
+        rows = []
+        for tx_hash, result in items:
+            value = json.dumps(result)
+            rows.append((cache_key(tx_hash, config), value, len(value), now))
+        self.db.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", rows)
+        self.db.commit()
+        self.stored += len(rows)
+
+    def put(self, tx_hash: str, config: str, result: dict):
+        self.put_many([(tx_hash, result)], config)
+
+    def size(self) -> int:
+        return self.db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+    def evict(self) -> int:
+        # drop least recently used results until the cache fits in max_bytes
+        excess = self.size() - self.max_bytes
+        if excess <= 0:
+            return 0
+        evicted = 0
+        freed = 0
+        rows = self.db.execute("SELECT key, size FROM results ORDER BY last_used")
+        keys = []
+        for key, size in rows:
+            if freed >= excess:
+                break
+            keys.append((key,))
+            freed += size
+            evicted += 1
+        self.db.executemany("DELETE FROM results WHERE key = ?", keys)
+        self.db.commit()
+        return evicted
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
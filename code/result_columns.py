@@ -0,0 +1,149 @@
+import os
+import json
+import shutil
+import numpy as np
+
+COLUMNS_DIR = "columns"
+SCHEMA_FILE = "schema.json"
+# every result row starts with where the batch came from
+KEY_COLUMNS = {
+    "batch_index": "int64",
+    "block": "uint64"
+}
+
+def column_dtype(value) -> str:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise Exception(f"Results can only hold numbers, got {type(value).__name__}")
+    return "int64" if isinstance(value, int) else "float64"
+
+################################################################################
+# appendable result columns
+################################################################################
+class ResultColumnsWriter:
+    # One raw little endian file per column, appended in chunks. schema.json
+    # holds the column types and the number of complete rows and is replaced
+    # after every flush, so an interrupted run leaves a readable prefix.
+    def __init__(self, path: str, truncate: bool=False, flush_every: int=1024):
+        if truncate and os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.flush_every = flush_every
+        self.schema = None
+        self.rows = 0
+        self.buffer = []
+        if os.path.exists(f"{path}/{SCHEMA_FILE}"):
+            with open(f"{path}/{SCHEMA_FILE}", "r") as f:
+                self.schema = json.load(f)
+            self.rows = self.schema["rows"]
+            # drop any partial chunk written after the last schema update
+            for name, dtype in self.schema["columns"].items():
+                with open(f"{path}/{name}.bin", "ab") as f:
+                    f.truncate(self.rows * np.dtype(dtype).itemsize)
+
+    def append(self, batch_index: int, block: int, result: dict):
+        if self.schema is None:
+            columns = { **KEY_COLUMNS, **{ name: column_dtype(value) for name, value in result.items() } }
+            self.schema = { "columns": columns, "rows": 0 }
+        if len(result) + len(KEY_COLUMNS) != len(self.schema["columns"]):
+            raise Exception(f"Result fields {sorted(result)} don't match the columns in {self.path}")
+        self.buffer.append({ "batch_index": batch_index, "block": block, **result })
+        if len(self.buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        for name, dtype in self.schema["columns"].items():
+            with open(f"{self.path}/{name}.bin", "ab") as f:
+                np.array([row[name] for row in self.buffer], dtype=np.dtype(dtype).newbyteorder("<")).tofile(f)
+        self.rows += len(self.buffer)
+        self.buffer = []
+        self._write_schema()
+
+    def truncate_batches(self, batch_index: int) -> int:
+        # Drops the rows of batch_index and every later batch, which have to be
+        # the last rows written, as they are when follow.py rolls back a reorg.
+        # The schema shrinks first, so an interruption can't expose stale rows.
+        self.flush()
+        if not self.rows:
+            return 0
+        batch_indexes = np.fromfile(f"{self.path}/batch_index.bin", dtype="<i8", count=self.rows)
+        keep = int(np.count_nonzero(batch_indexes < batch_index))
+        if (batch_indexes[:keep] >= batch_index).any():
+            raise Exception(f"Rows from batch {batch_index} on are not the last rows in {self.path}")
+        dropped = self.rows - keep
+        if dropped:
+            self.rows = keep
+            self._write_schema()
+            for name, dtype in self.schema["columns"].items():
+                with open(f"{self.path}/{name}.bin", "ab") as f:
+                    f.truncate(self.rows * np.dtype(dtype).itemsize)
+        return dropped
+
+    def keep_batches(self, batch_indexes: set) -> int:
+        # Drops the rows of every batch not in batch_indexes, wherever they
+        # are, so a resumed streaming run can match its columns to its jsonl.
+        # Each column is rewritten to a temporary file and replaced, then the
+        # schema, so this isn't atomic across columns, but it only runs when a
+        # resumed run starts.
+        self.flush()
+        if not self.rows:
+            return 0
+        recorded = np.fromfile(f"{self.path}/batch_index.bin", dtype="<i8", count=self.rows)
+        keep = np.isin(recorded, np.fromiter(batch_indexes, dtype=np.int64, count=len(batch_indexes)))
+        dropped = self.rows - int(np.count_nonzero(keep))
+        if dropped:
+            for name, dtype in self.schema["columns"].items():
+                path = f"{self.path}/{name}.bin"
+                values = np.fromfile(path, dtype=np.dtype(dtype).newbyteorder("<"), count=self.rows)
+                values[keep].tofile(f"{path}.tmp")
+                os.replace(f"{path}.tmp", path)
+            self.rows -= dropped
+            self._write_schema()
+        return dropped
+
+    def _write_schema(self):
+        with open(f"{self.path}/{SCHEMA_FILE}.tmp", "w+") as f:
+            json.dump({ **self.schema, "rows": self.rows }, f, indent=2)
+        os.replace(f"{self.path}/{SCHEMA_FILE}.tmp", f"{self.path}/{SCHEMA_FILE}")
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class ResultColumns:
+    # memory maps every column, only the rows recorded in schema.json are visible
+    def __init__(self, path: str):
+        with open(f"{path}/{SCHEMA_FILE}", "r") as f:
+            self.schema = json.load(f)
+        self.path = path
+        self.rows = self.schema["rows"]
+        self.columns = {}
+        for name, dtype in self.schema["columns"].items():
+            dtype = np.dtype(dtype).newbyteorder("<")
+            if self.rows:
+                self.columns[name] = np.memmap(f"{path}/{name}.bin", dtype=dtype, mode="r", shape=(self.rows,))
+            else:
+                self.columns[name] = np.zeros(0, dtype=dtype)
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    def names(self) -> list:
+        return list(self.columns)
+
+    def batch_order(self) -> np.ndarray:
+        # streaming runs append in completion order
+        return np.argsort(self.columns["batch_index"], kind="stable")
+
+def has_columns(results_dir: str) -> bool:
+    return os.path.exists(f"{results_dir}/{COLUMNS_DIR}/{SCHEMA_FILE}")
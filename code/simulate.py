@@ -1,93 +1,305 @@
 from multiprocessing import Pool
-import brotli
-from utils import decode_by_function_selector
+from calldata_cost import compute_l1_costs
+from compressors import get_compressor
+from dictionary import dictionary_gain
+from profiling import stage
+from batch_store import (
+    BatchStore,
+    STORE_DIR
+)
 
-def count_zeros(calldata: bytes):
-    total = len(calldata)
-    num = 0
-    for i in range(total):
-        if calldata[i] == 0:
-            num += 1
-    return (num, total - num, total)
-
-def compute_l1_cost(n_zeros, n_nonzeros):
-    return (4 * n_zeros) + (16 * n_nonzeros)
-
-def analyze_calldata(calldata_tuple: bytes, compressed: bool=False):
+def analyze_calldata(calldata_tuple: tuple, compressor=None, dictionary_compressor=None):
     calldata = calldata_tuple[0]
     fname = calldata_tuple[1]
-    n_zeros, n_nonzeros, size = count_zeros(calldata)
-    cost = compute_l1_cost(n_zeros, n_nonzeros)
-    if not compressed:
-        compressed_n_zeros, compressed_size, compressed_cost = analyze_calldata(
-            (brotli.compress(calldata), fname), compressed=True
-        )
-        compression_ratio = size / compressed_size
-        cost_ratio = cost / compressed_cost
-        return (fname, {
-            "compressed_n_zeros": compressed_n_zeros,
-            "compressed_size": compressed_size,
-            "compressed_cost": compressed_cost,
-            "uncompressed_n_zeros": n_zeros,
-            "uncompressed_size": size,
-            "uncompressed_cost": cost,
-            "compression_ratio": compression_ratio,
-            "cost_ratio": cost_ratio,
-            "space_saving": 1 - 1 / compression_ratio,
-            "gas_saving": 1 - 1 / cost_ratio
-        })
-    else:
-        return (n_zeros, size, cost)
+    if compressor is None:
+        compressor = get_compressor("brotli")
+    with stage("compress", len(calldata)):
+        outputs = [calldata, compressor.compress(calldata)]
+    if dictionary_compressor is not None:
+        with stage("dictionary_compress", len(calldata)):
+            outputs.append(dictionary_compressor.compress(calldata))
+    with stage("count_zeros", sum(len(output) for output in outputs)):
+        n_zeros, _, sizes, costs = compute_l1_costs(outputs)
+    n_zeros, compressed_n_zeros = n_zeros.tolist()[:2]
+    size, compressed_size = sizes.tolist()[:2]
+    cost, compressed_cost = costs.tolist()[:2]
+    compression_ratio = size / compressed_size
+    cost_ratio = cost / compressed_cost
+    result = {
+        "compressed_n_zeros": compressed_n_zeros,
+        "compressed_size": compressed_size,
+        "compressed_cost": compressed_cost,
+        "uncompressed_n_zeros": n_zeros,
+        "uncompressed_size": size,
+        "uncompressed_cost": cost,
+        "compression_ratio": compression_ratio,
+        "cost_ratio": cost_ratio,
+        "space_saving": 1 - 1 / compression_ratio,
+        "gas_saving": 1 - 1 / cost_ratio
+    }
+    if dictionary_compressor is not None:
+        result.update(dictionary_gain(result, int(sizes[2]), int(costs[2])))
+    return (fname, result)
+
+store = None
+compressor = None
+dictionary_compressor = None
+
+def open_store(store_dir: str, batch_compressor=None, batch_dictionary_compressor=None):
+    # each worker maps the store itself so only batch ids cross process boundaries
+    global store, compressor, dictionary_compressor
+    store = BatchStore(store_dir)
+    compressor = batch_compressor
+    dictionary_compressor = batch_dictionary_compressor
+
+def simulate_batch(i: int):
+    with stage("task"):
+        return analyze_calldata((store.transactions(i), store.name(i)), compressor, dictionary_compressor)
+
+def simulate_batches(batch_ids: list) -> list:
+    return [simulate_batch(i) for i in batch_ids]
 
 if __name__ == "__main__":
     import os
     import json
-    import codecs
     import time
+    import argparse
+    from collections import deque
+    from compressors import (
+        parse_compressor,
+        available_compressors
+    )
+    from dictionary import load_dictionary
+    from result_cache import (
+        ResultCache,
+        cache_config,
+        CACHE_PATH
+    )
+    from multiprocessing.pool import ThreadPool
+    from pipeline import (
+        imap_chunks,
+        JsonLinesWriter,
+        read_json_lines,
+        rewrite_json_lines,
+        default_workers,
+        size_aware_chunks
+    )
+    from aggregates import (
+        Aggregates,
+        AGGREGATES_FILE,
+        BLOCK_RANGE,
+        rebuild_aggregates
+    )
+    from result_columns import (
+        ResultColumns,
+        ResultColumnsWriter,
+        COLUMNS_DIR,
+        has_columns
+    )
+    import profiling
 
-    start = time.perf_counter()
-
-    batch_files = os.listdir("../data/transactions")
-    if ".gitignore" in batch_files:
-        batch_files.pop(batch_files.index(".gitignore"))
+    parser = argparse.ArgumentParser(description="Simulate compression of sequencer batches")
+    parser.add_argument("--stream", action="store_true",
+        help="append results to _total_results.jsonl as batches complete instead of collecting them in memory")
+    parser.add_argument("--window", type=int, default=None,
+        help="maximum number of tasks in flight in streaming mode, each a size-aware chunk of up to 256 batches (default: two per worker)")
+    parser.add_argument("--workers", type=int, default=default_workers(),
+        help="compression processes, one less than the available cores by default")
+    parser.add_argument("--writers", type=int, default=8,
+        help="threads writing per-batch json files")
+    parser.add_argument("--compressor", type=parse_compressor, default="brotli",
+        help=f"compressor and parameters, e.g. brotli:quality=5 ({', '.join(available_compressors())})")
+    parser.add_argument("--output", default="../data/resultsV2",
+        help="directory for per-batch and total results")
+    parser.add_argument("--dictionary", default=None,
+        help="also compress with this dictionary (see dictionary.py) and report the gain per batch")
+    parser.add_argument("--cache", default=CACHE_PATH,
+        help="result cache keyed by transaction hash and compressor configuration")
+    parser.add_argument("--cache-size", type=int, default=512,
+        help="cache size limit in MiB, least recently used results are evicted")
+    parser.add_argument("--no-cache", action="store_true",
+        help="recompress every batch and leave the cache untouched")
+    parser.add_argument("--block-range", type=int, default=BLOCK_RANGE,
+        help="l1 blocks per rollup in _aggregates.json")
+    parser.add_argument("--format", choices=["columns", "json", "both"], default="columns",
+        help="typed result columns (see result_columns.py), per-batch json files plus total results, or both")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profile = profiling.settings_from_args("simulate", args)
+    batch_dictionary_compressor = None
+    if args.dictionary:
+        batch_dictionary_compressor = args.compressor.with_dictionary(load_dictionary(args.dictionary))
+    worker_init = (profile, open_store, (STORE_DIR, args.compressor, batch_dictionary_compressor))
 
-    print(f"Preparing {len(batch_files)} batches")
+    start = time.perf_counter()
 
-    n = 11
-    def prepare_batch(batch_file):
-        with open(f"../data/transactions/{batch_file}", "r") as f:
-            batch = json.load(f)
-        decoded_calldata = decode_by_function_selector(batch["input"])
-        transactions = decoded_calldata["transactions"]
-        if len(transactions):
-            return (transactions, batch_file)
-        else:
-            print(f"Skipping a batch with zero transactions: {batch_file}")
-            return None
+    os.makedirs(args.output, exist_ok=True)
+    open_store(STORE_DIR)
+    batch_ids = store.nonempty().tolist()
+    if len(batch_ids) < len(store):
+        print(f"Skipping {len(store) - len(batch_ids)} batches with zero transactions")
 
+    n = args.workers
+    window = args.window or 2 * n
+    write_json = args.format in ("json", "both")
+    write_columns = args.format in ("columns", "both")
     def record_results(results_tuple):
         fname, result = results_tuple
-        with open(f"../data/resultsV2/{fname}", "w+") as f:
+        with open(f"{args.output}/{fname}", "w+") as f:
             json.dump(result, f, indent=2)
 
-    print(f"Preparing batch data using {n} processes")
-    with Pool(n) as p:
-        calldatas = p.map(prepare_batch, batch_files)
-    for calldata in calldatas[::-1]:
-        if calldata is None:
-            calldatas.pop(calldatas.index(calldata))
+    aggregates_path = f"{args.output}/{AGGREGATES_FILE}"
+    aggregates = Aggregates(args.block_range)
+    columns_path = f"{args.output}/{COLUMNS_DIR}"
+    if args.stream:
+        total_results = f"{args.output}/_total_results.jsonl"
+        # Results are appended, so a rerun picks up where the last one stopped.
+        # The jsonl gets every result at once but the columns only every flush,
+        # so a batch counts as done only when every format this run writes has
+        # it, and anything just one of them holds is dropped and redone.
+        recorded = []
+        if write_columns:
+            recorded.append(set(ResultColumns(columns_path)["batch_index"].tolist()) if has_columns(args.output) else set())
+        json_lines = []
+        if write_json and os.path.exists(total_results):
+            json_lines = [int(r["batch"].split("_", 1)[0]) for r in read_json_lines(total_results)]
+        if write_json:
+            recorded.append(set(json_lines))
+        done = set.intersection(*recorded)
+        if write_columns and has_columns(args.output):
+            with ResultColumnsWriter(columns_path) as columns:
+                columns.keep_batches(done)
+        if len(json_lines) != len(done):
+            kept = set()
+            def keep(r: dict) -> bool:
+                index = int(r["batch"].split("_", 1)[0])
+                if index not in done or index in kept:
+                    return False
+                kept.add(index)
+                return True
+            rewrite_json_lines(total_results, keep)
+        if done:
+            batch_ids = [i for i in batch_ids if int(store.batch_index[i]) not in done]
+            print(f"Resuming: {len(done)} batches already recorded in {args.output}")
+            # the aggregates already cover those batches and only grow from here,
+            # unless an interrupted run recorded results after its last save
+            if os.path.exists(aggregates_path):
+                aggregates = Aggregates.load(aggregates_path)
+            if aggregates.batches != len(done):
+                aggregates = rebuild_aggregates(args.output, args.block_range, "columns" if write_columns else "json")
+    index_of = { store.name(i): i for i in batch_ids }
+
+    def record_row(columns, fname: str, result: dict):
+        i = index_of[fname]
+        if columns is not None:
+            with stage("write_columns"):
+                columns.append(int(store.batch_index[i]), int(store.block[i]), result)
+        with stage("aggregate"):
+            aggregates.add(result, int(store.block[i]))
 
-    print(f"Beginning simulations with {n} processes")
-    with Pool(n) as p:
-        results = p.map(analyze_calldata, calldatas)
+    # only (batch, config) pairs missing from the cache are compressed again
+    cache = None if args.no_cache else ResultCache(args.cache, args.cache_size * 1024 * 1024)
+    config = cache_config(args.compressor, batch_dictionary_compressor)
+    cached = {}
+    if cache is not None:
+        with stage("cache_lookup"):
+            hits = cache.get_many([store.tx_hash(i) for i in batch_ids], config)
+        cached = { i: (store.name(i), hits[store.tx_hash(i)]) for i in batch_ids if store.tx_hash(i) in hits }
+    fresh_ids = [i for i in batch_ids if i not in cached]
+    tx_hashes = { store.name(i): store.tx_hash(i) for i in fresh_ids }
+    print(f"{len(cached)} cached results, {len(fresh_ids)} batches to compress")
+    # compression time follows batch size, so the largest batches go first
+    chunks = size_aware_chunks(fresh_ids, store.size[fresh_ids].tolist(), n)
 
-    print(f"Recording results using {n*10} processes")
-    with Pool(n*10) as p:
-        p.map(record_results, results)
+    if args.stream:
+        print(f"Streaming {config} simulations of {len(fresh_ids)} batches with {n} processes in {len(chunks)} tasks, {window} in flight")
+        out = JsonLinesWriter(total_results) if write_json else None
+        columns = ResultColumnsWriter(columns_path) if write_columns else None
+        writes = ThreadPool(args.writers) if write_json else None
+        pending_writes = deque()
+        with Pool(n, initializer=profiling.init_worker, initargs=worker_init) as p, stage("pool"):
+            def record(fname: str, result: dict):
+                if write_json:
+                    with stage("write_json"):
+                        pending_writes.append(writes.apply_async(record_results, ((fname, result),)))
+                        # waiting on the oldest write keeps a slow disk from
+                        # queueing every result, and raises its errors
+                        while len(pending_writes) > 4 * args.writers:
+                            pending_writes.popleft().get()
+                        out.write({ "batch": fname, **result })
+                record_row(columns, fname, result)
+
+            for fname, result in cached.values():
+                record(fname, result)
+            uncached = []
+            for fname, result in imap_chunks(p, simulate_batches, chunks, window):
+                record(fname, result)
+                uncached.append((tx_hashes[fname], result))
+                if len(uncached) >= 256:
+                    if cache is not None:
+                        cache.put_many(uncached, config)
+                    if columns is not None:
+                        columns.flush()
+                    aggregates.save(aggregates_path)
+                    uncached = []
+            if cache is not None:
+                cache.put_many(uncached, config)
+            # workers only write their profiles on a clean exit
+            p.close()
+            p.join()
+        if writes is not None:
+            for pending in pending_writes:
+                pending.get()
+            writes.close()
+            writes.join()
+        for writer in (out, columns):
+            if writer is not None:
+                writer.close()
+        aggregates.save(aggregates_path)
+        print(f"Recorded {len(cached) + len(fresh_ids)} results in {args.output}")
+    else:
+        print(f"Beginning {config} simulations of {len(fresh_ids)} batches with {n} processes in {len(chunks)} tasks")
+        with Pool(n, initializer=profiling.init_worker, initargs=worker_init) as p, stage("pool"):
+            fresh = dict(result for results in p.imap_unordered(simulate_batches, chunks) for result in results)
+            p.close()
+            p.join()
+        if cache is not None:
+            cache.put_many([(tx_hashes[fname], result) for fname, result in fresh.items()], config)
+        results = [cached[i] if i in cached else (store.name(i), fresh[store.name(i)]) for i in batch_ids]
 
-    print("Recording completed. Writing total results")
-    with open("../data/resultsV2/_total_results.json", "w+") as f:
-        json.dump(results, f, indent=2)
+        if write_json:
+            # writing files waits on the disk, not the cpu, so threads do
+            print(f"Recording results using {args.writers} threads")
+            with ThreadPool(args.writers) as p, stage("write_json"):
+                p.map(record_results, results)
+
+            print("Recording completed. Writing total results")
+            with open(f"{args.output}/_total_results.json", "w+") as f, stage("write_json"):
+                json.dump(results, f, indent=2)
+        if write_columns:
+            # a full run replaces the columns, in batch order
+            with ResultColumnsWriter(columns_path, truncate=True) as columns:
+                for fname, result in results:
+                    record_row(columns, fname, result)
+        else:
+            for fname, result in results:
+                record_row(None, fname, result)
+        aggregates.save(aggregates_path)
+
+    if cache is not None:
+        evicted = cache.evict()
+        print(f"Cache: {cache.hits} hits, {cache.stored} fresh results stored, {evicted} evicted")
+        cache.close()
 
     elapsed = time.perf_counter() - start
-    print(f"Total time to simulate: {elapsed:.2f} seconds or {elapsed/60.0:.2f} minutes")
\ No newline at end of file
+    print(f"Total time to simulate: {elapsed:.2f} seconds or {elapsed/60.0:.2f} minutes")
+    if profile is not None:
+        report = profiling.finish_run({
+            "compressor": config,
+            "batches": len(batch_ids),
+            "cached": len(cached),
+            "processes": n,
+            "tasks": len(chunks),
+            "stream": args.stream
+        })
+        print(f"Profile written to {report}")
@@ -1,90 +1,113 @@
 from multiprocessing import Pool
-import brotli
-from utils import decode_by_function_selector
+import json
+from calldata_cost import compute_l1_costs
+from compressors import get_compressor
+from dictionary import dictionary_gain
+from batch_store import (
+    BatchStore,
+    STORE_DIR
+)
 
-def count_zeros(calldata: bytes):
-    total = len(calldata)
-    num = 0
-    for i in range(total):
-        if calldata[i] == 0:
-            num += 1
-    return num, total - num, total
-
-def compute_l1_cost(n_zeros, n_nonzeros):
-    return (4 * n_zeros) + (16 * n_nonzeros)
-
-def analyze_calldata(calldata_tuple: bytes, compressed: bool=False):
+def analyze_calldata(calldata_tuple: tuple, compressor=None, dictionary_compressor=None):
     calldata = calldata_tuple[0]
     fname = calldata_tuple[1]
-    n_zeros, n_nonzeros, size = count_zeros(calldata)
-    cost = compute_l1_cost(n_zeros, n_nonzeros)
-    if not compressed:
-        compressed_n_zeros, compressed_size, compressed_cost = analyze_calldata(
-            (brotli.compress(calldata), fname), compressed=True
-        )
-        compression_ratio = size / compressed_size
-        cost_ratio = cost / compressed_cost
-        result = {
-            "compressed_n_zeros": compressed_n_zeros,
-            "compressed_size": compressed_size,
-            "compressed_cost": compressed_cost,
-            "uncompressed_n_zeros": n_zeros,
-            "uncompressed_size": size,
-            "uncompressed_cost": cost,
-            "compression_ratio": compression_ratio,
-            "cost_ratio": cost_ratio,
-            "space_saving": 1 - 1 / compression_ratio,
-            "gas_saving": 1 - 1 / cost_ratio
-        }
-        with open(f"../data/resultsV2/{fname}", "w+") as f:
-            json.dump(result, f, indent=2)
-        return result
-    else:
-        return n_zeros, size, cost
+    if compressor is None:
+        compressor = get_compressor("brotli")
+    outputs = [calldata, compressor.compress(calldata)]
+    if dictionary_compressor is not None:
+        outputs.append(dictionary_compressor.compress(calldata))
+    n_zeros, _, sizes, costs = compute_l1_costs(outputs)
+    n_zeros, compressed_n_zeros = n_zeros.tolist()[:2]
+    size, compressed_size = sizes.tolist()[:2]
+    cost, compressed_cost = costs.tolist()[:2]
+    compression_ratio = size / compressed_size
+    cost_ratio = cost / compressed_cost
+    result = {
+        "compressed_n_zeros": compressed_n_zeros,
+        "compressed_size": compressed_size,
+        "compressed_cost": compressed_cost,
+        "uncompressed_n_zeros": n_zeros,
+        "uncompressed_size": size,
+        "uncompressed_cost": cost,
+        "compression_ratio": compression_ratio,
+        "cost_ratio": cost_ratio,
+        "space_saving": 1 - 1 / compression_ratio,
+        "gas_saving": 1 - 1 / cost_ratio
+    }
+    if dictionary_compressor is not None:
+        result.update(dictionary_gain(result, int(sizes[2]), int(costs[2])))
+    with open(f"../data/resultsV2/{fname}", "w+") as f:
+        json.dump(result, f, indent=2)
+    return result
 
-if __name__ == "__main__":
-    import os
-    import json
-    import codecs
-    import time
+store = None
+compressor = None
+dictionary_compressor = None
 
-    start = time.perf_counter()
+def open_store(store_dir: str, batch_compressor=None, batch_dictionary_compressor=None):
+    # each worker maps the store itself so only batch ids cross process boundaries
+    global store, compressor, dictionary_compressor
+    store = BatchStore(store_dir)
+    compressor = batch_compressor
+    dictionary_compressor = batch_dictionary_compressor
 
-    batch_files = os.listdir("../data/transactions")
-    if ".gitignore" in batch_files:
-        batch_files.pop(batch_files.index(".gitignore"))
+def simulate_batch(i: int):
+    return analyze_calldata((store.transactions(i), store.name(i)), compressor, dictionary_compressor)
 
-    print(f"Preparing {len(batch_files)} batches")
+if __name__ == "__main__":
+    import time
+    from pipeline import default_workers
+    from result_cache import (
+        ResultCache,
+        cache_config
+    )
+    from aggregates import (
+        Aggregates,
+        AGGREGATES_FILE
+    )
+    from result_columns import (
+        ResultColumnsWriter,
+        COLUMNS_DIR
+    )
 
-    n = 11
-    print(f"Preparing batch data using {n} processes")
-    def prepare_batch(batch_file):
-        with open(f"../data/transactions/{batch_file}", "r") as f:
-            batch = json.load(f)
-        decoded_calldata = decode_by_function_selector(batch["input"])
-        transactions = decoded_calldata["transactions"]
-        if len(transactions):
-            return (transactions, batch_file)
-        else:
-            print(f"Skipping a batch with zero transactions: {batch_file}")
-            return None
+    start = time.perf_counter()
 
-    with Pool(n) as p:
-        calldatas = p.map(prepare_batch, batch_files)
+    open_store(STORE_DIR)
+    batch_ids = store.nonempty().tolist()
+    if len(batch_ids) < len(store):
+        print(f"Skipping {len(store) - len(batch_ids)} batches with zero transactions")
 
-    for calldata in calldatas[::-1]:
-        if calldata is None:
-            calldatas.pop(calldatas.index(calldata))
+    # batches already simulated with the same compressor come from the cache
+    cache = ResultCache()
+    config = cache_config(get_compressor("brotli"))
+    hits = cache.get_many([store.tx_hash(i) for i in batch_ids], config)
+    for i in batch_ids:
+        if store.tx_hash(i) in hits:
+            with open(f"../data/resultsV2/{store.name(i)}", "w+") as f:
+                json.dump(hits[store.tx_hash(i)], f, indent=2)
+    fresh_ids = [i for i in batch_ids if store.tx_hash(i) not in hits]
 
-    print(f"Beginning simulations with {n} processes")
+    n = default_workers()
+    print(f"Beginning simulations of {len(fresh_ids)} batches with {n} processes, {len(hits)} cached")
 
-    with Pool(n) as p:
-        results = p.map(analyze_calldata, calldatas)
+    with Pool(n, initializer=open_store, initargs=(STORE_DIR,)) as p:
+        fresh = p.map(simulate_batch, fresh_ids)
+    cache.put_many([(store.tx_hash(i), result) for i, result in zip(fresh_ids, fresh)], config)
+    print(f"Cache: {cache.hits} hits, {cache.stored} fresh results, {cache.evict()} evicted")
+    cache.close()
+    fresh = iter(fresh)
+    results = [hits[store.tx_hash(i)] if store.tx_hash(i) in hits else next(fresh) for i in batch_ids]
 
     print("Processing completed. Writing total results")
 
     with open("../data/resultsV2/_total_results.json", "w+") as f:
         json.dump(results, f, indent=2)
+    aggregates = Aggregates()
+    with ResultColumnsWriter(f"../data/resultsV2/{COLUMNS_DIR}", truncate=True) as columns:
+        for i, result in zip(batch_ids, results):
+            columns.append(int(store.batch_index[i]), int(store.block[i]), result)
+            aggregates.add(result, int(store.block[i]))
+    aggregates.save(f"../data/resultsV2/{AGGREGATES_FILE}")
 
     elapsed = time.perf_counter() - start
     print(f"Total time to simulate: {elapsed} seconds")
@@ -0,0 +1,142 @@
+from multiprocessing import Pool
+import csv
+import time
+import itertools
+import brotli
+from calldata_cost import compute_l1_costs
+from batch_store import (
+    BatchStore,
+    STORE_DIR
+)
+
+MODES = {
+    "generic": brotli.MODE_GENERIC,
+    "text": brotli.MODE_TEXT,
+    "font": brotli.MODE_FONT
+}
+
+FIELDS = [
+    "quality",
+    "lgwin",
+    "mode",
+    "uncompressed_size",
+    "uncompressed_cost",
+    "compressed_n_zeros",
+    "compressed_size",
+    "compressed_cost",
+    "compression_ratio",
+    "cost_ratio",
+    "compress_seconds",
+    "compress_mb_per_s"
+]
+
+def parameter_grid(qualities: list, lgwins: list, modes: list) -> list:
+    return [
+        { "quality": q, "lgwin": w, "mode": m }
+        for q, w, m in itertools.product(qualities, lgwins, modes)
+    ]
+
+def sweep_calldata(calldata: bytes, grid: list) -> list:
+    compressed = []
+    seconds = []
+    for params in grid:
+        start = time.perf_counter()
+        compressed.append(brotli.compress(
+            calldata, quality=params["quality"], lgwin=params["lgwin"], mode=MODES[params["mode"]]
+        ))
+        seconds.append(time.perf_counter() - start)
+
+    # cost the raw batch and every compressed output in one pass
+    n_zeros, _, sizes, costs = compute_l1_costs([calldata] + compressed)
+    n_zeros, sizes, costs = n_zeros.tolist(), sizes.tolist(), costs.tolist()
+    rows = []
+    for k, params in enumerate(grid):
+        rows.append({
+            **params,
+            "uncompressed_size": sizes[0],
+            "uncompressed_cost": costs[0],
+            "compressed_n_zeros": n_zeros[k + 1],
+            "compressed_size": sizes[k + 1],
+            "compressed_cost": costs[k + 1],
+            "compression_ratio": sizes[0] / sizes[k + 1],
+            "cost_ratio": costs[0] / costs[k + 1],
+            "compress_seconds": seconds[k],
+            "compress_mb_per_s": sizes[0] / seconds[k] / 1e6 if seconds[k] else float("inf")
+        })
+    return rows
+
+def write_table(path: str, rows: list):
+    with open(path, "w+", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+store = None
+grid = None
+
+def open_sweep(store_dir: str, sweep_grid: list):
+    global store, grid
+    store = BatchStore(store_dir)
+    grid = sweep_grid
+
+def sweep_batch(i: int):
+    # the batch is read from the store once and reused for every grid point
+    return store.name(i), sweep_calldata(store.transactions(i), grid)
+
+def parse_list(values: str, cast=int) -> list:
+    return [cast(v) for v in values.split(",")]
+
+if __name__ == "__main__":
+    import os
+    import argparse
+    from pipeline import (
+        bounded_imap_unordered,
+        default_workers
+    )
+
+    parser = argparse.ArgumentParser(description="Sweep brotli parameters over sequencer batches")
+    parser.add_argument("--quality", type=parse_list, default=list(range(12)),
+        help="comma separated brotli qualities (0-11)")
+    parser.add_argument("--lgwin", type=parse_list, default=[22],
+        help="comma separated base 2 log window sizes (10-24)")
+    parser.add_argument("--mode", type=lambda v: parse_list(v, str), default=["generic"],
+        help=f"comma separated brotli modes ({', '.join(MODES)})")
+    parser.add_argument("--output", default="../data/sweep",
+        help="directory for the per-batch result tables")
+    parser.add_argument("--window", type=int, default=256,
+        help="maximum number of batches in flight")
+    args = parser.parse_args()
+    for mode in args.mode:
+        if mode not in MODES:
+            parser.error(f"unknown brotli mode: {mode}")
+
+    start = time.perf_counter()
+    sweep_grid = parameter_grid(args.quality, args.lgwin, args.mode)
+    os.makedirs(args.output, exist_ok=True)
+
+    open_sweep(STORE_DIR, sweep_grid)
+    batch_ids = store.nonempty().tolist()
+
+    n = default_workers()
+    print(f"Sweeping {len(sweep_grid)} parameter sets over {len(batch_ids)} batches with {n} processes")
+    summed = ["uncompressed_size", "uncompressed_cost", "compressed_n_zeros",
+        "compressed_size", "compressed_cost", "compress_seconds"]
+    totals = { (p["quality"], p["lgwin"], p["mode"]): { **p, **dict.fromkeys(summed, 0) } for p in sweep_grid }
+    with Pool(n, initializer=open_sweep, initargs=(STORE_DIR, sweep_grid)) as p:
+        for fname, rows in bounded_imap_unordered(p, sweep_batch, batch_ids, args.window):
+            write_table(f"{args.output}/{fname[:-len('.json')]}.csv", rows)
+            for row in rows:
+                total = totals[(row["quality"], row["lgwin"], row["mode"])]
+                for field in summed:
+                    total[field] += row[field]
+
+    # corpus-wide totals per parameter set, in the same table layout
+    summary = list(totals.values())
+    for total in summary:
+        total["compression_ratio"] = total["uncompressed_size"] / max(total["compressed_size"], 1)
+        total["cost_ratio"] = total["uncompressed_cost"] / max(total["compressed_cost"], 1)
+        total["compress_mb_per_s"] = total["uncompressed_size"] / max(total["compress_seconds"], 1e-9) / 1e6
+    write_table(f"{args.output}/_summary.csv", summary)
+
+    elapsed = time.perf_counter() - start
+    print(f"Total time to sweep: {elapsed:.2f} seconds or {elapsed/60.0:.2f} minutes")
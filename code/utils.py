@@ -1,20 +1,31 @@
 import os
 import json
+import time
 import codecs
-import brotli
-import eth_abi
-import requests
-from Crypto.Hash import keccak
-from dotenv import (
-    load_dotenv,
-    find_dotenv
-)
+import random
+import asyncio
+import functools
+import numpy as np
+
+# brotli, eth_abi, aiohttp, requests, pycryptodome and dotenv are imported
+# where they are used, so the decoder and pool workers start without them
 
 ################################################################################
 # os
 ################################################################################
+@functools.lru_cache(maxsize=None)
+def load_env() -> str:
+    # find_dotenv walks up the directory tree, so it only runs once per process
+    from dotenv import (
+        load_dotenv,
+        find_dotenv
+    )
+    path = find_dotenv()
+    load_dotenv(path)
+    return path
+
 def get_env(key: str, raise_on_none: bool=False) -> str:
-    load_dotenv(find_dotenv())
+    load_env()
     value = os.environ.get(key)
     if value is None:
         if raise_on_none:
@@ -26,15 +37,18 @@ def get_env(key: str, raise_on_none: bool=False) -> str:
 # compression
 ################################################################################
 def compress_json(json_data: dict) -> bytes:
-    return brotli.compress(json.dumps(data).encode("utf-8"))
+    import brotli
+    return brotli.compress(json.dumps(json_data).encode("utf-8"))
 
 def decompress_json(compressed_data: bytes) -> dict:
+    import brotli
     return json.loads(brotli.decompress(compressed_data))
 
 ################################################################################
 # ethereum
 ################################################################################
 def keccak256(data: bytes) -> bytes:
+    from Crypto.Hash import keccak
     hasher = keccak.new(digest_bits=256)
     hasher.update(data)
     return hasher.digest()
@@ -46,40 +60,295 @@ def fn_selector(fn_sig: str) -> str:
     return "0x" + keccak256(fn_sig.encode("utf-8"))[0:4].hex()
 
 def decode_fn(calldata: str, arg_types: list, arg_fields: list):
+    import eth_abi
     decoded_tuple = eth_abi.decode_abi(
         arg_types, codecs.decode(calldata, "hex_codec")
     )
-    return { field:decoded_tuple(f) for (f, field) in enumerate(arg_fields) }
+    return { field:decoded_tuple[f] for (f, field) in enumerate(arg_fields) }
 
-def eth_request(provider_url: str, method: str, params: list):
-    return requests.post(provider_url, json={
-        "id": 0,
-        "jsonrpc": "2.0",
-        "method": method,
-        "params": params
-    }).json()
-
-def get_logs(provider_url: str, from_block: int, to_block: int, topic: str):
-    params = [{
+def log_filter(from_block: int, to_block: int, topic: str) -> dict:
+    return {
         "fromBlock": hex(from_block),
         "toBlock": hex(to_block),
         "topics": [topic]
-    }]
-    return eth_request(provider_url, "eth_getLogs", params)
+    }
+
+def eth_request(provider_url: str, method: str, params: list):
+    return shared_provider(provider_url).request(method, params)
+
+def get_logs(provider_url: str, from_block: int, to_block: int, topic: str):
+    return shared_provider(provider_url).get_logs(from_block, to_block, topic)
 
 def get_transaction_by_hash(provider_url: str, transaction_hash: str):
-    params = [transaction_hash]
-    return eth_request(provider_url, "eth_getTransactionByHash", params)
+    return shared_provider(provider_url).get_transaction_by_hash(transaction_hash)
+
+################################################################################
+# async json rpc
+################################################################################
+class RateLimiter:
+    # spaces requests evenly so at most `rate` start per second
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate else 0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            now = loop.time()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+class RetryableError(Exception):
+    pass
+
+def is_retryable(error: dict) -> bool:
+    # providers reuse -32005 for both rate limits and oversized queries, so only
+    # the message tells a rate limit apart from a request that will never succeed
+    message = str(error.get("message", "")).lower()
+    return error.get("code") in (429, -32603) or "rate limit" in message or "request rate" in message
+
+async def eth_batch_request(
+    session,
+    provider_url: str,
+    calls: list,
+    limiter: RateLimiter=None,
+    retries: int=5,
+    backoff: float=0.5
+) -> list:
+    # calls are (method, params) pairs, responses come back in the same order
+    import aiohttp
+    responses = [None] * len(calls)
+    pending = list(range(len(calls)))
+    for attempt in range(retries + 1):
+        if attempt:
+            await asyncio.sleep(backoff * 2 ** (attempt - 1) * (1 + random.random()))
+        if limiter is not None:
+            await limiter.acquire()
+        payload = [{
+            "id": k,
+            "jsonrpc": "2.0",
+            "method": calls[k][0],
+            "params": calls[k][1]
+        } for k in pending]
+        try:
+            async with session.post(provider_url, json=payload) as response:
+                if response.status == 429 or response.status >= 500:
+                    raise RetryableError(f"HTTP {response.status}")
+                body = await response.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, RetryableError):
+            if attempt == retries:
+                raise
+            continue
+        if not isinstance(body, list):
+            # a single error object means the provider rejected the whole batch
+            raise Exception(f"Batch request rejected: {body}")
+
+        retry = []
+        for item in body:
+            k = item.get("id")
+            if k not in pending:
+                continue
+            responses[k] = item
+            if item.get("error") is not None and is_retryable(item["error"]):
+                retry.append(k)
+        missing = [k for k in pending if responses[k] is None]
+        pending = sorted(retry + missing)
+        if not pending:
+            break
+    for k in range(len(calls)):
+        if responses[k] is None:
+            responses[k] = { "id": k, "jsonrpc": "2.0", "error": { "code": -32000, "message": "no response" } }
+    return responses
+
+class LatencyCounters:
+    def __init__(self):
+        self.methods = {}
+
+    def record(self, method: str, seconds: float, calls: int=1, errors: int=0):
+        counter = self.methods.setdefault(method, {
+            "requests": 0, "calls": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0
+        })
+        counter["requests"] += 1
+        counter["calls"] += calls
+        counter["errors"] += errors
+        counter["total_seconds"] += seconds
+        counter["max_seconds"] = max(counter["max_seconds"], seconds)
+
+    def summary(self) -> dict:
+        return { method: {
+            **counter,
+            "mean_ms": 1000 * counter["total_seconds"] / counter["requests"]
+        } for method, counter in self.methods.items() }
+
+def batch_method(calls: list) -> str:
+    methods = set(method for method, _ in calls)
+    return methods.pop() if len(methods) == 1 else "batch"
 
 class Provider:
-    def __init__(self, provider_url: str):
+    # one pooled keep-alive session per provider, with urllib3 retrying
+    # connection errors, 429s and 5xx responses with exponential backoff
+    def __init__(
+        self,
+        provider_url: str,
+        timeout: float=30,
+        retries: int=5,
+        backoff: float=0.5,
+        pool_size: int=16
+    ):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
         self.provider_url = provider_url
+        self.timeout = timeout
+        self.latency = LatencyCounters()
+        self.session = requests.Session()
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["POST"]
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _post(self, method: str, payload, calls: int):
+        start = time.perf_counter()
+        try:
+            response = self.session.post(self.provider_url, json=payload, timeout=self.timeout)
+            response.raise_for_status()
+            body = response.json()
+        except Exception:
+            self.latency.record(method, time.perf_counter() - start, calls, errors=calls)
+            raise
+        errors = sum(1 for r in (body if isinstance(body, list) else [body]) if r.get("error") is not None)
+        self.latency.record(method, time.perf_counter() - start, calls, errors)
+        return body
+
+    def request(self, method: str, params: list) -> dict:
+        return self._post(method, {
+            "id": 0,
+            "jsonrpc": "2.0",
+            "method": method,
+            "params": params
+        }, 1)
+
+    def batch(self, calls: list) -> list:
+        # calls are (method, params) pairs, responses come back in the same order
+        if not calls:
+            return []
+        body = self._post(batch_method(calls), [{
+            "id": k,
+            "jsonrpc": "2.0",
+            "method": method,
+            "params": params
+        } for k, (method, params) in enumerate(calls)], len(calls))
+        if not isinstance(body, list):
+            raise Exception(f"Batch request rejected: {body}")
+        by_id = { r.get("id"): r for r in body }
+        return [by_id.get(k, { "id": k, "jsonrpc": "2.0", "error": { "code": -32000, "message": "no response" } })
+            for k in range(len(calls))]
+
+    def block_number(self) -> int:
+        return int(self.request("eth_blockNumber", [])["result"], 16)
 
     def get_logs(self, from_block: int, to_block: int, topic: str):
-        return get_logs(self.provider_url, from_block, to_block, topic)
+        return self.request("eth_getLogs", [log_filter(from_block, to_block, topic)])
+
+    def get_logs_batch(self, block_ranges: list, topic: str) -> list:
+        return self.batch([("eth_getLogs", [log_filter(f, t, topic)]) for f, t in block_ranges])
 
     def get_transaction_by_hash(self, transaction_hash: str):
-        return get_transaction_by_hash(self.provider_url, transaction_hash)
+        return self.request("eth_getTransactionByHash", [transaction_hash])
+
+    def get_transactions_by_hash(self, transaction_hashes: list) -> list:
+        return self.batch([("eth_getTransactionByHash", [h]) for h in transaction_hashes])
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+_providers = {}
+
+def shared_provider(provider_url: str) -> Provider:
+    # the module level helpers reuse one pooled session per url and process
+    if provider_url not in _providers:
+        _providers[provider_url] = Provider(provider_url)
+    return _providers[provider_url]
+
+class AsyncProvider:
+    # asyncio variant sharing one aiohttp connection pool, with a request rate
+    # limit and eth_batch_request's retry and backoff
+    def __init__(
+        self,
+        provider_url: str,
+        timeout: float=120,
+        retries: int=5,
+        backoff: float=0.5,
+        parallel_requests: int=8,
+        requests_per_second: float=0
+    ):
+        self.provider_url = provider_url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.parallel_requests = parallel_requests
+        self.limiter = RateLimiter(requests_per_second)
+        self.latency = LatencyCounters()
+        self.session = None
+
+    async def __aenter__(self):
+        import aiohttp
+        connector = aiohttp.TCPConnector(limit=self.parallel_requests, ttl_dns_cache=300)
+        self.session = aiohttp.ClientSession(
+            connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    async def batch(self, calls: list) -> list:
+        start = time.perf_counter()
+        try:
+            responses = await eth_batch_request(
+                self.session, self.provider_url, calls, self.limiter, self.retries, self.backoff
+            )
+        except Exception:
+            self.latency.record(batch_method(calls), time.perf_counter() - start, len(calls), errors=len(calls))
+            raise
+        errors = sum(1 for r in responses if r.get("error") is not None)
+        self.latency.record(batch_method(calls), time.perf_counter() - start, len(calls), errors)
+        return responses
+
+    async def request(self, method: str, params: list) -> dict:
+        return (await self.batch([(method, params)]))[0]
+
+    async def block_number(self) -> int:
+        return int((await self.request("eth_blockNumber", []))["result"], 16)
+
+    async def get_logs(self, from_block: int, to_block: int, topic: str):
+        return await self.request("eth_getLogs", [log_filter(from_block, to_block, topic)])
+
+    async def get_logs_batch(self, block_ranges: list, topic: str) -> list:
+        return await self.batch([("eth_getLogs", [log_filter(f, t, topic)]) for f, t in block_ranges])
+
+    async def get_transaction_by_hash(self, transaction_hash: str):
+        return await self.request("eth_getTransactionByHash", [transaction_hash])
+
+    async def get_transactions_by_hash(self, transaction_hashes: list) -> list:
+        return await self.batch([("eth_getTransactionByHash", [h]) for h in transaction_hashes])
 
 ################################################################################
 # sequencer
@@ -99,10 +368,69 @@ arg_fields = [
     ["transactions", "lengths", "sectionsMetadata", "afterAcc"],
 ]
 
-decoders = { f"{fn_selector(signatures[i])}": lambda calldata: decode_fn(calldata, arg_types[i], arg_fields[i]) for i in range(len(signatures)) }
+# fn_selector of each signature, precomputed so importing utils hashes nothing
+selectors = [
+    "0x8a2df18d",
+    "0x44c7cc30"
+]
+
+def check_selectors():
+    for signature, selector in zip(signatures, selectors):
+        if fn_selector(signature) != selector:
+            raise Exception(f"Selector of {signature} is {fn_selector(signature)}, not {selector}")
+
+# generic eth_abi decoders, kept as the reference for decode_by_function_selector
+abi_decoders = { selectors[i]: lambda calldata, i=i: decode_fn(calldata, arg_types[i], arg_fields[i]) for i in range(len(signatures)) }
+
+# both layouts share the same head: offsets of the three dynamic arguments,
+# then afterAcc and, for the gas refunder variant, the refunder address
+sequencer_layouts = { bytes.fromhex(selectors[i][2:]): arg_fields[i] for i in range(len(signatures)) }
+
+def as_calldata(calldata) -> memoryview:
+    # hex strings are decoded once, bytes and mmaps are used in place
+    if isinstance(calldata, str):
+        calldata = bytes.fromhex(calldata[2:] if calldata.startswith("0x") else calldata)
+    return memoryview(calldata).cast("B")
+
+def read_word(args: memoryview, offset: int) -> int:
+    if offset + 32 > len(args):
+        raise Exception(f"Calldata too short: word at {offset} past {len(args)} bytes")
+    return int.from_bytes(args[offset:offset + 32], "big")
+
+def read_uint_array(args: memoryview, offset: int) -> np.ndarray:
+    # uint256[] as uint64, every element is checked to fit
+    n = read_word(args, offset)
+    if offset + 32 + 32 * n > len(args):
+        raise Exception(f"Calldata too short: uint256[{n}] at {offset} past {len(args)} bytes")
+    words = np.frombuffer(args, dtype=">u8", count=4 * n, offset=offset + 32).reshape(n, 4)
+    if words[:, :3].any():
+        raise Exception(f"uint256[] at {offset} has values that don't fit in 64 bits")
+    return words[:, 3].astype(np.uint64)
+
+def read_uint_list(args: memoryview, offset: int) -> list:
+    # uint256[] as python ints, for short arrays with full width values
+    n = read_word(args, offset)
+    return [read_word(args, offset + 32 * (k + 1)) for k in range(n)]
 
-def decode_by_function_selector(calldata: str):
-    selector = calldata[0:10]
-    if decoders.get(selector) is None:
-        raise Exception(f"Unrecognized function selector: {selector}")
-    return decoders[selector](calldata[10:])
\ No newline at end of file
+def decode_by_function_selector(calldata) -> dict:
+    # Reads the head offsets of addSequencerL2BatchFromOrigin* directly instead
+    # of going through eth_abi. transactions is a zero copy view into the input
+    # and lengths is a uint64 array.
+    data = as_calldata(calldata)
+    fields = sequencer_layouts.get(bytes(data[:4]))
+    if fields is None:
+        raise Exception(f"Unrecognized function selector: 0x{bytes(data[:4]).hex()}")
+    args = data[4:]
+    transactions_offset = read_word(args, 0)
+    n = read_word(args, transactions_offset)
+    if transactions_offset + 32 + n > len(args):
+        raise Exception(f"Calldata too short: {n} transaction bytes at {transactions_offset} past {len(args)} bytes")
+    decoded = {
+        "transactions": args[transactions_offset + 32:transactions_offset + 32 + n],
+        "lengths": read_uint_array(args, read_word(args, 32)),
+        "sectionsMetadata": read_uint_list(args, read_word(args, 64)),
+        "afterAcc": bytes(args[96:128])
+    }
+    if "gasRefunder" in fields:
+        decoded["gasRefunder"] = "0x" + bytes(args[140:160]).hex()
+    return decoded